@@ -20,11 +20,14 @@ setup(
     install_requires=dependencies,
     extras_require={
         'test': ['pytest'],
+        'validation': ['jsonschema'],
+        'speedups': ['orjson'],
+        'zstd': ['zstandard'],
     },
     packages=["twyla.kubedeploy"],
     entry_points={
         'console_scripts': [
-            'kubedeploy = twyla.kubedeploy:cli'
+            'kubedeploy = twyla.kubedeploy.client:main'
         ]
     },
     url="https://bitbucket.org/twyla/twyla.kubedeploy",
@@ -0,0 +1,187 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple
+
+import docker
+
+from twyla.kubedeploy import docker_helpers, serialization
+from twyla.kubedeploy.kube import Kube
+from twyla.kubedeploy.kubectl import Kubectl, KubectlCallFailed
+from twyla.kubedeploy.monorepo import Service
+from twyla.kubedeploy.prompt import carry_output
+
+
+STATUS_DEPLOYED = 'deployed'
+STATUS_DRY = 'dry run'
+STATUS_IMAGE_MISSING = 'image missing'
+STATUS_FAILED = 'failed'
+
+
+class BatchResult(NamedTuple):
+    name: str
+    tag: str
+    status: str
+    message: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (STATUS_DEPLOYED, STATUS_DRY)
+
+
+def load_services(file_name: str) -> List[Service]:
+    '''
+    load_services reads a YAML list of services. Every entry takes the same
+    keys as kubedeploy.yml and an optional path of the service directory.
+    '''
+    with open(file_name) as fd:
+        entries = serialization.load_yaml(fd) or []
+
+    services = []
+    for entry in entries:
+        entry = dict(entry)
+        path = entry.pop('path', '.')
+        services.append(Service(path=path, config=entry))
+
+    return services
+
+
+class BatchDeploy:
+    '''
+    BatchDeploy deploys several services sharing one registry session, one
+    docker client, and one Kubectl per namespace. Builds and the whole per
+    service pipeline run concurrently with separate limits.
+    '''
+    def __init__(self,
+                 registry: str,
+                 version: str,
+                 printer: Callable[[str], int],
+                 error_printer: Callable[[str], int],
+                 prepare_build: Callable[[str], None],
+                 local: bool=False,
+                 dry: bool=False,
+                 jobs: int=4,
+                 build_jobs: int=1):
+        self.registry = registry
+        self.version = version
+        self.printer = printer
+        self.error_printer = error_printer
+        self.prepare_build = prepare_build
+        self.local = local
+        self.dry = dry
+        self.jobs = jobs
+        self.session = docker_helpers.RegistrySession()
+        self.build_slots = threading.BoundedSemaphore(build_jobs)
+        # Downloading requirements runs pip which is not thread safe.
+        self.prepare_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.kubectls = {}
+        self.docker_client = None
+
+
+    def kubectl(self, namespace: str) -> Kubectl:
+        with self.lock:
+            if namespace not in self.kubectls:
+                kubectl = Kubectl()
+                kubectl.namespace = namespace
+                self.kubectls[namespace] = kubectl
+            return self.kubectls[namespace]
+
+
+    def docker(self):
+        with self.lock:
+            if self.docker_client is None:
+                self.docker_client = docker.from_env(version='1.24')
+            return self.docker_client
+
+
+    def service_printer(self, name: str, printer: Callable[[str], int]):
+        return lambda msg: printer('[{}] {}'.format(name, msg))
+
+
+    def build(self, service: Service, tag: str):
+        with self.build_slots:
+            with self.prepare_lock:
+                self.prepare_build(service.path)
+            client = self.docker()
+            docker_helpers.docker_image('build', tag, path=service.path,
+                                        client=client)
+            docker_helpers.docker_image('push', tag, client=client)
+
+
+    def deploy_service(self, service: Service) -> BatchResult:
+        # The deployment is named after the image just like in deploy.
+        # Services without an image are reported by their path.
+        image = service.config.get('image') or service.path
+        tag = ''
+        try:
+            if not service.config.get('image'):
+                raise ValueError('No image configured for {}'.format(
+                    service.path))
+            registry = service.config.get('registry', self.registry)
+            namespace = service.config.get('namespace', 'default')
+            variants = service.config.get('variants')
+            if isinstance(variants, str):
+                variants = [v.strip() for v in variants.split(',')]
+
+            version = self.version or docker_helpers.context_hash(
+                service.path)
+            tag = docker_helpers.make_tag(registry, image, version)
+
+            # Like deploy --local, rebuild unless the version is a content
+            # hash and the image for it exists already.
+            content_versioned = self.version is None
+            if self.local and not self.dry and not (
+                    content_versioned and self.session.image_exists(tag)):
+                self.build(service, tag)
+
+            if not self.session.image_exists(tag):
+                return BatchResult(image, tag, STATUS_IMAGE_MISSING)
+
+            if self.dry:
+                return BatchResult(image, tag, STATUS_DRY)
+
+            template = os.path.relpath(
+                os.path.join(service.path, 'deployment.yml'))
+            kube = Kube(namespace=namespace,
+                        deployment_name=image,
+                        printer=self.service_printer(image, self.printer),
+                        error_printer=self.service_printer(
+                            image, self.error_printer),
+                        deployment_template=template,
+                        variants=variants,
+                        kubectl=self.kubectl(namespace))
+            kube.apply(tag)
+        except KubectlCallFailed as e:
+            return BatchResult(image, tag, STATUS_FAILED,
+                               e.args[0].decode('utf8').strip())
+        except Exception as e:
+            # A failing service must not abort the others in the batch.
+            return BatchResult(image, tag, STATUS_FAILED, str(e))
+
+        return BatchResult(image, tag, STATUS_DEPLOYED)
+
+
+    def run(self, services: List[Service]) -> List[BatchResult]:
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            return list(executor.map(carry_output(self.deploy_service),
+                                     services))
+
+
+def print_results(results: List[BatchResult],
+                  printer: Callable[[str], int],
+                  error_printer: Callable[[str], int]):
+    name_width = max([len(r.name) for r in results] + [len('NAME')])
+    tag_width = max([len(r.tag) for r in results] + [len('TAG')])
+    row = '{:<%d}  {:<%d}  {}' % (name_width, tag_width)
+
+    printer(row.format('NAME', 'TAG', 'STATUS'))
+    for result in results:
+        status = result.status
+        if result.message:
+            status = '{}: {}'.format(status, result.message)
+        line = row.format(result.name, result.tag, status)
+        if result.ok:
+            printer(line)
+        else:
+            error_printer(line)
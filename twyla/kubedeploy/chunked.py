@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, NamedTuple
+
+from twyla.kubedeploy import serialization
+from twyla.kubedeploy.kubectl import Kubectl, KubectlCallFailed
+from twyla.kubedeploy.prompt import carry_output
+from twyla.kubedeploy.ratelimit import TokenBucket
+
+
+class ChunkResult(NamedTuple):
+    index: int
+    size: int
+    lines: List[str]
+    errors: List[str]
+    message: str = ''
+
+    @property
+    def ok(self) -> bool:
+        return not self.message
+
+
+def chunk_list(kube_list: dict, size: int) -> List[dict]:
+    '''
+    chunk_list partitions a Kubernetes List into Lists of at most size
+    items. A List that fits into one chunk is returned as it is.
+    '''
+    items = kube_list.get('items') or []
+    if size < 1 or len(items) <= size:
+        return [kube_list]
+
+    return [dict(kube_list, items=items[start:start + size])
+            for start in range(0, len(items), size)]
+
+
+class ChunkedApply:
+    '''
+    ChunkedApply applies the chunks of a List concurrently with up to jobs
+    kubectl processes. Every applied object counts against a shared limit of
+    qps objects per second. Output is collected per chunk and reported in the
+    order of the List as soon as the chunks before are reported, and a
+    failing chunk does not stop the others. A List that fits into one chunk
+    is applied with a single kubectl call whose output is printed as it is
+    written.
+    '''
+    def __init__(self, kubectl: Kubectl, chunk_size: int=25, jobs: int=4,
+                 qps: float=None):
+        self.kubectl = kubectl
+        self.chunk_size = chunk_size
+        self.jobs = jobs
+        self.limiter = TokenBucket(qps=qps, burst=chunk_size)
+
+
+    def apply_chunk(self, index: int, chunk: dict) -> ChunkResult:
+        size = len(chunk.get('items') or [])
+        lines = []
+        errors = []
+        self.limiter.acquire(size)
+        try:
+            output = self.kubectl.apply_manifest(
+                serialization.dump_yaml(chunk), on_error=errors.append)
+            for line in output:
+                if line:
+                    lines.append(line)
+        except KubectlCallFailed as e:
+            return ChunkResult(index, size, lines, errors, failure_message(e))
+
+        return ChunkResult(index, size, lines, errors)
+
+
+    def results(self, chunks: List[dict]) -> Iterator[ChunkResult]:
+        '''
+        results applies chunks concurrently and yields their results in
+        order, each as soon as it and all chunks before it are done.
+        '''
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(carry_output(self.apply_chunk),
+                                       index, chunk)
+                       for index, chunk in enumerate(chunks)]
+            for future in futures:
+                yield future.result()
+
+
+    def stream(self, kube_list: dict, printer: Callable[[str], int],
+               error_printer: Callable[[str], int]) -> bool:
+        self.limiter.acquire(len(kube_list.get('items') or []))
+        try:
+            for line in self.kubectl.apply_manifest(
+                    serialization.dump_yaml(kube_list),
+                    on_error=error_printer):
+                printer(line)
+        except KubectlCallFailed as e:
+            error_printer(failure_message(e))
+            return False
+        return True
+
+
+    def run(self, kube_list: dict, printer: Callable[[str], int],
+            error_printer: Callable[[str], int]) -> bool:
+        '''
+        run applies kube_list, prints the output and returns whether all of
+        it was applied.
+        '''
+        chunks = chunk_list(kube_list, self.chunk_size)
+        if len(chunks) == 1:
+            return self.stream(kube_list, printer, error_printer)
+        return print_report(self.results(chunks), len(chunks), printer,
+                            error_printer)
+
+
+def failure_message(e: KubectlCallFailed) -> str:
+    message = e.args[0]
+    if isinstance(message, bytes):
+        message = message.decode('utf8').strip()
+    return message
+
+
+def print_report(results: Iterable[ChunkResult], total: int,
+                 printer: Callable[[str], int],
+                 error_printer: Callable[[str], int]) -> bool:
+    '''
+    print_report prints the output of every chunk under a header as the
+    results come in and returns whether all chunks were applied.
+    '''
+    first = 1
+    failed = 0
+    for result in results:
+        header = 'chunk {}/{}: items {}-{}'.format(
+            result.index + 1, total, first, first + result.size - 1)
+        if result.ok:
+            printer(header)
+        else:
+            error_printer(header)
+            failed += 1
+        first += result.size
+        for line in result.lines:
+            printer(line, 2)
+        for error in result.errors:
+            error_printer(error, 2)
+        if result.message:
+            error_printer(result.message, 2)
+
+    if failed:
+        error_printer('{} of {} chunks failed'.format(failed, total))
+    return not failed
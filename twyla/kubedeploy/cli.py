@@ -0,0 +1,845 @@
+import contextlib
+import functools
+import itertools
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+from typing import Iterable, List
+
+import click
+import git
+
+try:
+    # noinspection PyProtectedMember
+    from pip._internal import main as pip_main
+except ImportError:
+    # we are using pip 9.0.3 or earlier
+    from pip import main as pip_main
+
+from twyla.kubedeploy import (batch, chunked, client, cluster, daemon, delta,
+                              docker_helpers, model, monorepo, ratelimit,
+                              serialization, validation)
+from twyla.kubedeploy import watch as watch_module
+from twyla.kubedeploy.informer import CachedKubectl, Informer
+from twyla.kubedeploy.kube import Kube, variant_matrix
+from twyla.kubedeploy.kubectl import Kubectl, KubectlCallFailed
+from twyla.kubedeploy.pipeline import Pipeline
+from twyla.kubedeploy.prompt import error_prompt, prompt
+from twyla.kubedeploy.snapshot import (  # noqa: F401
+    CompressionUnavailable, open_snapshot, scrub_cluster_info, scrub_items,
+    write_list)
+
+
+# Constants equivalent to commonly used environment variables to configure
+# kubedeploy.
+CONFIG_FILE = 'kubedeploy.yml'
+KUBEDEPLOY_NAME = 'KUBEDEPLOY_NAME'
+KUBEDEPLOY_NAMESPACE = 'KUBEDEPLOY_NAMESPACE'
+KUBEDEPLOY_IMAGE = 'KUBEDEPLOY_IMAGE'
+KUBEDEPLOY_REGISTRY = 'KUBEDEPLOY_REGISTRY'
+KUBEDEPLOY_VARIANTS = 'KUBEDEPLOY_VARIANTS'
+KUBEDEPLOY_GROUP = 'KUBEDEPLOY_GROUP'
+KUBEDEPLOY_BRANCH = 'KUBEDEPLOY_BRANCH'
+KUBEDEPLOY_VERSION = 'KUBEDEPLOY_VERSION'
+KUBEDEPLOY_VERSIONING = 'KUBEDEPLOY_VERSIONING'
+KUBEDEPLOY_QPS = 'KUBEDEPLOY_QPS'
+KUBEDEPLOY_BURST = 'KUBEDEPLOY_BURST'
+KUBEDEPLOY_CACHE = 'KUBEDEPLOY_CACHE'
+KUBEDEPLOY_QUEUE = 'KUBEDEPLOY_QUEUE'
+
+# Image versions are either the short commit ID of the deployed git state or a
+# hash of the effective build context.
+VERSIONING_GIT = 'git'
+VERSIONING_CONTENT = 'content'
+
+
+def download_requirements(force: bool=False, path: str=None):
+    requirements = 'requirements.txt'
+    if path is not None:
+        requirements = os.path.join(path, requirements)
+    if not os.path.isfile(requirements):
+        return
+    # Create temporary directory as download target for requirements then
+    # download to this temporary directory and move it into the docker
+    # context. The docker context is the current directory that can not be
+    # used as initial destination as it itself is part of the requirements.txt
+    dest = os.path.join(path or os.getcwd(), 'pip-cache')
+
+    if os.path.isdir(dest):
+        if not force:
+            prompt('pip-cache exists. Skipping download of requirements.')
+            return
+
+        # Remove the existing pip-cache if any
+        prompt('pip-cache exists. Removing for fresh download of '
+               'requirements.')
+        shutil.rmtree(dest)
+
+    tmp = tempfile.mkdtemp()
+    prompt('Downloading requirements.')
+    with open(requirements) as f:
+        deps = [line for line in f if line.startswith('git+ssh')]
+    pip_main(['download', '-q', '--dest', tmp, *deps])
+    shutil.move(tmp, dest)
+
+
+# Set in long running processes so that every repository is opened once and
+# keeps its git processes, see daemon.py.
+_shared_repositories = None
+_shared_repositories_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def shared_repositories():
+    global _shared_repositories
+    _shared_repositories = {}
+    try:
+        yield _shared_repositories
+    finally:
+        for repo, _ in _shared_repositories.values():
+            repo.close()
+        _shared_repositories = None
+
+
+@contextlib.contextmanager
+def repository(working_directory: str):
+    '''
+    repository opens the git repository at working_directory, or reuses it
+    in a long running process. A shared repository is used by one thread at
+    a time.
+    '''
+    if _shared_repositories is None:
+        yield git.Repo(working_directory)
+        return
+
+    # Requests of the daemon come from different working directories.
+    path = os.path.abspath(working_directory or os.getcwd())
+    with _shared_repositories_lock:
+        if path not in _shared_repositories:
+            _shared_repositories[path] = (git.Repo(path), threading.Lock())
+        repo, lock = _shared_repositories[path]
+    with lock:
+        yield repo
+
+
+def head_of(working_directory: str,
+            branch: str=None, local: bool=False) -> str:
+    with repository(working_directory) as repo:
+        return head_of_repository(repo, branch, local)
+
+
+def head_of_repository(repo: git.Repo, branch: str=None,
+                       local: bool=False) -> str:
+    if branch is None:
+        try:
+            branch = repo.active_branch
+        # The type error gets thrown for example on detached HEAD states and
+        # during unfinished rebases and cherry-picks.
+        except TypeError as e:
+            error_prompt('No branch given and current status is inconclusive: '
+                         '{}'.format(str(e)))
+            sys.exit(1)
+
+    if local:
+        return repo.git.rev_parse(repo.head.commit, short=8)
+
+    prompt("Getting remote HEAD of {}".format(branch))
+
+    # Fetch all remotes (usually one?!) to make sure the latest refs are known
+    # to git. Save remote refs that match current branch to make sure to avoid
+    # ambiguities and bail out if a branch exists in multiple remotes with
+    # different HEADs.
+    remote_refs = []
+    for remote in repo.remotes:
+        remote.fetch()
+        for ref in remote.refs:
+            # Finding the remote tracking branch this way is a simplification
+            # already that assumes the remote tracking branches are of the
+            # format refs/remotes/foo/bar (indicating that it tracks a branch
+            # named bar in a remote named foo), and matches the right-hand-side
+            # of a configured fetch refspec. To actually do it correctly
+            # involves reading local git config and use `git remote show
+            # <remote-name>`. The main issue with that approach is it would
+            # involve porcelain commands as there are no plumbing commands
+            # available to get the remote tracking branches currently. Long
+            # story short: follow the conventions and this script will work.
+            if ref.name == '{remote}/{branch}'.format(remote=remote.name,
+                                                      branch=branch):
+                prompt('Found "{}" at {}'.format(ref.name,
+                                                 str(ref.commit)[:8]))
+                remote_refs.append(ref)
+
+    # Bail out if no remote tracking branches where found.
+    if len(remote_refs) < 1:
+        error_prompt('No remote tracking branch matching "{}" found'.format(
+            branch))
+        sys.exit(1)
+
+    # Iterate over found remote tracking branches and compare commit IDs; bail
+    # out if there is more than one and they differ.
+    if len(remote_refs) > 1:
+        seen = {}
+        for ref in remote_refs:
+            seen[repo.git.rev_parse(ref.name)] = True
+        if seen.keys() != 1:
+            error_prompt('Multiple matching remote tracking branches with'
+                         ' different commit IDs found. Can not go on. Make'
+                         ' sure requested deployments are unambiguous.')
+            sys.exit(1)
+
+    # At this point the head commit of the first remote tracking branch can be
+    # returned as it is the same as the others if they exist.
+    return repo.git.rev_parse(remote_refs[0].commit, short=8)
+
+
+def content_version(working_directory: str) -> str:
+    version = docker_helpers.context_hash(working_directory or os.getcwd())
+    prompt('Build context hashes to {}'.format(version))
+    return version
+
+
+def image_up_to_date(versioning: str, tag: str) -> bool:
+    # With content based versions an existing image is guaranteed to be built
+    # from the same inputs, so building and pushing it again can be skipped.
+    if versioning != VERSIONING_CONTENT:
+        return False
+    if not docker_helpers.docker_image_exists(tag):
+        return False
+
+    prompt('Image {} exists in the registry. Skipping.'.format(tag))
+    return True
+
+
+def validate_deployment(kube: Kube, tag: str) -> bool:
+    try:
+        validator = validation.ManifestValidator.for_cluster(kube.kubectl)
+    except validation.ValidationUnavailable as e:
+        prompt('Skipping validation: {}'.format(str(e)))
+        return True
+    except KubectlCallFailed as e:
+        error_prompt('Could not load the cluster schema: {}'.format(
+            kube.exception(e)))
+        return False
+
+    errors = kube.validate(tag, validator)
+    if not errors:
+        prompt('Manifests are valid for {}.'.format(validator.version))
+        return True
+
+    error_prompt('Manifests are invalid for {}:'.format(validator.version))
+    for error in errors:
+        error_prompt(error, 4)
+    return False
+
+
+def set_config(config_file):
+    # load config from file and set environment variables accordingly for use
+    # by click later on
+    config = {}
+    if os.path.isfile(config_file):
+        with open(config_file) as fd:
+            config = serialization.load_yaml(fd) or {}
+
+    for key, value in config.items():
+        if isinstance(value, list):
+            value = (','.join(value))
+        os.environ[f'KUBEDEPLOY_{key.upper()}'] = str(value)
+
+
+@click.group()
+@click.option('--qps', help='Maximum number of API requests per second.'
+              ' 0 disables the limit.', default=None, type=float)
+@click.option('--burst', help='Number of API requests allowed above the QPS'
+              ' limit in short bursts.', default=None, type=int)
+@click.pass_context
+def cli(ctx: click.Context, qps: float, burst: int):
+    set_config(CONFIG_FILE)
+    ctx.obj = {}
+
+    # The limits can only be read from the environment after the config file
+    # was loaded, so they do not use click's envvar support.
+    if qps is None:
+        qps = float(os.environ.get(KUBEDEPLOY_QPS, ratelimit.DEFAULT_QPS))
+    if burst is None:
+        burst = int(os.environ.get(KUBEDEPLOY_BURST, ratelimit.DEFAULT_BURST))
+    ratelimit.configure(qps=qps, burst=burst)
+
+
+@cli.command()
+@click.option('--registry', help='Docker registry name.',
+              envvar=KUBEDEPLOY_REGISTRY, required=True)
+@click.option('--image', help='Docker image name.',
+              envvar=KUBEDEPLOY_IMAGE, required=True)
+@click.option('--name', help='Name of the deployment.',
+              envvar=KUBEDEPLOY_NAME, required=True)
+@click.option('--namespace', help='The destination namespace in the cluster.',
+              envvar=KUBEDEPLOY_NAMESPACE, default='default')
+@click.option('--branch', help='The git branch to deploy. Defaults to master.',
+              envvar=KUBEDEPLOY_BRANCH, default='master')
+@click.option('--version', help='Version of API to build and deploy. Will'
+                                'replace if it already exists.',
+              envvar=KUBEDEPLOY_VERSION)
+@click.option('--variants', help='Variants are a comma separated list of '
+                                 'strings that can be used in template '
+                                 'conditionals.',
+              envvar=KUBEDEPLOY_VARIANTS)
+@click.option('--versioning', help='Derive the image version from the git'
+              ' commit (git) or from a hash of the build context (content).',
+              envvar=KUBEDEPLOY_VERSIONING, default=VERSIONING_GIT,
+              type=click.Choice([VERSIONING_GIT, VERSIONING_CONTENT]))
+@click.option('--dry/--no-dry', help='Run without building, pushing, and'
+              ' deploying anything',
+              default=False)
+@click.option('--validate/--no-validate', help='Validate the rendered'
+              ' manifests against the cached schema of the cluster before'
+              ' doing anything else. Always done on dry runs.',
+              default=False)
+@click.option('--local/--no-local', help='If set then the local state of the'
+              ' service will be used to create, push, and deploy a Docker'
+              ' image.',
+              default=False)
+@click.option('--profile/--no-profile', help='Print the duration of every'
+              ' phase and the critical path of the deployment.',
+              default=False)
+@click.option('--queue/--no-queue', help='Coalesce with other deploys of the'
+              ' same deployment: only the newest of the waiting deploys is'
+              ' applied, the others give up.',
+              envvar=KUBEDEPLOY_QUEUE, default=False)
+def deploy(registry: str, image: str, name: str, namespace: str, branch: str,
+           version: str, variants: str, versioning: str, local: bool,
+           dry: bool, validate: bool, profile: bool, queue: bool):
+    working_directory = os.getcwd()
+    if variants is not None:
+        variants = preprocess_variants(variants)
+
+    kube = Kube(namespace=namespace,
+                deployment_name=image,
+                printer=prompt,
+                error_printer=error_prompt,
+                variants=variants)
+
+    if local:
+        # Reset branch when using local.
+        branch = None
+
+    deploy_queue = None
+    # Nothing is superseded without a queue.
+    superseded = ()
+    if queue and not dry:
+        # The queue locks files with flock, which only POSIX systems have, so
+        # it is only imported when it is used.
+        from twyla.kubedeploy import coalesce
+        superseded = coalesce.Superseded
+        # The ticket is taken first so that deploys are ordered by the time
+        # they were started.
+        deploy_queue = coalesce.DeployQueue(kube.kubectl.current_context(),
+                                            namespace, name)
+        deploy_queue.take()
+
+    # The phases of a deployment run concurrently as far as their
+    # dependencies allow: the remote deployment is fetched while the version
+    # is resolved and the image is built and looked up in the registry.
+    def validate_phase(results):
+        # Validation only needs the template and the cached schema, so
+        # mistakes are found before spending time on git, builds, and the
+        # registry.
+        if not (dry or validate):
+            return
+        placeholder = docker_helpers.make_tag(registry, image,
+                                              version or 'latest')
+        if not validate_deployment(kube, placeholder):
+            sys.exit(1)
+
+    def version_phase(results):
+        if version is not None:
+            return docker_helpers.make_tag(registry, image, version)
+        if versioning == VERSIONING_CONTENT:
+            resolved = content_version(working_directory)
+        else:
+            resolved = head_of(working_directory, branch, local=local)
+        return docker_helpers.make_tag(registry, image, resolved)
+
+    def build_phase(results):
+        tag = results['version']
+        if deploy_queue is not None:
+            # No need to build an image that is not going to be deployed.
+            deploy_queue.check()
+        if local and not dry and not image_up_to_date(versioning, tag):
+            download_requirements()
+            docker_helpers.docker_image('build', tag)
+            docker_helpers.docker_image('push', tag)
+
+    def image_phase(results):
+        tag = results['version']
+        if not docker_helpers.docker_image_exists(tag):
+            error_prompt('Image not found: {}'.format(tag))
+            if not dry:
+                sys.exit(1)
+
+    def apply_phase(results):
+        if deploy_queue is None:
+            kube.apply(results['version'])
+            return
+        with deploy_queue.turn():
+            kube.apply(results['version'])
+
+    pipeline = Pipeline()
+    pipeline.add('validate', validate_phase)
+    pipeline.add('version', version_phase, requires=['validate'])
+    pipeline.add('info', lambda results: kube.info(), requires=['validate'])
+    pipeline.add('build', build_phase, requires=['version'])
+    pipeline.add('image', image_phase, requires=['build'])
+    if not dry:
+        pipeline.add('apply', apply_phase, requires=['image', 'info'])
+
+    try:
+        pipeline.run()
+    except superseded as e:
+        prompt(str(e))
+    finally:
+        if deploy_queue is not None:
+            deploy_queue.drop()
+        if profile:
+            pipeline.print_profile(prompt)
+
+    if dry:
+        prompt('Dry run finished. Not deploying.')
+
+
+@cli.command()
+@click.option('--branch', help='The git branch to deploy. Defaults to master.',
+              envvar=KUBEDEPLOY_BRANCH, default='master')
+@click.option('--local/--no-local', help='Compare against the local HEAD'
+              ' instead of the remote branch.',
+              default=False)
+@click.option('--names-only/--no-names-only', help='Only print the paths of'
+              ' changed services, one per line.',
+              default=False)
+def plan(branch: str, local: bool, names_only: bool):
+    # Find all services in the monorepo and compare the commit deployed for
+    # each of them with the target commit. Only services with changes in their
+    # directory need to be built and deployed.
+    working_directory = os.getcwd()
+    if local:
+        branch = None
+    target = head_of(working_directory, branch, local=local)
+
+    planned = monorepo.plan(working_directory, target, CONFIG_FILE)
+    changed = [p for p in planned if p.changed]
+    for entry in changed:
+        path = os.path.relpath(entry.service.path, working_directory)
+        if names_only:
+            click.echo(path)
+            continue
+        prompt(path)
+        if entry.deployed is None:
+            prompt('not deployed', 4)
+        else:
+            prompt('{} -> {}'.format(entry.deployed, target), 4)
+
+    if not names_only:
+        prompt('{} of {} services changed.'.format(len(changed),
+                                                   len(planned)))
+
+
+@cli.command(name='deploy-many')
+@click.option('--registry', help='Docker registry name.',
+              envvar=KUBEDEPLOY_REGISTRY, required=True)
+@click.option('--services', help='YAML file with a list of services to'
+              ' deploy. Defaults to all services found below the current'
+              ' directory.',
+              default=None)
+@click.option('--branch', help='The git branch to deploy. Defaults to master.',
+              envvar=KUBEDEPLOY_BRANCH, default='master')
+@click.option('--version', help='Version of all images to deploy.',
+              envvar=KUBEDEPLOY_VERSION)
+@click.option('--versioning', help='Derive the image version from the git'
+              ' commit (git) or from a hash of the build context (content).',
+              envvar=KUBEDEPLOY_VERSIONING, default=VERSIONING_GIT,
+              type=click.Choice([VERSIONING_GIT, VERSIONING_CONTENT]))
+@click.option('--jobs', help='Number of services deployed concurrently.',
+              default=4, type=int)
+@click.option('--build-jobs', help='Number of images built concurrently.',
+              default=1, type=int)
+@click.option('--dry/--no-dry', help='Run without building, pushing, and'
+              ' deploying anything',
+              default=False)
+@click.option('--local/--no-local', help='If set then the local state of the'
+              ' services will be used to create, push, and deploy Docker'
+              ' images.',
+              default=False)
+def deploy_many(registry: str, services: str, branch: str, version: str,
+                versioning: str, jobs: int, build_jobs: int, dry: bool,
+                local: bool):
+    working_directory = os.getcwd()
+    if services is None:
+        to_deploy = monorepo.find_services(working_directory, CONFIG_FILE)
+    else:
+        to_deploy = batch.load_services(services)
+
+    # All services share the git state, so it is only resolved once. Content
+    # hashes are computed per service.
+    if local:
+        branch = None
+    if version is None and versioning == VERSIONING_GIT:
+        version = head_of(working_directory, branch, local=local)
+
+    deployer = batch.BatchDeploy(registry=registry,
+                                 version=version,
+                                 printer=prompt,
+                                 error_printer=error_prompt,
+                                 prepare_build=lambda path:
+                                 download_requirements(path=path),
+                                 local=local,
+                                 dry=dry,
+                                 jobs=jobs,
+                                 build_jobs=build_jobs)
+    results = deployer.run(to_deploy)
+    batch.print_results(results, prompt, error_prompt)
+
+    if not all(result.ok for result in results):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--registry', help='Docker registry name.',
+              envvar=KUBEDEPLOY_REGISTRY, required=True)
+@click.option('--image', help='Docker image name.',
+              envvar=KUBEDEPLOY_IMAGE, required=True)
+@click.option('--namespace', help='The destination namespace in the cluster.',
+              envvar=KUBEDEPLOY_NAMESPACE, default='default')
+@click.option('--branch', help='The git branch to deploy. Defaults to master.',
+              envvar=KUBEDEPLOY_BRANCH, default='master')
+@click.option('--version', help='Version of the image to render.',
+              envvar=KUBEDEPLOY_VERSION)
+@click.option('--variant-matrix', 'matrix_spec', help='Comma separated'
+              ' dimensions of variants, each a list of alternatives separated'
+              ' by |. All combinations will be rendered.',
+              required=True)
+@click.option('--output-dir', help='Directory to write rendered manifests to.',
+              default='rendered')
+@click.option('--local/--no-local', help='Use the local git state to'
+              ' determine the version.',
+              default=False)
+def render(registry: str, image: str, namespace: str, branch: str,
+           version: str, matrix_spec: str, output_dir: str, local: bool):
+    if local:
+        branch = None
+    if version is None:
+        version = head_of(os.getcwd(), branch, local=local)
+
+    kube = Kube(namespace=namespace,
+                deployment_name=image,
+                printer=prompt,
+                error_printer=error_prompt)
+    tag = docker_helpers.make_tag(registry, image, version)
+    rendered = kube.render_matrix(tag, variant_matrix(matrix_spec))
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = {}
+    for variants, manifest in rendered:
+        label = '-'.join(variants) or 'default'
+        # Combinations that result in the same manifest are only written once.
+        if manifest in written:
+            prompt('{}: same as {}'.format(label, written[manifest]))
+            continue
+        file_name = os.path.join(output_dir,
+                                 'deployment-{}.yml'.format(label))
+        with open(file_name, mode='w') as fd:
+            fd.write(manifest)
+        written[manifest] = file_name
+        prompt('{}: {}'.format(label, file_name))
+
+
+@cli.command(name='update-schema')
+def update_schema():
+    # Fetch the OpenAPI schema of the cluster of the current context into the
+    # cache used for validating manifests.
+    kubectl = Kubectl()
+    try:
+        schema = validation.load_schema(kubectl, update=True)
+    except KubectlCallFailed as e:
+        error_prompt(e.args[0].decode('utf8').strip())
+        sys.exit(1)
+    prompt('Cached schema for {} ({} definitions).'.format(
+        schema['version'], len(schema['definitions'])))
+
+
+def preprocess_variants(variants: str) -> List[str]:
+    return [variant.strip() for variant in variants.split(',')]
+
+
+def split_values(values: str) -> List[str]:
+    return [value.strip() for value in values.split(',') if value.strip()]
+
+
+@cli.command()
+@click.option('--registry', help='Docker registry name.',
+              envvar=KUBEDEPLOY_REGISTRY, required=True)
+@click.option('--image', help='Docker image name.',
+              envvar=KUBEDEPLOY_IMAGE, required=True)
+@click.option('--version', help='Git commit ID or branch to build and deploy.'
+              ' Will replace if it already exists.', envvar=KUBEDEPLOY_VERSION,
+              default=None)
+@click.option('--versioning', help='Derive the image version from the git'
+              ' commit (git) or from a hash of the build context (content).',
+              envvar=KUBEDEPLOY_VERSIONING, default=VERSIONING_GIT,
+              type=click.Choice([VERSIONING_GIT, VERSIONING_CONTENT]))
+def build(registry: str, image: str, version: str, versioning: str):
+    if version is None:
+        if versioning == VERSIONING_CONTENT:
+            version = content_version(None)
+        else:
+            version = head_of(None, local=True)
+
+    tag = docker_helpers.make_tag(registry, image, version)
+    if image_up_to_date(versioning, tag):
+        return
+    download_requirements()
+    docker_helpers.docker_image('build', tag)
+
+
+@cli.command()
+@click.option('--registry', help='Docker registry name.',
+              envvar=KUBEDEPLOY_REGISTRY, required=True)
+@click.option('--image', help='Docker image name.',
+              envvar=KUBEDEPLOY_IMAGE, required=True)
+@click.option('--version', help='Git commit ID or branch to build and deploy.'
+              ' Will replace if it already exists.', envvar=KUBEDEPLOY_VERSION,
+              default=None)
+@click.option('--versioning', help='Derive the image version from the git'
+              ' commit (git) or from a hash of the build context (content).',
+              envvar=KUBEDEPLOY_VERSIONING, default=VERSIONING_GIT,
+              type=click.Choice([VERSIONING_GIT, VERSIONING_CONTENT]))
+def push(registry: str, image: str, version: str, versioning: str):
+    if version is None:
+        if versioning == VERSIONING_CONTENT:
+            version = content_version(None)
+        else:
+            version = head_of(None, local=True)
+
+    tag = docker_helpers.make_tag(registry, image, version)
+    if image_up_to_date(versioning, tag):
+        return
+    docker_helpers.docker_image('push', tag)
+
+
+@cli.command()
+@click.option('--name', help='Deployment name. Separate several names with'
+              ' commas.', envvar=KUBEDEPLOY_NAME)
+@click.option('--selector', help='Label selector of the deployments, e.g.'
+              ' "servicegroup=twyla".')
+@click.option('--namespace', help='Namespace in the cluster.',
+              envvar=KUBEDEPLOY_NAMESPACE, default='default')
+@click.option('--cache/--no-cache', help='Read deployments from the local'
+              ' cache of the cluster state.',
+              envvar=KUBEDEPLOY_CACHE, default=False)
+def info(name: str, selector: str, namespace: str, cache: bool):
+    names = split_values(name or '')
+    if not names and not selector:
+        error_prompt('Either --name or --selector is required.')
+        sys.exit(1)
+
+    kwargs = {}
+    if cache:
+        kwargs['kubectl'] = CachedKubectl()
+    kube = Kube(namespace=namespace,
+                deployment_name=names[0] if len(names) == 1 else None,
+                printer=prompt,
+                error_printer=error_prompt,
+                **kwargs)
+    if len(names) == 1 and not selector:
+        kube.info()
+    else:
+        # One list call for all of them.
+        kube.info_many(names=names, selectors=selector)
+
+
+@cli.command()
+@click.option('--namespace', help='Namespace in the cluster. Separate several'
+              ' namespaces with commas.',
+              envvar=KUBEDEPLOY_NAMESPACE, default='default')
+@click.option('--all-namespaces/--no-all-namespaces',
+              help='Select deployments in all namespaces.', default=False)
+@click.option('--group',
+              help='Value of the servicegroup selector to select by. Separate'
+              ' several values with commas.',
+              envvar=KUBEDEPLOY_GROUP, default='twyla')
+@click.option('--jobs', help='Number of namespaces listed concurrently.',
+              default=4, type=int)
+@click.option('--watch/--no-watch',
+              help='Keep watching and print deployments whose replica counts'
+              ' change.', default=False)
+@click.option('--dump-to',
+              help='Dump cluster info into kubectl compatible yaml file, '
+                   'compressed if it ends in .gz or .zst',
+              default=None)
+@click.option('--delta-from', multiple=True,
+              help='Dump only the changes against this snapshot. Repeat for '
+                   'a full snapshot followed by a chain of deltas.')
+@click.option('--cache/--no-cache', help='Read deployments from the local'
+              ' cache of the cluster state.',
+              envvar=KUBEDEPLOY_CACHE, default=False)
+def cluster_info(dump_to: str, group: str, namespace: str,
+                 all_namespaces: bool, jobs: int, watch: bool,
+                 delta_from: List[str], cache: bool):
+    if watch:
+        watch_cluster_info(split_values(namespace), split_values(group),
+                           all_namespaces)
+        return
+
+    # All namespaces share the informer so that each is synced once.
+    make_kubectl = (functools.partial(CachedKubectl, Informer())
+                    if cache else None)
+
+    by_namespace = cluster.list_deployments(split_values(namespace),
+                                            split_values(group),
+                                            all_namespaces=all_namespaces,
+                                            jobs=jobs,
+                                            make_kubectl=make_kubectl)
+    grouped = all_namespaces or len(by_namespace) > 1
+    # Without a dump only the summaries are needed and every item is released
+    # once it was parsed.
+    consume = dump_to is None
+    for name, items in by_namespace.items():
+        if grouped:
+            prompt(f'namespace: {name}')
+        print_cluster_info(model.summaries(items, consume=consume))
+
+    if dump_to is not None:
+        # The state is not needed anymore, so it is scrubbed in place and
+        # every item is written and released right away. Cached items are
+        # still held by the informer and must not be modified.
+        try:
+            base_index = None
+            if delta_from:
+                # Only the hashes of the previous state are kept around.
+                base = delta.load_chain(list(delta_from))
+                base_index = delta.make_index(base.get('items') or [])
+            with open_snapshot(dump_to, mode='w') as fd:
+                # The dump is grouped by namespace like the output.
+                items = itertools.chain.from_iterable(
+                    scrub_items(items, in_place=not cache)
+                    for items in by_namespace.values())
+                if base_index is None:
+                    write_list(fd, items)
+                else:
+                    changed = delta.write_delta(fd, base_index, items)
+                    prompt(f'{changed} new or changed deployments dumped.')
+        except (CompressionUnavailable, delta.DeltaMismatch) as e:
+            error_prompt(str(e))
+            sys.exit(1)
+
+
+def watch_cluster_info(namespaces: List[str], groups: List[str],
+                       all_namespaces: bool):
+    # One list per namespace, then only the changes from the watch streams.
+    def on_change(row: watch_module.Row, deleted: bool):
+        line = watch_module.format_row(row)
+        if deleted:
+            error_prompt(f'{row.namespace}/{row.name} deleted')
+        elif row.replicas == 0 or row.ready < row.replicas:
+            error_prompt(line)
+        else:
+            prompt(line)
+
+    watcher = watch_module.DeploymentWatch(namespaces, groups,
+                                           all_namespaces=all_namespaces)
+    try:
+        watcher.run(on_change)
+    except KeyboardInterrupt:
+        pass
+    except KubectlCallFailed as e:
+        error_prompt(e.args[0].decode('utf8').strip())
+        sys.exit(1)
+    finally:
+        # The streams of the watch keep running in a long running process
+        # otherwise, see daemon.py.
+        watcher.stop()
+
+
+def print_cluster_info(deployments: Iterable[model.Deployment]):
+    for deployment in deployments:
+        prompt(deployment.name)
+        for image in deployment.images:
+            prompt(image, 4)
+        if not deployment.has_status:
+            error_prompt('No replicas running.', 4)
+        else:
+            prompt(
+                (f'replicas: {deployment.replicas or 0} '
+                 f'ready: {deployment.ready} '
+                 f'updated: {deployment.updated}'), 4)
+
+
+@cli.command()
+@click.option('--from-file', multiple=True,
+              help='File containing a Kubernetes List of deployments. Repeat '
+                   'to apply a full snapshot followed by a chain of deltas.')
+@click.option('--chunk-size', help='Number of objects applied by one kubectl'
+              ' call.', default=25, type=int)
+@click.option('--jobs', help='Number of chunks applied concurrently.',
+              default=4, type=int)
+@click.option('--objects-per-second', help='Maximum number of objects'
+              ' applied per second. 0 disables the limit.', default=20.0,
+              type=float)
+@click.option('--cache/--no-cache', help='Read the replicas of the target'
+              ' cluster from the local cache of the cluster state.',
+              envvar=KUBEDEPLOY_CACHE, default=False)
+def apply(from_file: List[str], chunk_size: int, jobs: int,
+          objects_per_second: float, cache: bool):
+    # Load the deployments from file and get the current count of replicas in
+    # the target cluster for each of the deployments. Then update the replicas
+    # to match the target cluster and pass the result on to kubectl apply
+    # without touching the file.
+    # Compressed files are decompressed while they are parsed.
+    try:
+        kube_list = delta.load_chain(list(from_file))
+    except (CompressionUnavailable, delta.DeltaMismatch) as e:
+        error_prompt(str(e))
+        sys.exit(1)
+
+    kubectl = CachedKubectl() if cache else Kubectl()
+    kubectl.update_replicas(kube_list)
+
+    # Large Lists are applied in chunks by concurrent kubectl calls. The
+    # output is reported in the order of the List.
+    applier = chunked.ChunkedApply(kubectl, chunk_size=chunk_size, jobs=jobs,
+                                   qps=objects_per_second)
+    if not applier.run(kube_list, prompt, error_prompt):
+        sys.exit(1)
+
+
+@cli.command()
+@click.option('--socket', 'socket_path', help='Path of the Unix socket to'
+              ' listen on.', envvar=client.KUBEDEPLOY_SOCKET, default=None)
+def serve(socket_path: str):
+    # Keeps running and runs deploy, info and cluster-info for the kubedeploy
+    # command, which forwards them while the daemon is running.
+    server = daemon.Daemon(cli, path=socket_path)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    # Stopped by a service manager the socket is removed as well.
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        with shared_repositories():
+            server.serve(ready=lambda: prompt(
+                f'Listening on {server.path}. Press Ctrl-C to stop.'))
+    except daemon.DaemonRunning as e:
+        error_prompt(str(e))
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    cli(obj={})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+import json
+import os
+import socket
+import sys
+from typing import Dict, Iterator, List, Optional
+
+# The client forwards invocations to a running `kubedeploy serve`, see
+# daemon.py, and otherwise runs them in process. It only uses the standard
+# library, and the package __init__ is empty, so that forwarding does not pay
+# for the imports of the commands in cli.py.
+
+KUBEDEPLOY_SOCKET = 'KUBEDEPLOY_SOCKET'
+KUBEDEPLOY_NO_DAEMON = 'KUBEDEPLOY_NO_DAEMON'
+
+# Commands that are run by the daemon when it is running.
+FORWARDED_COMMANDS = ('deploy', 'info', 'cluster-info', 'cluster_info')
+# Options of the group that take a value and precede the command.
+GROUP_OPTIONS = ('--qps', '--burst')
+# Options that keep a command running until it is interrupted. The daemon
+# does not notice a client going away, so these always run in process.
+LOCAL_OPTIONS = ('--watch',)
+
+# The daemon uses the environment it was started with, apart from these.
+FORWARDED_ENV = ('KUBECONFIG',)
+FORWARDED_ENV_PREFIX = 'KUBEDEPLOY_'
+
+
+def socket_path() -> str:
+    if os.environ.get(KUBEDEPLOY_SOCKET):
+        return os.environ[KUBEDEPLOY_SOCKET]
+    directory = (os.environ.get('XDG_RUNTIME_DIR') or
+                 os.environ.get('XDG_CACHE_HOME') or
+                 os.path.expanduser('~/.cache'))
+    return os.path.join(directory, 'kubedeploy', 'kubedeploy.sock')
+
+
+def is_forwarded(key: str) -> bool:
+    return key in FORWARDED_ENV or key.startswith(FORWARDED_ENV_PREFIX)
+
+
+def forwarded_env(environ: Dict[str, str]) -> Dict[str, str]:
+    return {key: value for key, value in environ.items()
+            if is_forwarded(key)}
+
+
+def command_of(args: List[str]) -> Optional[str]:
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg in GROUP_OPTIONS:
+            skip = True
+        elif not arg.startswith('-'):
+            return arg
+    return None
+
+
+def is_forwardable(args: List[str]) -> bool:
+    return (command_of(args) in FORWARDED_COMMANDS and
+            not any(arg in LOCAL_OPTIONS for arg in args))
+
+
+def send(connection: socket.socket, message: dict):
+    connection.sendall(json.dumps(message).encode('utf8') + b'\n')
+
+
+def messages(connection: socket.socket) -> Iterator[dict]:
+    # Messages are JSON objects, one per line.
+    with connection.makefile('rb') as stream:
+        for line in stream:
+            yield json.loads(line.decode('utf8'))
+
+
+def connect(path: str) -> Optional[socket.socket]:
+    if not os.path.exists(path):
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError:
+        # A socket left behind by a daemon that is gone.
+        connection.close()
+        return None
+    return connection
+
+
+def forward(args: List[str], path: str=None) -> Optional[int]:
+    '''
+    forward runs args in the daemon and passes on its output. It returns the
+    exit code, or None if no daemon is running.
+    '''
+    connection = connect(path or socket_path())
+    if connection is None:
+        return None
+
+    with connection:
+        send(connection, {'args': args,
+                          'cwd': os.getcwd(),
+                          'env': forwarded_env(os.environ)})
+        for message in messages(connection):
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'exit' in message:
+                return message['exit']
+
+    sys.stderr.write('Lost the connection to the kubedeploy daemon.\n')
+    return 1
+
+
+def main():
+    args = sys.argv[1:]
+    if not os.environ.get(KUBEDEPLOY_NO_DAEMON) and is_forwardable(args):
+        code = forward(args)
+        if code is not None:
+            sys.exit(code)
+
+    from twyla.kubedeploy.cli import cli
+    cli(obj={})
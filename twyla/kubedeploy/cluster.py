@@ -0,0 +1,51 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from twyla.kubedeploy.kubectl import Kubectl
+from twyla.kubedeploy.prompt import carry_output
+
+
+def group_selector(groups: List[str]) -> Dict[str, object]:
+    # One group is selected by equality, several with a set based selector so
+    # that a single list call covers all of them.
+    if len(groups) == 1:
+        return {'servicegroup': groups[0]}
+    return {'servicegroup': list(groups)}
+
+
+def list_deployments(namespaces: List[str],
+                     groups: List[str],
+                     all_namespaces: bool=False,
+                     jobs: int=4,
+                     make_kubectl: Callable[[], Kubectl]=None
+                     ) -> 'OrderedDict[str, List[dict]]':
+    '''
+    list_deployments lists the deployments of all groups in every namespace
+    and returns them grouped by namespace. Namespaces are listed
+    concurrently with one call each, or with a single call across all
+    namespaces if all_namespaces is set.
+    '''
+    selectors = group_selector(groups)
+    make_kubectl = make_kubectl or Kubectl
+
+    if all_namespaces:
+        state = make_kubectl().list_deployments(selectors=selectors,
+                                                all_namespaces=True)
+        grouped = {}
+        for item in state['items']:
+            namespace = item['metadata'].get('namespace', 'default')
+            grouped.setdefault(namespace, []).append(item)
+        return OrderedDict(sorted(grouped.items()))
+
+    def list_namespace(namespace):
+        # Kubectl keeps the namespace as state, so every namespace gets its
+        # own instance.
+        kubectl = make_kubectl()
+        kubectl.namespace = namespace
+        return kubectl.list_deployments(selectors=selectors)['items']
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return OrderedDict(zip(namespaces,
+                               executor.map(carry_output(list_namespace),
+                                            namespaces)))
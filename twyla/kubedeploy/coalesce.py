@@ -0,0 +1,145 @@
+import contextlib
+import fcntl
+import os
+import threading
+import time
+import urllib.parse
+from typing import Callable, List, Optional
+
+from twyla.kubedeploy.kube import CACHE_DIR
+
+QUEUE_DIR = os.path.join(CACHE_DIR, 'queue')
+TICKET = '.ticket'
+TURN = 'turn.lock'
+
+
+class Superseded(Exception):
+    pass
+
+
+def now_ns() -> int:
+    # time.time_ns is only available from Python 3.7 on.
+    return int(time.time() * 1e9)
+
+
+def try_lock(fd: int) -> bool:
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class DeployQueue:
+    '''
+    DeployQueue coalesces deploys of the same deployment. Every deploy takes
+    a ticket when it starts, and tickets are ordered by the time they were
+    taken. Deploys apply one at a time, and a deploy that finds a newer
+    ticket before it applies is superseded and gives up, so only the newest
+    of the pending deploys applies.
+
+    Tickets and the turn to apply are files locked with flock. Deploys
+    coalesce across processes as well as across the threads of a daemon,
+    and the ticket of a deploy that died is unlocked and ignored.
+    '''
+    def __init__(self, context: str, namespace: str, name: str,
+                 queue_dir: str=QUEUE_DIR, poll: float=0.5,
+                 clock: Callable[[], int]=now_ns,
+                 sleep: Callable[[float], None]=time.sleep):
+        # Context names of some providers contain slashes and colons.
+        self.directory = os.path.join(
+            queue_dir, *(urllib.parse.quote(part, safe='')
+                         for part in (context, namespace, name)))
+        self.description = '{}/{}'.format(namespace, name)
+        self.poll = poll
+        self.clock = clock
+        self.sleep = sleep
+        self.ticket = None
+        self.fd = None
+
+
+    def take(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.ticket = '{:020d}-{}-{}'.format(self.clock(), os.getpid(),
+                                             threading.get_ident())
+        path = os.path.join(self.directory, self.ticket + TICKET)
+        # Locked before it is visible, otherwise it could be taken for the
+        # ticket of a dead deploy.
+        tmp_path = path + '.tmp'
+        self.fd = os.open(tmp_path, os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        os.rename(tmp_path, path)
+
+
+    def drop(self):
+        if self.fd is None:
+            return
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(os.path.join(self.directory, self.ticket + TICKET))
+        os.close(self.fd)
+        self.fd = None
+
+
+    def tickets(self) -> List[str]:
+        return sorted((entry[:-len(TICKET)]
+                       for entry in os.listdir(self.directory)
+                       if entry.endswith(TICKET)), reverse=True)
+
+
+    def alive(self, ticket: str) -> bool:
+        path = os.path.join(self.directory, ticket + TICKET)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            if not try_lock(fd):
+                return True
+            # Nobody holds the ticket, the deploy that took it is gone.
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            return False
+        finally:
+            os.close(fd)
+
+
+    def newer(self) -> Optional[str]:
+        for ticket in self.tickets():
+            if ticket <= self.ticket:
+                return None
+            if self.alive(ticket):
+                return ticket
+        return None
+
+
+    def check(self):
+        '''
+        check raises Superseded if a newer deploy of the same deployment is
+        waiting.
+        '''
+        if self.newer() is not None:
+            raise Superseded(
+                'Superseded by a newer deploy of {}. Not deploying.'.format(
+                    self.description))
+
+
+    @contextlib.contextmanager
+    def turn(self):
+        '''
+        turn waits until no other deploy of the same deployment applies and
+        holds the turn for the block. It raises Superseded if a newer deploy
+        comes in while waiting.
+        '''
+        fd = os.open(os.path.join(self.directory, TURN),
+                     os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            while True:
+                acquired = try_lock(fd)
+                self.check()
+                if acquired:
+                    break
+                self.sleep(self.poll)
+            yield
+        finally:
+            # Closing releases the lock.
+            os.close(fd)
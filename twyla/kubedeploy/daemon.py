@@ -0,0 +1,209 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from typing import Callable, Dict, Hashable, List, Optional
+
+import colorama
+
+from twyla.kubedeploy import client, docker_helpers
+from twyla.kubedeploy.prompt import ThreadLocalStream
+
+
+class DaemonRunning(Exception):
+    pass
+
+
+class ConnectionStream(io.TextIOBase):
+    '''
+    ConnectionStream sends everything written to it to a client as messages
+    of kind, 'out' or 'err'. Both streams of a request share the lock.
+    '''
+    def __init__(self, connection: socket.socket, kind: str,
+                 lock: threading.Lock):
+        self.connection = connection
+        self.kind = kind
+        self.lock = lock
+
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+
+    def writable(self) -> bool:
+        return True
+
+
+    def write(self, text: str) -> int:
+        # click checks for binary streams by writing bytes to them.
+        if not isinstance(text, str):
+            raise TypeError('write() argument must be str')
+        if text:
+            with self.lock:
+                client.send(self.connection, {self.kind: text})
+        return len(text)
+
+
+class Gate:
+    '''
+    Gate lets requests with the same key run concurrently. The key stands for
+    the working directory and the environment, which a process has only one
+    of: a request with another key waits until the running requests are done
+    and then switches the process over.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.key = None
+        self.running = 0
+
+
+    @contextlib.contextmanager
+    def enter(self, key: Hashable, switch: Callable[[], None]):
+        with self.condition:
+            while self.running and self.key != key:
+                self.condition.wait()
+            if self.key != key:
+                switch()
+                self.key = key
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                if not self.running:
+                    self.condition.notify_all()
+
+
+def apply_environment(cwd: str, env: Dict[str, str]):
+    os.chdir(cwd)
+    for key in list(os.environ):
+        if client.is_forwarded(key):
+            del os.environ[key]
+    os.environ.update(env)
+
+
+def exit_code(e: SystemExit) -> int:
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code
+    # sys.exit with a message.
+    print(e.code, file=sys.stderr)
+    return 1
+
+
+def run_command(command, args: List[str]) -> int:
+    '''
+    run_command runs the click command with args like the command line does
+    and returns the exit code.
+    '''
+    try:
+        command.main(args=args, prog_name='kubedeploy')
+    except SystemExit as e:
+        return exit_code(e)
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line.decode('utf8'))
+        code = self.server.daemon.run(self.connection, request)
+        with contextlib.suppress(OSError):
+            client.send(self.connection, {'exit': code})
+
+
+class Daemon:
+    '''
+    Daemon runs kubedeploy commands for clients connecting to a Unix socket,
+    see client.py. Everything kept by the process stays warm between
+    requests: the imports, the compiled templates, the registry sessions and
+    the rate limiter shared by all kubectl calls. Requests run concurrently
+    in threads as long as they come from the same working directory with the
+    same environment.
+    '''
+    def __init__(self, command, path: str=None):
+        self.command = command
+        self.path = path or client.socket_path()
+        self.gate = Gate()
+        self.stdout = None
+        self.stderr = None
+        self.server = None
+
+
+    def run(self, connection: socket.socket, request: dict) -> int:
+        lock = threading.Lock()
+        # Colors are reset after every write like on the command line, see
+        # prompt.py.
+        out = colorama.AnsiToWin32(ConnectionStream(connection, 'out', lock),
+                                   convert=False, strip=False,
+                                   autoreset=True).stream
+        err = ConnectionStream(connection, 'err', lock)
+        cwd = request.get('cwd') or '/'
+        env = client.forwarded_env(request.get('env') or {})
+        key = (cwd, tuple(sorted(env.items())))
+
+        self.stdout.set(out)
+        self.stderr.set(err)
+        try:
+            with self.gate.enter(key, lambda: apply_environment(cwd, env)):
+                return run_command(self.command, list(request['args']))
+        except OSError:
+            # The client went away.
+            return 1
+        finally:
+            self.stdout.set(None)
+            self.stderr.set(None)
+
+
+    def bind(self):
+        running = client.connect(self.path)
+        if running is not None:
+            running.close()
+            raise DaemonRunning(
+                'A kubedeploy daemon is running at {}.'.format(self.path))
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.path,
+                                                             RequestHandler)
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        # Commands run with the permissions of the daemon, so only its user
+        # may connect.
+        os.chmod(self.path, 0o600)
+
+
+    def serve(self, ready: Optional[Callable[[], None]]=None):
+        self.bind()
+        self.stdout = ThreadLocalStream(sys.stdout)
+        self.stderr = ThreadLocalStream(sys.stderr)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        try:
+            with docker_helpers.shared_sessions():
+                if ready is not None:
+                    ready()
+                self.server.serve_forever()
+        finally:
+            sys.stdout, sys.stderr = self.stdout.fallback, self.stderr.fallback
+            self.server.server_close()
+            with contextlib.suppress(OSError):
+                os.unlink(self.path)
+
+
+    def shutdown(self):
+        self.server.shutdown()
@@ -0,0 +1,165 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import IO, Dict, Iterable, Iterator, List
+
+from twyla.kubedeploy import serialization
+from twyla.kubedeploy.snapshot import ListWriter, open_snapshot
+
+DELTA_API_VERSION = 'kubedeploy/v1'
+DELTA_KIND = 'SnapshotDelta'
+
+
+class DeltaMismatch(Exception):
+    pass
+
+
+def identity(item: dict) -> str:
+    # The API version is left out, it changes when an object is migrated to
+    # a new API group version but the object stays the same.
+    metadata = item.get('metadata', {})
+    return '{}/{}/{}'.format(item.get('kind'),
+                             metadata.get('namespace', ''),
+                             metadata.get('name'))
+
+
+def item_hash(item: dict) -> str:
+    data = json.dumps(item, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf8')).hexdigest()[:16]
+
+
+def make_index(items: Iterable[dict]) -> Dict[str, str]:
+    return {identity(item): item_hash(item) for item in items}
+
+
+def digest(index: Dict[str, str]) -> str:
+    '''
+    digest identifies the state of a snapshot by the identities and hashes
+    of its items. A delta records the digest of the state it was made against
+    and of the state it results in.
+    '''
+    sha = hashlib.sha256()
+    for key in sorted(index):
+        sha.update('{} {}\n'.format(key, index[key]).encode('utf8'))
+    return sha.hexdigest()[:16]
+
+
+def is_delta(document: dict) -> bool:
+    return isinstance(document, dict) and document.get('kind') == DELTA_KIND
+
+
+class DeltaWriter(ListWriter):
+    '''
+    DeltaWriter writes the difference between the snapshot described by
+    base_index and the items passed to add. Only new and changed items are
+    written, items missing from the new state are recorded as deleted.
+    '''
+    def __init__(self, fd: IO[str], base_index: Dict[str, str]):
+        super().__init__(fd)
+        self.base_index = base_index
+        self.index = {}
+
+
+    def header(self):
+        self.fd.write('apiVersion: {}\nbase: {}\n'.format(
+            DELTA_API_VERSION, digest(self.base_index)))
+
+
+    def trailer(self):
+        deleted = sorted(set(self.base_index) - set(self.index))
+        serialization.dump_yaml({'deleted': deleted,
+                                 'digest': digest(self.index),
+                                 'kind': DELTA_KIND}, self.fd)
+
+
+    def add(self, item: dict) -> bool:
+        key = identity(item)
+        hashed = item_hash(item)
+        self.index[key] = hashed
+        if self.base_index.get(key) == hashed:
+            return False
+
+        self.write(item)
+        return True
+
+
+def write_delta(fd: IO[str], base_index: Dict[str, str],
+                items: Iterable[dict]) -> int:
+    '''
+    write_delta streams the delta between base_index and items to fd and
+    returns the number of new and changed items.
+    '''
+    with DeltaWriter(fd, base_index) as writer:
+        for item in items:
+            writer.add(item)
+
+    return writer.count
+
+
+def apply_delta(items: 'OrderedDict[str, dict]', index: Dict[str, str],
+                delta: dict):
+    for key in delta.get('deleted') or []:
+        items.pop(key, None)
+        index.pop(key, None)
+    for item in delta.get('items') or []:
+        key = identity(item)
+        items[key] = item
+        index[key] = item_hash(item)
+
+
+def reconstruct(documents: Iterable[dict]) -> dict:
+    '''
+    reconstruct builds the List of a full snapshot followed by a chain of
+    deltas. Every delta must have been made against the state resulting from
+    the documents before it.
+    '''
+    documents = iter(documents)
+    base = next(documents, None)
+    if base is None or is_delta(base):
+        raise DeltaMismatch('A chain of deltas has to start with a full '
+                            'snapshot')
+
+    items = OrderedDict((identity(item), item)
+                        for item in base.get('items') or [])
+    index = make_index(items.values())
+    for position, delta in enumerate(documents, start=1):
+        if not is_delta(delta):
+            raise DeltaMismatch(
+                'Document {} of the chain is not a delta'.format(position))
+        current = digest(index)
+        if delta.get('base') != current:
+            raise DeltaMismatch(
+                'Delta {} was made against {} but the chain is at {}'.format(
+                    position, delta.get('base'), current))
+        apply_delta(items, index, delta)
+        if delta.get('digest') != digest(index):
+            raise DeltaMismatch(
+                'Delta {} does not result in the state it recorded'.format(
+                    position))
+
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'metadata': {},
+        'items': list(items.values()),
+    }
+
+
+def read_snapshots(paths: List[str]) -> Iterator[dict]:
+    # Deltas are read one at a time while the chain is reconstructed.
+    for path in paths:
+        with open_snapshot(path) as fd:
+            yield serialization.load_yaml(fd)
+
+
+def load_chain(paths: List[str]) -> dict:
+    if len(paths) == 1:
+        with open_snapshot(paths[0]) as fd:
+            document = serialization.load_yaml(fd)
+        if is_delta(document):
+            raise DeltaMismatch('{} is a delta, the full snapshot it was '
+                                'made against is required'.format(paths[0]))
+        # A single full snapshot is returned as it is.
+        return document
+
+    return reconstruct(read_snapshots(paths))
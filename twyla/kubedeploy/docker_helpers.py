@@ -1,7 +1,13 @@
 import base64
+import contextlib
+import functools
+import hashlib
 import json
 import os
+import re
+import threading
 from subprocess import PIPE, STDOUT, Popen
+from typing import Dict, List
 
 import docker
 import docker_registry_client as registry
@@ -12,6 +18,14 @@ from twyla.kubedeploy.prompt import prompt
 MACOS_KEYCHAIN_CMD = ['security', 'find-internet-password', '-l',
                       'Docker Credentials', '-w', '-s']
 
+# Paths that are never part of the content hash of a build context. The git
+# directory changes with every commit regardless of the sources. The
+# pip-cache is downloaded from requirements.txt, which is hashed instead.
+# Requirements that point at a branch, e.g. git+ssh URLs without a fixed
+# commit, are therefore not covered: a new commit on that branch does not
+# change the version.
+CONTEXT_HASH_EXCLUDES = ['.git', 'pip-cache']
+
 
 class DockerException(Exception):
     pass
@@ -28,6 +42,115 @@ def tag_components(tag: str) -> (str, str, str):
     return domain, repository, version
 
 
+def read_dockerignore(path: str) -> List[str]:
+    ignore_file = os.path.join(path, '.dockerignore')
+    if not os.path.isfile(ignore_file):
+        return []
+
+    patterns = []
+    with open(ignore_file) as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            exclude = line.startswith('!')
+            pattern = os.path.normpath(line.lstrip('!').strip()).lstrip('/')
+            patterns.append('!' + pattern if exclude else pattern)
+
+    return patterns
+
+
+@functools.lru_cache(maxsize=None)
+def pattern_regex(pattern: str):
+    # The translation Docker uses for .dockerignore patterns: * and ? match
+    # within a path segment only, ** matches any number of segments.
+    regex = ''
+    position = 0
+    while position < len(pattern):
+        char = pattern[position]
+        position += 1
+        if char == '*':
+            if pattern[position:position + 1] != '*':
+                regex += '[^/]*'
+                continue
+            position += 1
+            if pattern[position:position + 1] == '/':
+                position += 1
+            regex += '.*' if position == len(pattern) else '(.*/)?'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', position)
+            if end == -1:
+                regex += re.escape(char)
+                continue
+            members = pattern[position:end]
+            if members.startswith('!'):
+                members = '^' + members[1:]
+            regex += '[' + members + ']'
+            position = end + 1
+        elif char == '\\' and position < len(pattern):
+            regex += re.escape(pattern[position])
+            position += 1
+        else:
+            regex += re.escape(char)
+    return re.compile('^' + regex + '$')
+
+
+def is_ignored(rel_path: str, patterns: List[str]) -> bool:
+    # Same semantics as Docker: the last matching pattern wins, patterns
+    # prefixed with ! re-include paths, and a pattern matching a directory
+    # matches everything below it.
+    parts = rel_path.split('/')
+    prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+    ignored = False
+    for pattern in patterns:
+        exclude = pattern.startswith('!')
+        regex = pattern_regex(pattern.lstrip('!'))
+        if any(regex.match(prefix) for prefix in prefixes):
+            ignored = not exclude
+
+    return ignored
+
+
+def context_hash(path: str, dockerfile: str='Dockerfile',
+                 build_args: Dict[str, str]=None) -> str:
+    '''
+    context_hash returns a version string derived from the effective Docker
+    build context in path (after applying .dockerignore), the Dockerfile, and
+    the build arguments. Unchanged inputs always result in the same version.
+    '''
+    patterns = read_dockerignore(path)
+    digest = hashlib.sha256()
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        rel_root = os.path.relpath(root, path)
+        if rel_root == '.':
+            dirs[:] = [d for d in dirs if d not in CONTEXT_HASH_EXCLUDES]
+        for name in names:
+            rel_path = os.path.normpath(os.path.join(rel_root, name))
+            if not is_ignored(rel_path, patterns):
+                files.append(rel_path)
+
+    # The Dockerfile is always sent to the daemon even if it is ignored.
+    if dockerfile not in files and os.path.isfile(
+            os.path.join(path, dockerfile)):
+        files.append(dockerfile)
+
+    for rel_path in sorted(files):
+        digest.update(rel_path.encode('utf8') + b'\0')
+        with open(os.path.join(path, rel_path), mode='rb') as fd:
+            for chunk in iter(lambda: fd.read(65536), b''):
+                digest.update(chunk)
+        digest.update(b'\0')
+
+    for key, value in sorted((build_args or {}).items()):
+        digest.update('{}={}\0'.format(key, value).encode('utf8'))
+
+    return digest.hexdigest()[:12]
+
+
 def get_macos_credentials(domain):
     keychain_cmd = ["docker-credential-osxkeychain", "get"]
     p = Popen(keychain_cmd, stdout=PIPE, stdin=PIPE, stderr=STDOUT)
@@ -36,20 +159,20 @@ def get_macos_credentials(domain):
     return credentials['Username'], credentials['Secret']
 
 
-def docker_image(op: str, tag: str):
+def docker_image(op: str, tag: str, path: str=None, client=None):
     # The registry part of the tag will be used to determine the push
     # destination domain.
-    client = docker.from_env(version='1.24')
+    client = client or docker.from_env(version='1.24')
 
     if op == "build":
         prompt('Building image: {}'.format(tag))
-        client.images.build(tag=tag, path=os.getcwd())
+        client.images.build(tag=tag, path=path or os.getcwd())
     elif op == "push":
         prompt('Pushing image: {}'.format(tag))
         client.images.push(tag)
 
 
-def docker_image_exists(tag: str) -> bool:
+def registry_credentials(domain: str) -> (str, str):
     # This one assumes a logged in local docker to read the credentials from
     home = os.path.expanduser('~')
     docker_auth_file = os.path.join(home, '.docker', 'config.json')
@@ -57,28 +180,69 @@ def docker_image_exists(tag: str) -> bool:
         docker_auth_data = json.load(fd)
 
     # Extract the credentials for the docker json.
-    domain_part, repository, version = tag_components(tag)
-    if domain_part not in docker_auth_data['auths']:
-        raise DockerException("Not authorized for registry {}".format(domain_part))
+    if domain not in docker_auth_data['auths']:
+        raise DockerException("Not authorized for registry {}".format(domain))
 
     if docker_auth_data.get('credsStore', '') == 'osxkeychain':
-        username, password = get_macos_credentials(domain_part)
-    else:
-        base64_credentials = docker_auth_data['auths'][domain_part]['auth']
-        # dXNlcm5hbWU6cGFzc3dvcmQK= -> username:password
-        credentials = base64.b64decode(base64_credentials).decode('utf8')
-        # username:password -> [username, password]
-        username, password = credentials.split(':', 1)
-    client = registry.DockerRegistryClient("https://{}".format(domain_part),
-                                           username=username,
-                                           password=password)
-    repository = client.repository(repository)
+        return get_macos_credentials(domain)
+
+    base64_credentials = docker_auth_data['auths'][domain]['auth']
+    # dXNlcm5hbWU6cGFzc3dvcmQK= -> username:password
+    credentials = base64.b64decode(base64_credentials).decode('utf8')
+    # username:password -> [username, password]
+    username, password = credentials.split(':', 1)
+    return username, password
+
+
+class RegistrySession:
+    '''
+    RegistrySession keeps authenticated registry clients around so that
+    checking many images only reads the credentials once per registry.
+    '''
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+
+    def client(self, domain: str):
+        with self.lock:
+            if domain not in self.clients:
+                username, password = registry_credentials(domain)
+                self.clients[domain] = registry.DockerRegistryClient(
+                    "https://{}".format(domain),
+                    username=username,
+                    password=password)
+            return self.clients[domain]
 
+
+    def image_exists(self, tag: str) -> bool:
+        domain_part, repository, version = tag_components(tag)
+        repository = self.client(domain_part).repository(repository)
+
+        try:
+            repository.manifest(version)
+            return True
+        except HTTPError as e:
+            if e.response.status_code != 404:
+                raise
+
+        return False
+
+
+# Set in long running processes so that the credentials of a registry are
+# read once for all callers, see daemon.py.
+_shared_session = None
+
+
+@contextlib.contextmanager
+def shared_sessions():
+    global _shared_session
+    _shared_session = RegistrySession()
     try:
-        repository.manifest(version)
-        return True
-    except HTTPError as e:
-        if e.response.status_code != 404:
-            raise
+        yield _shared_session
+    finally:
+        _shared_session = None
+
 
-    return False
+def docker_image_exists(tag: str, session: RegistrySession=None) -> bool:
+    return (session or _shared_session or RegistrySession()).image_exists(tag)
@@ -0,0 +1,200 @@
+import contextlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Union
+
+from twyla.kubedeploy import serialization
+from twyla.kubedeploy.kube import CACHE_DIR
+from twyla.kubedeploy.kubectl import (DEPLOYMENT_NOT_FOUND, Kubectl,
+                                      KubectlCallFailed)
+from twyla.kubedeploy.labels import LabelIndex
+from twyla.kubedeploy.watch import (ADDED, DELETED, ERROR, MODIFIED,
+                                    watch_path)
+
+INFORMER_CACHE_DIR = os.path.join(CACHE_DIR, 'informer')
+DEPLOYMENT_ENTITIES = ('deployment', 'deployments', 'deploy')
+
+
+class Informer:
+    '''
+    Informer keeps the deployments of a namespace in a cache on disk, keyed
+    by the kubectl context and the namespace. The cache stores the resource
+    version of the last list. On the next run the cache catches up with a
+    short watch starting at that version, and the namespace is only listed
+    again when the version has expired. A cache synced less than max_age
+    seconds ago is used as it is. A namespace is synced once per process.
+    '''
+    def __init__(self, cache_dir: str=INFORMER_CACHE_DIR, timeout: int=1,
+                 max_age: float=5.0):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_age = max_age
+        self.context = None
+        self.states = {}
+        self.indexes = {}
+        self.lock = threading.Lock()
+        self.namespace_locks = defaultdict(threading.Lock)
+
+
+    def kubectl(self, namespace: str) -> Kubectl:
+        kubectl = Kubectl()
+        kubectl.namespace = namespace
+        return kubectl
+
+
+    def cache_file(self, namespace: str) -> str:
+        if self.context is None:
+            self.context = self.kubectl(namespace).current_context()
+        # Context names of some providers contain slashes and colons.
+        context = urllib.parse.quote(self.context, safe='')
+        return os.path.join(self.cache_dir, context,
+                            '{}.json'.format(namespace))
+
+
+    def load(self, namespace: str) -> Optional[dict]:
+        cache_file = self.cache_file(namespace)
+        if not os.path.isfile(cache_file):
+            return None
+        with open(cache_file, mode='rb') as fd:
+            state = serialization.loads_json(fd.read())
+        state['items'] = OrderedDict(
+            (item['metadata']['name'], item) for item in state['items'])
+        return state
+
+
+    def is_fresh(self, namespace: str) -> bool:
+        # The modification time of the cache is the time of the last sync.
+        try:
+            synced = os.path.getmtime(self.cache_file(namespace))
+        except OSError:
+            return False
+        return time.time() - synced < self.max_age
+
+
+    def touch(self, namespace: str):
+        with contextlib.suppress(OSError):
+            os.utime(self.cache_file(namespace))
+
+
+    def save(self, namespace: str, state: dict):
+        cache_file = self.cache_file(namespace)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Written to a temporary file first so that concurrent runs never
+        # read a partial cache.
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, mode='w') as fd:
+            json.dump({'resourceVersion': state['resourceVersion'],
+                       'items': list(state['items'].values())}, fd)
+        os.replace(tmp_file, cache_file)
+
+
+    def relist(self, namespace: str) -> dict:
+        listed = self.kubectl(namespace).list_deployments()
+        return {
+            'resourceVersion': listed['metadata']['resourceVersion'],
+            'items': OrderedDict((item['metadata']['name'], item)
+                                 for item in listed['items']),
+        }
+
+
+    def catch_up(self, namespace: str, state: dict) -> Optional[dict]:
+        '''
+        catch_up applies the changes since the cached resource version to
+        state. It returns None if the version expired.
+        '''
+        path = watch_path(namespace, None, state['resourceVersion'],
+                          timeout=self.timeout)
+        for event in self.kubectl(namespace).watch_raw(path):
+            kind = event.get('type')
+            item = event.get('object') or {}
+            if kind == ERROR:
+                return None
+            name = item['metadata'].get('name')
+            if kind in (ADDED, MODIFIED):
+                state['items'][name] = item
+            elif kind == DELETED:
+                state['items'].pop(name, None)
+            # Bookmarks only move the resource version forward.
+            state['resourceVersion'] = item['metadata']['resourceVersion']
+        return state
+
+
+    def sync(self, namespace: str) -> dict:
+        # Namespaces are synced concurrently, but each only once.
+        with self.lock:
+            namespace_lock = self.namespace_locks[namespace]
+        with namespace_lock:
+            if namespace in self.states:
+                return self.states[namespace]
+
+            state = self.load(namespace)
+            if state is not None and not self.is_fresh(namespace):
+                version = state['resourceVersion']
+                state = self.catch_up(namespace, state)
+                if state is not None and state['resourceVersion'] == version:
+                    # Nothing changed, only the time of the sync is recorded.
+                    self.touch(namespace)
+                elif state is not None:
+                    self.save(namespace, state)
+            if state is None:
+                state = self.relist(namespace)
+                self.save(namespace, state)
+            self.states[namespace] = state
+            self.indexes[namespace] = LabelIndex(state['items'].values())
+            return state
+
+
+    def get(self, namespace: str, name: str) -> Optional[dict]:
+        return self.sync(namespace)['items'].get(name)
+
+
+    def list(self, namespace: str,
+             selectors: Union[str, Dict[str, object]]=None) -> List[dict]:
+        '''
+        list answers selectors from the label index of the namespace, see
+        LabelIndex.select.
+        '''
+        self.sync(namespace)
+        return self.indexes[namespace].select(selectors)
+
+
+class CachedKubectl(Kubectl):
+    '''
+    CachedKubectl reads deployments from an Informer and passes everything
+    else on to kubectl.
+    '''
+    def __init__(self, informer: Informer=None, **kwargs):
+        super().__init__(**kwargs)
+        self.informer = informer or Informer()
+
+
+    def _get_entity_by_name(self, entity, name):
+        if entity not in DEPLOYMENT_ENTITIES:
+            return super()._get_entity_by_name(entity, name)
+
+        item = self.informer.get(self.namespace or 'default', name)
+        if item is None:
+            raise KubectlCallFailed(
+                (DEPLOYMENT_NOT_FOUND.format(name) + '\n').encode('utf8'))
+        return item
+
+
+    def _list_entities(self, entity, selectors=None, expect_json=True,
+                       all_namespaces=False):
+        if (entity not in DEPLOYMENT_ENTITIES or not expect_json or
+                all_namespaces):
+            return super()._list_entities(entity, selectors, expect_json,
+                                          all_namespaces)
+
+        namespace = self.namespace or 'default'
+        state = self.informer.sync(namespace)
+        return {
+            'apiVersion': 'v1',
+            'kind': 'List',
+            'metadata': {'resourceVersion': state['resourceVersion']},
+            'items': self.informer.list(namespace, selectors),
+        }
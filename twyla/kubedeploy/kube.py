@@ -1,15 +1,121 @@
-import tempfile
-from typing import Callable, List
+import copy
+import itertools
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Tuple, Union
 
-from jinja2 import Environment, Template, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-from twyla.kubedeploy.kubectl import Kubectl, KubectlCallFailed
+from twyla.kubedeploy import model, serialization
+from twyla.kubedeploy.kubectl import (DEPLOYMENT_NOT_FOUND, Kubectl,
+                                      KubectlCallFailed)
+from twyla.kubedeploy.model import Deployment
+
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'kubedeploy')
+TEMPLATE_CACHE_DIR = os.path.join(CACHE_DIR, 'jinja')
+
+INFO_TEMPLATE = '''
+{{ meta.title }}:
+{% for name, image in deployment.containers %}
+  name: {{ name }}
+  image: {{ image }}
+{% endfor %}
+  replicas: {{ deployment.ready }}/{{ deployment.replicas or 0 -}}
+        '''
+
+
+def make_bytecode_cache(directory: str=TEMPLATE_CACHE_DIR):
+    # Compiled templates are cached on disk so that only the first run after a
+    # change of deployment.yml pays for compiling it. Caching is skipped if
+    # the directory can not be created.
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(directory)
+
+
+# Templates are compiled once per process: built-in templates at import time,
+# and deployment templates by the environment of their directory, which
+# reloads them if the file changes. A long running process (see daemon.py)
+# renders the templates of several directories.
+bytecode_cache = make_bytecode_cache()
+jinja = Environment(bytecode_cache=bytecode_cache)
+info_template = jinja.from_string(INFO_TEMPLATE)
+environments = {}
+environments_lock = threading.Lock()
+
+
+def template_environment(directory: str=None) -> Environment:
+    directory = os.path.abspath(directory or os.getcwd())
+    with environments_lock:
+        if directory not in environments:
+            environments[directory] = Environment(
+                loader=FileSystemLoader(directory),
+                bytecode_cache=bytecode_cache)
+        return environments[directory]
 
 
 class DeploymentNotFoundException(Exception):
     pass
 
 
+LAST_APPLIED = 'kubectl.kubernetes.io/last-applied-configuration'
+
+STATUS_NEW = 'new'
+STATUS_CHANGED = 'changed'
+STATUS_UNCHANGED = 'unchanged'
+
+
+def split_documents(manifest: str) -> List[dict]:
+    return [document for document in serialization.load_all_yaml(manifest)
+            if document]
+
+
+def last_applied_configuration(live: dict):
+    annotations = live.get('metadata', {}).get('annotations') or {}
+    if LAST_APPLIED not in annotations:
+        return None
+    return serialization.loads_json(annotations[LAST_APPLIED])
+
+
+def contains(live, applied) -> bool:
+    '''
+    contains tells whether every value set in applied has the same value in
+    live. Defaults and status the server added to live are ignored, a value
+    changed in the cluster, e.g. by kubectl set image, is not.
+    '''
+    if isinstance(applied, dict):
+        return isinstance(live, dict) and all(
+            key in live and contains(live[key], value)
+            for key, value in applied.items())
+    if isinstance(applied, list):
+        return (isinstance(live, list) and len(live) == len(applied) and
+                all(contains(l, a) for l, a in zip(live, applied)))
+    return live == applied
+
+
+def normalize(document: dict, namespace: str) -> dict:
+    # kubectl stores the last applied configuration with the namespace set
+    # and the annotations of the object apart from its own, so both sides
+    # are brought into the same shape before comparing.
+    document = copy.deepcopy(document)
+    metadata = document.setdefault('metadata', {})
+    metadata.setdefault('namespace', namespace)
+    annotations = metadata.get('annotations') or {}
+    annotations.pop(LAST_APPLIED, None)
+    if annotations:
+        metadata['annotations'] = annotations
+    else:
+        metadata.pop('annotations', None)
+
+    return document
+
+
 class Kube:
     def __init__(self,
                  namespace: str,
@@ -17,12 +123,15 @@ class Kube:
                  printer: Callable[[str], int],
                  error_printer: Callable[[str], int],
                  deployment_template: str=None,
-                 variants: List[str]=None):
+                 variants: List[str]=None,
+                 kubectl: Kubectl=None):
         self.printer = printer
         self.error_printer = error_printer
         self.deployment_name = deployment_name
         self.deployment_template = deployment_template or 'deployment.yml'
-        self.kubectl = Kubectl()
+        # A Kubectl instance can be shared between several Kube objects as
+        # long as they use the same namespace.
+        self.kubectl = kubectl or Kubectl()
         self.kubectl.namespace = namespace
         self.variants = variants or []
 
@@ -31,18 +140,70 @@ class Kube:
         return self.kubectl.get_deployment(self.deployment_name)
 
 
+    def get_live_object(self, document: dict):
+        kind = document['kind'].lower()
+        name = document['metadata']['name']
+        return self.kubectl._get_entity_by_name(kind, name)
+
+
+    def document_status(self, document: dict) -> str:
+        '''
+        document_status compares a rendered document with the configuration
+        that was last applied to its live counterpart, and that configuration
+        with the live object, which may have been changed since without
+        kubectl apply.
+        '''
+        if not document.get('kind') or not document.get(
+                'metadata', {}).get('name'):
+            return STATUS_CHANGED
+
+        try:
+            live = self.get_live_object(document)
+        except KubectlCallFailed:
+            return STATUS_NEW
+
+        applied = last_applied_configuration(live)
+        if applied is None:
+            return STATUS_CHANGED
+
+        namespace = self.kubectl.namespace
+        applied = normalize(applied, namespace)
+        if (normalize(document, namespace) == applied and
+                contains(normalize(live, namespace), applied)):
+            return STATUS_UNCHANGED
+
+        return STATUS_CHANGED
+
+
     def apply(self, tag: str):
-        # Load the deployment definition
-        file_name = self.render_template(tag)
-        output = self.kubectl.apply(file_name)
-        for line in output.split('\n'):
-            if line is not '':
+        # Load the deployment definition and only apply the documents that
+        # differ from what is running in the cluster.
+        manifest = self.render_template(tag)
+        changed = []
+        for document in split_documents(manifest):
+            status = self.document_status(document)
+            self.printer('{}/{}: {}'.format(
+                document.get('kind'),
+                document.get('metadata', {}).get('name'),
+                status))
+            if status != STATUS_UNCHANGED:
+                changed.append(document)
+
+        if not changed:
+            self.printer('All objects unchanged. Nothing to apply.')
+            return
+
+        output = self.kubectl.apply_manifest(
+            serialization.dump_all_yaml(changed),
+            on_error=self.error_printer)
+        for line in output:
+            if line:
                 self.printer(line)
 
 
     def info(self):
         try:
-            deployment = self.get_remote_deployment()
+            deployment = Deployment.from_dict(self.get_remote_deployment())
             self.print_deployment_info(
                 'Current {}'.format(self.deployment_name),
                 deployment)
@@ -50,6 +211,30 @@ class Kube:
             self.error_printer(self.exception(e))
 
 
+    def info_many(self, names: List[str]=None,
+                  selectors: Union[str, Dict[str, object]]=None):
+        '''
+        info_many prints the deployments named by names, or all selected by
+        selectors, with a single list call. Missing names are reported and do
+        not stop the others from being printed.
+        '''
+        try:
+            listed = self.kubectl.list_deployments(selectors=selectors)
+        except KubectlCallFailed as e:
+            self.error_printer(self.exception(e))
+            return
+
+        deployments = OrderedDict(
+            (deployment.name, deployment)
+            for deployment in model.summaries(listed['items']))
+        for name in names or list(deployments):
+            deployment = deployments.get(name)
+            if deployment is None:
+                self.error_printer(DEPLOYMENT_NOT_FOUND.format(name))
+                continue
+            self.print_deployment_info('Current {}'.format(name), deployment)
+
+
     def exception(self, e):
         return e.args[0].decode('utf8').strip()
 
@@ -57,16 +242,7 @@ class Kube:
     def print_deployment_info(
             self,
             title: str,
-            deployment):
-
-        info_template = Template('''
-{{ meta.title }}:
-{% for c in deployment.spec.template.spec.containers %}
-  name: {{ c.name }}
-  image: {{ c.image }}
-{% endfor %}
-  replicas: {{ deployment.status.readyReplicas }}/{{ deployment.status.replicas -}}
-        ''')
+            deployment: Deployment):
 
         rendered = info_template.render(meta={'name': self.deployment_name,
                                               'title': title},
@@ -79,33 +255,66 @@ class Kube:
         return
 
 
-    def render_template(self, tag: str):
-        jinja = Environment(loader=FileSystemLoader('./'))
-        template = jinja.get_template(self.deployment_template)
-
+    def remote_replicas(self):
         replicas = None
         try:
-            deployment = self.get_remote_deployment()
-            replicas = deployment['spec']['replicas']
-
+            deployment = Deployment.from_dict(self.get_remote_deployment())
             # make sure to use the same number of replicas as remote to honor
             # scaling
-            if deployment.get('status'):
-                replicas = deployment['status']['replicas']
+            replicas = deployment.current_replicas
         except KubectlCallFailed as e:
             self.error_printer(self.exception(e))
 
+        return replicas
+
+
+    def render(self, tag: str, replicas, variants: List[str]=None) -> str:
+        template = template_environment().get_template(
+            self.deployment_template)
+
         data = {
             'image': tag,
             'name': self.deployment_name,
             'namespace': self.kubectl.namespace,
             'replicas': replicas,
-            'variants': self.variants
+            'variants': self.variants if variants is None else variants
         }
 
-        rendered = template.render(data=data)
-        tmp_file = tempfile.NamedTemporaryFile(delete=False)
+        return template.render(data=data)
+
+
+    def validate(self, tag: str, validator) -> List[str]:
+        # Render with a placeholder for the replicas so that validating does
+        # not need to call the cluster.
+        return validator.validate_manifest(self.render(tag, replicas=1))
+
+
+    def render_template(self, tag: str) -> str:
+        return self.render(tag, self.remote_replicas())
+
+
+    def render_matrix(self, tag: str, matrix: List[List[str]]
+                      ) -> List[Tuple[List[str], str]]:
+        '''
+        render_matrix renders the deployment template for every combination of
+        variants in matrix. The template is compiled and the remote replicas
+        are looked up only once for all combinations.
+        '''
+        replicas = self.remote_replicas()
+        return [(variants, self.render(tag, replicas, variants))
+                for variants in matrix]
+
 
-        tmp_file.write(rendered.encode('utf8'))
+def variant_matrix(spec: str) -> List[List[str]]:
+    '''
+    variant_matrix expands a comma separated list of dimensions, each a list
+    of alternatives separated by |, into all combinations of variants, e.g.
+    "de|en,prod|staging" into [de, prod], [de, staging], [en, prod], [en,
+    staging]. An empty alternative, e.g. in "beta|", leaves the dimension
+    out of the combination.
+    '''
+    dimensions = [[a.strip() for a in dimension.split('|')]
+                  for dimension in spec.split(',')]
 
-        return tmp_file.name
+    return [[variant for variant in combination if variant]
+            for combination in itertools.product(*dimensions)]
@@ -1,16 +1,88 @@
+import contextlib
 import functools
-import json
 import subprocess
+import threading
+from typing import Callable, Iterator
+
+from twyla.kubedeploy import ratelimit, serialization
+from twyla.kubedeploy.model import Deployment
+from twyla.kubedeploy.prompt import carry_output
 
 
 class KubectlCallFailed(Exception):
     pass
 
 
+# The error kubectl reports for a missing deployment.
+DEPLOYMENT_NOT_FOUND = \
+    'Error from server (NotFound): deployments.apps "{}" not found'
+
+
+def selector_string(selectors) -> str:
+    if selectors is None:
+        return ''
+    if isinstance(selectors, str):
+        # Already in the syntax of kubectl, e.g. 'app in (a,b),!legacy'.
+        return selectors
+
+    # {'key1': 'value1', 'key2': ['value2', 'value3']}
+    selector_strings = []
+    for k, v in selectors.items():
+        if isinstance(v, (list, tuple)):
+            # ['key2 in (value2,value3)']
+            selector_strings.append('{} in ({})'.format(k, ','.join(v)))
+        else:
+            # ['key1=value1']
+            selector_strings.append('='.join([k, v]))
+
+    return ','.join(selector_strings)
+
+
+class StreamErrors:
+    '''
+    StreamErrors collects the stderr of a streamed call. Lines for on_error
+    are held back until the call wrote output or ended, so that a call that
+    is throttled right away can be retried without reporting it. After that
+    they are passed on as they arrive.
+    '''
+    def __init__(self, on_error: Callable[[str], None]=None):
+        self.on_error = on_error
+        self.lines = []
+        self.held = []
+        self.released = False
+        self.lock = threading.Lock()
+
+
+    def add(self, line: bytes):
+        with self.lock:
+            self.lines.append(line)
+            if self.on_error is None:
+                return
+            if not self.released:
+                self.held.append(line)
+                return
+            self.on_error(line.decode('utf8').rstrip('\n'))
+
+
+    def release(self):
+        with self.lock:
+            self.released = True
+            held, self.held = self.held, []
+            if self.on_error is None:
+                return
+            for line in held:
+                self.on_error(line.decode('utf8').rstrip('\n'))
+
+
 class Kubectl:
-    def __init__(self):
+    def __init__(self, limiter: ratelimit.TokenBucket=None,
+                 backoff: ratelimit.Backoff=None):
         self.exe = 'kubectl'
         self.namespace = None
+        # All instances share one limiter unless told otherwise, so that the
+        # whole process stays within the configured rate.
+        self.limiter = limiter or ratelimit.shared_limiter()
+        self.backoff = backoff or ratelimit.Backoff()
 
 
     def _make_command(self, args=['get', 'pods']):
@@ -25,26 +97,162 @@ class Kubectl:
         return cmd
 
 
-    def _call(self, command, expect_json=True):
-        try:
-            proc = subprocess.run(
+    def _call(self, command, expect_json=True, stdin: bytes=None):
+        kwargs = {}
+        if stdin is not None:
+            kwargs['input'] = stdin
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                proc = subprocess.run(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    **kwargs)
+                proc.check_returncode()
+                break
+            except subprocess.CalledProcessError:
+                # Requests throttled by the API server are retried, every
+                # other failure is passed on right away.
+                if (attempt >= self.backoff.retries or
+                        not ratelimit.is_throttled(proc.stderr)):
+                    raise KubectlCallFailed(proc.stderr)
+            self.backoff.wait(attempt, ratelimit.retry_after(proc.stderr))
+            attempt += 1
+
+        if expect_json:
+            return serialization.loads_json(proc.stdout)
+
+        return proc.stdout.decode('utf8')
+
+
+    def _stream(self, command, stdin: bytes=None,
+                on_error: Callable[[str], None]=None,
+                on_start: Callable[[subprocess.Popen], None]=None
+                ) -> Iterator[str]:
+        '''
+        _stream yields the lines of stdout of command as they are written.
+        Lines on stderr are passed to on_error as they arrive; if on_error is
+        not given they are collected and raised with KubectlCallFailed.
+        on_start is given the process, so that another thread can kill it.
+        Streamed calls are rate limited. A call throttled by the API server
+        before it wrote any output is retried, other calls are not, their
+        output has been passed on already when they fail.
+        '''
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            proc = subprocess.Popen(
                 command,
+                stdin=subprocess.PIPE if stdin is not None else None,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE)
-            proc.check_returncode()
-        except subprocess.CalledProcessError:
-            raise KubectlCallFailed(proc.stderr)
+            if on_start is not None:
+                on_start(proc)
+
+            errors = StreamErrors(on_error)
+
+            def feed():
+                try:
+                    proc.stdin.write(stdin)
+                except BrokenPipeError:
+                    # kubectl exited or was killed before reading everything.
+                    pass
+                finally:
+                    with contextlib.suppress(BrokenPipeError):
+                        proc.stdin.close()
+
+            def drain():
+                for line in proc.stderr:
+                    errors.add(line)
+
+            # stdin and stderr are handled in threads so that neither pipe
+            # can fill up and block kubectl while stdout is read.
+            threads = [threading.Thread(target=carry_output(drain))]
+            if stdin is not None:
+                threads.append(threading.Thread(target=feed))
+            for thread in threads:
+                thread.start()
+
+            output = False
+            finished = False
+            try:
+                for line in proc.stdout:
+                    if not output:
+                        output = True
+                        errors.release()
+                    yield line.decode('utf8').rstrip('\n')
+                finished = True
+            finally:
+                # The consumer stopped early, e.g. with break or close(), or
+                # the generator was collected: kubectl must not outlive it.
+                if not finished and proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+                for thread in threads:
+                    thread.join()
+
+            stderr = b''.join(errors.lines)
+            if (proc.wait() != 0 and not output and
+                    attempt < self.backoff.retries and
+                    ratelimit.is_throttled(stderr)):
+                self.backoff.wait(attempt, ratelimit.retry_after(stderr))
+                attempt += 1
+                continue
+
+            errors.release()
+            if proc.returncode == 0:
+                return
+            if on_error is None:
+                raise KubectlCallFailed(stderr)
+            raise KubectlCallFailed('kubectl exited with status {}'.format(
+                proc.returncode).encode('utf8'))
 
-        out = proc.stdout.decode('utf8')
-        if expect_json:
-            return json.loads(out)
 
-        return out
+    def apply_manifest(self, manifest: str,
+                       on_error: Callable[[str], None]=None) -> Iterator[str]:
+        # Pass the manifest on stdin to avoid writing it to disk first, and
+        # stream the output as objects are applied.
+        args = ['apply', '-f', '-']
+        return self._stream(self._make_command(args),
+                            stdin=manifest.encode('utf8'),
+                            on_error=on_error)
 
 
-    def apply(self, file_name):
-        args = ['apply', '-f', file_name]
-        return self._call(self._make_command(args), expect_json=False)
+    def current_context(self) -> str:
+        # Reads the local kubeconfig only, no call to the API server.
+        args = ['config', 'current-context']
+        return self._call([self.exe] + args, expect_json=False).strip()
+
+
+    def server_version(self) -> str:
+        args = ['version', '-o', 'json']
+        version = self._call([self.exe] + args)
+        return version['serverVersion']['gitVersion']
+
+
+    def get_raw(self, path: str):
+        args = ['get', '--raw', path]
+        return self._call([self.exe] + args)
+
+
+    def watch_raw(self, path: str,
+                  on_start: Callable[[subprocess.Popen], None]=None
+                  ) -> Iterator[dict]:
+        '''
+        watch_raw yields the events of a watch request to the API server as
+        they arrive. The server sends one JSON encoded event per line.
+        Closing the iterator ends the request.
+        '''
+        args = ['get', '--raw', path]
+        lines = self._stream([self.exe] + args, on_start=on_start)
+        with contextlib.closing(lines):
+            for line in lines:
+                if line:
+                    yield serialization.loads_json(line)
 
 
     def _get_entity_by_name(self, entity, name):
@@ -52,8 +260,11 @@ class Kubectl:
         return self._call(self._make_command(args))
 
 
-    def _list_entities(self, entity, selectors=None, expect_json=True):
+    def _list_entities(self, entity, selectors=None, expect_json=True,
+                       all_namespaces=False):
         args = ['get', entity]
+        if all_namespaces:
+            args.append('--all-namespaces')
         args.extend(self._make_selector_args(selectors))
 
         if expect_json:
@@ -62,17 +273,9 @@ class Kubectl:
 
 
     def _make_selector_args(self, selectors):
-        if selectors is None:
-            return []
-
-        # {'key1': 'value1', 'key2': 'value2'}
-        selector_strings = []
-        for k, v in selectors.items():
-            # ['key1value1', 'key2=value2']
-            selector_strings.append('='.join([k, v]))
-
-        if selector_strings:
-            return ['--selector', ','.join(selector_strings)]
+        selector = selector_string(selectors)
+        if selector:
+            return ['--selector', selector]
 
         return []
 
@@ -95,13 +298,11 @@ class Kubectl:
             namespace = deployment['metadata'].get('namespace') or 'default'
             name = deployment['metadata']['name']
 
-            # NOTE: Setting the namespace for every deployment currently makes
-            # limited sense as only one namespace is supported for dumping the
-            # file in the first place. It is nontheless required at least once.
+            # Dumps can contain deployments of several namespaces.
             self.namespace = namespace
             try:
-                remote = self.get_deployment(name)
-                deployment['spec']['replicas'] = remote['spec']['replicas']
+                remote = Deployment.from_dict(self.get_deployment(name))
+                deployment['spec']['replicas'] = remote.desired
             except KubectlCallFailed:
                 # Just use the replicas defined in the definition if there are
                 # problems getting the remote count.
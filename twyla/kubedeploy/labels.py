@@ -0,0 +1,144 @@
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Set, Tuple, Union
+
+IN = 'in'
+NOT_IN = 'notin'
+EXISTS = 'exists'
+DOES_NOT_EXIST = '!'
+
+SET_REQUIREMENT = re.compile(
+    r'^\s*([\w./-]+)\s+(in|notin)\s+\(([^)]*)\)\s*$')
+EQUALITY_REQUIREMENT = re.compile(
+    r'^\s*([\w./-]+)\s*(==|=|!=)\s*([\w.-]*)\s*$')
+KEY = re.compile(r'^\s*(!?)\s*([\w./-]+)\s*$')
+
+
+class Requirement(NamedTuple):
+    key: str
+    operator: str
+    values: Tuple[str, ...] = ()
+
+
+def split_requirements(selector: str) -> List[str]:
+    # Commas separate requirements except inside the values of in and notin.
+    parts = []
+    depth = 0
+    current = ''
+    for char in selector:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    parts.append(current)
+    return [part for part in parts if part.strip()]
+
+
+def parse_selector(selector: str) -> List[Requirement]:
+    '''
+    parse_selector parses a label selector in the syntax of kubectl, e.g.
+    "servicegroup in (a,b),app!=web,team,!deprecated".
+    '''
+    requirements = []
+    for part in split_requirements(selector):
+        match = SET_REQUIREMENT.match(part)
+        if match:
+            key, operator, values = match.groups()
+            values = tuple(v.strip() for v in values.split(',') if v.strip())
+            requirements.append(Requirement(key, operator, values))
+            continue
+
+        match = EQUALITY_REQUIREMENT.match(part)
+        if match:
+            key, operator, value = match.groups()
+            if operator == '!=':
+                requirements.append(Requirement(key, NOT_IN, (value,)))
+            else:
+                requirements.append(Requirement(key, IN, (value,)))
+            continue
+
+        match = KEY.match(part)
+        if match:
+            negated, key = match.groups()
+            requirements.append(
+                Requirement(key, DOES_NOT_EXIST if negated else EXISTS))
+            continue
+
+        raise ValueError('Invalid label selector: {}'.format(part.strip()))
+
+    return requirements
+
+
+def requirements_of(selectors: Union[str, Dict[str, object], None]
+                    ) -> List[Requirement]:
+    '''
+    requirements_of accepts a selector string or the selector dicts used by
+    Kubectl, where a list of values selects any of them.
+    '''
+    if selectors is None:
+        return []
+    if isinstance(selectors, str):
+        return parse_selector(selectors)
+
+    requirements = []
+    for key, value in selectors.items():
+        if isinstance(value, (list, tuple)):
+            requirements.append(Requirement(key, IN, tuple(value)))
+        else:
+            requirements.append(Requirement(key, IN, (value,)))
+    return requirements
+
+
+class LabelIndex:
+    '''
+    LabelIndex maps label keys and key/value pairs to the items carrying
+    them, so that selectors are answered with set operations instead of a
+    scan of every item. Results keep the order of the items.
+    '''
+    def __init__(self, items: Iterable[dict]):
+        self.items = list(items)
+        self.all = set(range(len(self.items)))
+        self.by_key = defaultdict(set)
+        self.by_label = defaultdict(set)
+        for position, item in enumerate(self.items):
+            labels = item.get('metadata', {}).get('labels') or {}
+            for key, value in labels.items():
+                self.by_key[key].add(position)
+                self.by_label[(key, value)].add(position)
+
+
+    def matching(self, requirement: Requirement) -> Set[int]:
+        if requirement.operator == EXISTS:
+            return self.by_key.get(requirement.key, set())
+        if requirement.operator == DOES_NOT_EXIST:
+            return self.all - self.by_key.get(requirement.key, set())
+
+        selected = set()
+        for value in requirement.values:
+            selected |= self.by_label.get((requirement.key, value), set())
+        if requirement.operator == NOT_IN:
+            # Like the API server, notin also matches items without the key.
+            return self.all - selected
+        return selected
+
+
+    def select(self, selectors: Union[str, Dict[str, object], None]=None
+               ) -> List[dict]:
+        requirements = requirements_of(selectors)
+        if not requirements:
+            return list(self.items)
+
+        # Intersect the smallest sets first to keep intermediate sets small.
+        sets = sorted((self.matching(r) for r in requirements), key=len)
+        selected = set(sets[0])
+        for other in sets[1:]:
+            if not selected:
+                break
+            selected &= other
+
+        return [self.items[position] for position in sorted(selected)]
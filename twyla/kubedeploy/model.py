@@ -0,0 +1,74 @@
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+def intern_labels(labels: Optional[Dict[str, str]]) -> Dict[str, str]:
+    # The same few label keys and values repeat across every deployment of a
+    # cluster.
+    return {sys.intern(key): sys.intern(str(value))
+            for key, value in (labels or {}).items()}
+
+
+class Deployment(NamedTuple):
+    '''
+    Deployment is the summary of a deployment that the read only commands
+    print and compare. It is a tuple, so an instance costs a small fraction
+    of the dict it is parsed from. replicas is None when the server did not
+    report it.
+    '''
+    name: str
+    namespace: str
+    containers: Tuple[Tuple[str, str], ...]
+    labels: Dict[str, str]
+    desired: Optional[int]
+    has_status: bool
+    replicas: Optional[int]
+    ready: int
+    updated: int
+
+
+    @property
+    def images(self) -> List[str]:
+        return [image for _, image in self.containers]
+
+
+    @property
+    def current_replicas(self) -> Optional[int]:
+        # The replicas actually running honor scaling since the last deploy.
+        return self.replicas if self.replicas is not None else self.desired
+
+
+    @classmethod
+    def from_dict(cls, item: dict) -> 'Deployment':
+        metadata = item.get('metadata') or {}
+        spec = item.get('spec') or {}
+        pod_spec = (spec.get('template') or {}).get('spec') or {}
+        status = item.get('status') or {}
+        containers = tuple((c.get('name', ''), c.get('image', ''))
+                           for c in pod_spec.get('containers') or [])
+        return cls(
+            name=metadata.get('name', ''),
+            namespace=sys.intern(metadata.get('namespace') or 'default'),
+            containers=containers,
+            labels=intern_labels(metadata.get('labels')),
+            desired=spec.get('replicas'),
+            has_status=bool(status),
+            replicas=status.get('replicas'),
+            # The API server leaves out counts that are zero.
+            ready=status.get('readyReplicas', 0),
+            updated=status.get('updatedReplicas', 0))
+
+
+def summaries(items: List[dict], consume: bool=True) -> Iterator[Deployment]:
+    '''
+    summaries yields the summary of every item. Unless told otherwise the
+    list is consumed, so that every item can be freed once it was parsed.
+    '''
+    if not consume:
+        for item in items:
+            yield Deployment.from_dict(item)
+        return
+
+    items.reverse()
+    while items:
+        yield Deployment.from_dict(items.pop())
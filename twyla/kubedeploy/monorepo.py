@@ -0,0 +1,93 @@
+import os
+from typing import List, NamedTuple, Optional
+
+import git
+
+from twyla.kubedeploy import docker_helpers, serialization
+from twyla.kubedeploy.kube import Kube
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+
+
+class Service(NamedTuple):
+    path: str
+    config: dict
+
+
+class PlannedService(NamedTuple):
+    service: Service
+    deployed: Optional[str]
+    changed: bool
+
+
+def find_services(root: str, config_file: str,
+                  deployment_template: str='deployment.yml') -> List[Service]:
+    '''
+    find_services returns all directories below root that contain both a
+    kubedeploy configuration and a deployment template.
+    '''
+    services = []
+    for path, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        if config_file in files and deployment_template in files:
+            with open(os.path.join(path, config_file)) as fd:
+                config = serialization.load_yaml(fd) or {}
+            services.append(Service(path=path, config=config))
+
+    return services
+
+
+def deployed_version(kube: Kube, image: str) -> Optional[str]:
+    try:
+        deployment = kube.get_remote_deployment()
+    except KubectlCallFailed:
+        return None
+
+    for container in deployment['spec']['template']['spec']['containers']:
+        try:
+            _, repository, version = docker_helpers.tag_components(
+                container['image'])
+        except ValueError:
+            # Images without registry or version, e.g. sidecars like nginx.
+            continue
+        if repository == image:
+            return version
+
+    return None
+
+
+def service_changed(repo: git.Repo, path: str,
+                    deployed: Optional[str], target: str) -> bool:
+    if deployed is None:
+        return True
+
+    rel_path = os.path.relpath(os.path.abspath(path), repo.working_tree_dir)
+    try:
+        diff = repo.git.diff('--name-only', deployed, target, '--', rel_path)
+    except git.GitCommandError:
+        # The deployed version is not a commit known to the repository (e.g. a
+        # content hash or a manually set version), so it can not be compared.
+        return True
+
+    return bool(diff.strip())
+
+
+def plan(root: str, target: str, config_file: str) -> List[PlannedService]:
+    repo = git.Repo(root, search_parent_directories=True)
+    planned = []
+    for service in find_services(root, config_file):
+        image = service.config.get('image')
+        if image is None:
+            continue
+
+        # The deployment is named after the image just like in deploy.
+        kube = Kube(namespace=service.config.get('namespace', 'default'),
+                    deployment_name=image,
+                    printer=lambda msg: None,
+                    error_printer=lambda msg: None)
+        deployed = deployed_version(kube, image)
+        changed = service_changed(repo, service.path, deployed, target)
+        planned.append(PlannedService(service=service,
+                                      deployed=deployed,
+                                      changed=changed))
+
+    return planned
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List
+
+from twyla.kubedeploy.prompt import carry_output
+
+
+class Pipeline:
+    '''
+    Pipeline runs phases concurrently as soon as the phases they require are
+    done. Every phase is called with the results of all phases finished so
+    far. If a phase fails, no further phases are started and the exception is
+    raised from run.
+    '''
+    def __init__(self, jobs: int=4):
+        self.jobs = jobs
+        self.phases = OrderedDict()
+        self.results = {}
+        self.timings = {}
+        self.origin = None
+
+
+    def add(self, name: str, func: Callable[[Dict], object],
+            requires: Iterable[str]=()):
+        requires = tuple(requires)
+        for required in requires:
+            if required not in self.phases:
+                raise ValueError('Unknown phase {} required by {}'.format(
+                    required, name))
+        self.phases[name] = (func, requires)
+
+
+    def _run_phase(self, name: str, func: Callable[[Dict], object]):
+        started = time.monotonic() - self.origin
+        try:
+            return func(self.results)
+        finally:
+            self.timings[name] = (started, time.monotonic() - self.origin)
+
+
+    def run(self) -> Dict[str, object]:
+        self.origin = time.monotonic()
+        pending = OrderedDict(self.phases)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while pending or running:
+                    for name, (func, requires) in list(pending.items()):
+                        if all(r in self.results for r in requires):
+                            del pending[name]
+                            future = executor.submit(
+                                carry_output(self._run_phase), name, func)
+                            running[future] = name
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        self.results[name] = future.result()
+            except BaseException:
+                for future in running:
+                    future.cancel()
+                raise
+
+        return self.results
+
+
+    def critical_path(self) -> List[str]:
+        '''
+        critical_path returns the chain of phases that determined the total
+        run time: starting with the phase that finished last, follow the
+        required phase that finished last.
+        '''
+        if not self.timings:
+            return []
+
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while True:
+            requires = [r for r in self.phases[name][1] if r in self.timings]
+            if not requires:
+                break
+            name = max(requires, key=lambda r: self.timings[r][1])
+            path.append(name)
+
+        return list(reversed(path))
+
+
+    def print_profile(self, printer: Callable[[str], int]):
+        critical = self.critical_path()
+        printer('Profile:')
+        for name in sorted(self.timings, key=lambda n: self.timings[n]):
+            started, finished = self.timings[name]
+            printer('{} {:<10} {:7.3f}s - {:7.3f}s ({:.3f}s)'.format(
+                '*' if name in critical else ' ', name, started, finished,
+                finished - started), 2)
+        if critical:
+            printer('critical path: {} ({:.3f}s)'.format(
+                ' -> '.join(critical), self.timings[critical[-1]][1]), 2)
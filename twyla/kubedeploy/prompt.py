@@ -1,5 +1,10 @@
-import colorama
+import functools
+import io
 import sys
+import threading
+from typing import Callable
+
+import colorama
 
 # Use a colorized prompt to differentiate output of this script from output
 # that is generated by called programs and libraries
@@ -17,3 +22,76 @@ def error_prompt(msg: str, indent: int=0):
     indentation = ' ' * indent
     sys.stdout.write(colorama.Fore.RED + PROMPT + indentation)
     print(msg)
+
+
+class ThreadLocalStream(io.TextIOBase):
+    '''
+    ThreadLocalStream passes writes on to the stream set for the current
+    thread, or to fallback. It replaces sys.stdout and sys.stderr in the
+    daemon so that the output of every request goes to its own client.
+    '''
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+
+    @property
+    def stream(self):
+        return getattr(self.local, 'stream', None)
+
+
+    @property
+    def target(self):
+        return self.stream or self.fallback
+
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+
+    def set(self, stream):
+        self.local.stream = stream
+
+
+    def writable(self) -> bool:
+        return True
+
+
+    def write(self, text: str) -> int:
+        return self.target.write(text)
+
+
+    def flush(self):
+        self.target.flush()
+
+
+    def bind(self, function: Callable) -> Callable:
+        '''
+        bind wraps function so that it writes to the stream of the current
+        thread, whichever thread runs it.
+        '''
+        stream = self.stream
+
+        @functools.wraps(function)
+        def bound(*args, **kwargs):
+            previous = self.stream
+            self.set(stream)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.set(previous)
+
+        return bound
+
+
+def carry_output(function: Callable) -> Callable:
+    '''
+    carry_output wraps function so that the output it writes in another
+    thread goes where the output of the calling thread goes. Requests pass
+    their functions through it before handing them to a thread or a pool.
+    '''
+    for stream in (sys.stdout, sys.stderr):
+        if isinstance(stream, ThreadLocalStream):
+            function = stream.bind(function)
+    return function
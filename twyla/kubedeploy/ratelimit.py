@@ -0,0 +1,121 @@
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    '''
+    TokenBucket limits requests to qps per second on average while allowing
+    bursts of up to burst requests. Tokens are reserved when acquired, so a
+    caller taking more tokens than are available waits for exactly the
+    missing ones and callers are served in the order they arrive. A qps of
+    None or 0 disables the limit.
+    '''
+    def __init__(self, qps: float=None, burst: int=1,
+                 clock: Callable[[], float]=time.monotonic,
+                 sleep: Callable[[float], None]=time.sleep):
+        self.qps = qps
+        self.burst = max(burst, 1)
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(self.burst)
+        self.last = clock()
+        self.lock = threading.Lock()
+
+
+    def reserve(self, tokens: int=1) -> float:
+        '''
+        reserve takes tokens from the bucket and returns the number of
+        seconds to wait before using them.
+        '''
+        if not self.qps:
+            return 0.0
+
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.qps)
+            self.last = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.qps
+
+
+    def acquire(self, tokens: int=1):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+
+
+# Defaults for all API traffic of one kubedeploy process.
+DEFAULT_QPS = 10.0
+DEFAULT_BURST = 20
+
+# kubectl reports a 429 from the API server as TooManyRequests and includes
+# the Retry-After delay in some versions.
+THROTTLED = re.compile(rb'TooManyRequests|too many requests', re.IGNORECASE)
+RETRY_AFTER = re.compile(rb'retry[- ]after:?\s*(\d+(?:\.\d+)?)\s*s?',
+                         re.IGNORECASE)
+
+_shared = TokenBucket(qps=DEFAULT_QPS, burst=DEFAULT_BURST)
+
+
+def shared_limiter() -> TokenBucket:
+    return _shared
+
+
+def configure(qps: float=DEFAULT_QPS, burst: int=DEFAULT_BURST):
+    '''
+    configure sets the limits of the limiter shared by all Kubectl instances.
+    The tokens are only reset when the limits change, so that runs sharing a
+    process do not refill the bucket for each other.
+    '''
+    with _shared.lock:
+        if _shared.qps == qps and _shared.burst == max(burst, 1):
+            return
+        _shared.qps = qps
+        _shared.burst = max(burst, 1)
+        _shared.tokens = float(_shared.burst)
+        _shared.last = _shared.clock()
+
+
+def is_throttled(stderr: bytes) -> bool:
+    return bool(THROTTLED.search(stderr or b''))
+
+
+def retry_after(stderr: bytes) -> Optional[float]:
+    match = RETRY_AFTER.search(stderr or b'')
+    if match is None:
+        return None
+    return float(match.group(1))
+
+
+class Backoff:
+    '''
+    Backoff computes how long to wait before retrying a throttled request.
+    The delay the server asked for is honored, otherwise the delay grows
+    exponentially up to cap. Both are jittered so that concurrent callers
+    throttled at the same time do not retry at the same time.
+    '''
+    def __init__(self, base: float=0.5, cap: float=30.0, retries: int=5,
+                 jitter: Callable[[], float]=random.random,
+                 sleep: Callable[[float], None]=time.sleep):
+        self.base = base
+        self.cap = cap
+        self.retries = retries
+        self.jitter = jitter
+        self.sleep = sleep
+
+
+    def delay(self, attempt: int, after: float=None) -> float:
+        if after is not None:
+            return after + self.jitter() * self.base
+        # Full jitter: anywhere between no delay and the exponential one.
+        return self.jitter() * min(self.cap, self.base * 2 ** attempt)
+
+
+    def wait(self, attempt: int, after: float=None):
+        self.sleep(self.delay(attempt, after))
@@ -0,0 +1,123 @@
+import argparse
+import json
+import time
+from typing import IO, Callable, Iterable, List, Union
+
+import yaml
+
+try:
+    from yaml import CSafeDumper, CSafeLoader
+except ImportError:
+    # PyYAML was built without libyaml.
+    CSafeDumper = CSafeLoader = None
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, install with the speedups extra to enable it.
+    orjson = None
+
+# The fastest available backends. All of them produce and accept the same
+# documents, the C versions are just faster.
+Loader = CSafeLoader or yaml.SafeLoader
+Dumper = CSafeDumper or yaml.SafeDumper
+
+YAMLError = yaml.YAMLError
+
+
+def load_yaml(stream: Union[str, bytes, IO]):
+    return yaml.load(stream, Loader=Loader)
+
+
+def load_all_yaml(stream: Union[str, bytes, IO]):
+    return yaml.load_all(stream, Loader=Loader)
+
+
+def dump_yaml(data, stream: IO=None):
+    return yaml.dump(data, stream, Dumper=Dumper, default_flow_style=False)
+
+
+def dump_all_yaml(documents: Iterable, stream: IO=None):
+    return yaml.dump_all(documents, stream, Dumper=Dumper,
+                         default_flow_style=False)
+
+
+def loads_json(data: Union[str, bytes]):
+    '''
+    loads_json decodes JSON directly from the bytes kubectl writes without
+    decoding them to a string first if orjson is installed.
+    '''
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def yaml_backends() -> dict:
+    backends = {'python': (yaml.SafeLoader, yaml.SafeDumper)}
+    if CSafeLoader is not None:
+        backends['libyaml'] = (CSafeLoader, CSafeDumper)
+    return backends
+
+
+def json_backends() -> dict:
+    backends = {'json': json.loads}
+    if orjson is not None:
+        backends['orjson'] = orjson.loads
+    return backends
+
+
+def measure(func: Callable[[], object], rounds: int) -> float:
+    # The best of several rounds is the least disturbed by other processes.
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def benchmark(snapshot: dict, rounds: int=5) -> List[tuple]:
+    '''
+    benchmark times loading and dumping snapshot as YAML and decoding it
+    from JSON bytes with every available backend. It returns tuples of the
+    operation, the backend and the best time in seconds.
+    '''
+    results = []
+    for name, (loader, dumper) in yaml_backends().items():
+        text = yaml.dump(snapshot, Dumper=dumper, default_flow_style=False)
+        results.append(('yaml load', name, measure(
+            lambda: yaml.load(text, Loader=loader), rounds)))
+        results.append(('yaml dump', name, measure(
+            lambda: yaml.dump(snapshot, Dumper=dumper,
+                              default_flow_style=False), rounds)))
+
+    raw = json.dumps(snapshot).encode('utf8')
+    for name, decode in json_backends().items():
+        results.append(('json decode', name, measure(
+            lambda: decode(raw), rounds)))
+
+    return results
+
+
+def main(args: List[str]=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the serialization backends on a snapshot, e.g. '
+                    'a file written by kubedeploy cluster_info --dump-to.')
+    parser.add_argument('snapshot', help='YAML file with a Kubernetes List')
+    parser.add_argument('--rounds', type=int, default=5)
+    options = parser.parse_args(args)
+
+    with open(options.snapshot) as fd:
+        snapshot = load_yaml(fd)
+
+    print('{} items, {} bytes of JSON'.format(
+        len(snapshot.get('items') or []), len(json.dumps(snapshot))))
+    for operation, backend, elapsed in benchmark(snapshot, options.rounds):
+        print('{:<12} {:<8} {:8.2f}ms'.format(operation, backend,
+                                              elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import gzip
+import io
+import os
+from typing import IO, Iterable, Iterator, List
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is optional, install with the zstd extra to enable it.
+    zstandard = None
+
+from twyla.kubedeploy import serialization
+
+GZIP_EXTENSIONS = ['.gz', '.gzip']
+ZSTD_EXTENSIONS = ['.zst', '.zstd']
+
+
+
+class CompressionUnavailable(Exception):
+    pass
+
+
+# Metadata that is specific to the cluster an object lives in.
+METADATA_SCRUB = ['annotations', 'creationTimestamp',
+                  'generation', 'resourceVersion',
+                  'selfLink', 'uid']
+
+
+def scrub_item(item: dict, in_place: bool=False) -> dict:
+    '''
+    scrub_item removes the status and cluster specific metadata of item. If
+    the caller owns item it is scrubbed in place, otherwise a new object is
+    projected from the remaining fields. The projection shares everything
+    but the top level and the metadata with item, so it must not be modified.
+    '''
+    if in_place:
+        item.pop('status', None)
+        for data in METADATA_SCRUB:
+            item['metadata'].pop(data, None)
+        return item
+
+    scrubbed = {k: v for k, v in item.items() if k != 'status'}
+    scrubbed['metadata'] = {k: v for k, v in item['metadata'].items()
+                            if k not in METADATA_SCRUB}
+    return scrubbed
+
+
+def scrub_items(items: List[dict], in_place: bool=False) -> Iterator[dict]:
+    '''
+    scrub_items yields scrubbed items one by one. When scrubbing in place the
+    list is consumed so that every item can be freed once it was handled.
+    '''
+    if not in_place:
+        for item in items:
+            yield scrub_item(item)
+        return
+
+    items.reverse()
+    while items:
+        yield scrub_item(items.pop(), in_place=True)
+
+
+def scrub_cluster_info(state: dict, in_place: bool=False) -> dict:
+    '''
+    scrub_cluster_info removes state information that is not required to deploy
+    the cluster state to another cluster.
+    '''
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'metadata': {},
+        'items': list(scrub_items(state.get('items'), in_place=in_place)),
+    }
+
+
+class ListWriter:
+    '''
+    ListWriter writes a Kubernetes List to fd as a stream. The header is
+    written when the writer is entered, every item is serialized and flushed
+    on its own, and the List is closed when the writer is left. The output is
+    the same as dumping the whole List at once. Items are emitted with the
+    libyaml C emitter when it is available.
+    '''
+    def __init__(self, fd: IO[str]):
+        self.fd = fd
+        self.count = 0
+
+
+    def header(self):
+        # Keys are written in sorted order like yaml.dump does.
+        self.fd.write('apiVersion: v1\n')
+
+
+    def trailer(self):
+        self.fd.write('kind: List\nmetadata: {}\n')
+
+
+    def __enter__(self):
+        self.header()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return False
+        if self.count == 0:
+            self.fd.write('items: []\n')
+        self.trailer()
+        self.fd.flush()
+        return False
+
+
+    def write(self, item: dict):
+        if self.count == 0:
+            self.fd.write('items:\n')
+        serialization.dump_yaml([item], self.fd)
+        self.fd.flush()
+        self.count += 1
+
+
+def write_list(fd: IO[str], items: Iterable[dict]) -> int:
+    '''
+    write_list streams items as a Kubernetes List to fd and returns the number
+    of items written.
+    '''
+    with ListWriter(fd) as writer:
+        for item in items:
+            writer.write(item)
+
+    return writer.count
+
+
+class DeferredFlush(io.BufferedIOBase):
+    '''
+    DeferredFlush passes writes on to a compressing stream but not flushes.
+    Every flush ends a block of the compressed stream, so flushing every
+    item of a List would cost most of the compression. The stream is
+    finished when it is closed.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+
+
+    def writable(self) -> bool:
+        return True
+
+
+    def write(self, data: bytes) -> int:
+        return self.stream.write(data)
+
+
+    def flush(self):
+        pass
+
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.stream.close()
+        finally:
+            super().close()
+
+
+def open_snapshot(path: str, mode: str='r') -> IO[str]:
+    '''
+    open_snapshot opens a snapshot file for reading or writing text. Files
+    ending in .gz or .zst are compressed and decompressed as a stream while
+    they are written and read, other files are plain YAML.
+    '''
+    if mode not in ('r', 'w'):
+        raise ValueError('Invalid mode {}'.format(mode))
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in GZIP_EXTENSIONS:
+        if mode == 'w':
+            return io.TextIOWrapper(DeferredFlush(gzip.open(path, mode='wb')),
+                                    encoding='utf8')
+        return gzip.open(path, mode=mode + 't', encoding='utf8')
+
+    if extension in ZSTD_EXTENSIONS:
+        if zstandard is None:
+            raise CompressionUnavailable(
+                'zstandard is not installed, can not open {}'.format(path))
+        raw = open(path, mode=mode + 'b')
+        if mode == 'w':
+            stream = DeferredFlush(
+                zstandard.ZstdCompressor().stream_writer(raw))
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf8')
+
+    return open(path, mode=mode)
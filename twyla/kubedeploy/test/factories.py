@@ -0,0 +1,43 @@
+# Kubernetes objects shared by the tests.
+from typing import Dict, List, Tuple
+
+
+def deployment(name: str, namespace: str='twyla', version: str='1',
+               replicas: int=2, ready: int=None, updated: int=None,
+               image: str=None, labels: Dict[str, str]=None,
+               status: dict=None, sidecars: List[Tuple[str, str]]=()):
+    '''
+    deployment returns a deployment the way the API server lists it, rolled
+    out to all replicas unless ready, updated or status say otherwise.
+    '''
+    if labels is None:
+        labels = {'app': name, 'servicegroup': 'twyla'}
+    if status is None:
+        status = {
+            'replicas': replicas,
+            'readyReplicas': replicas if ready is None else ready,
+            'updatedReplicas': replicas if updated is None else updated,
+        }
+    containers = [{'name': name, 'image': image or 'reg/{}:v1'.format(name)}]
+    containers.extend({'name': n, 'image': i} for n, i in sidecars)
+    return {
+        'apiVersion': 'apps/v1',
+        'kind': 'Deployment',
+        'metadata': {
+            'annotations': {'deployment.kubernetes.io/revision': '3'},
+            'creationTimestamp': '2017-10-16T14:55:37Z',
+            'generation': 3,
+            'labels': labels,
+            'name': name,
+            'namespace': namespace,
+            'resourceVersion': version,
+            'selfLink': '/apis/apps/v1/namespaces/{}/deployments/{}'.format(
+                namespace, name),
+            'uid': '120abf54-b282-11e7-b58f-000d3a2bee3e',
+        },
+        'spec': {
+            'replicas': replicas,
+            'template': {'spec': {'containers': containers}},
+        },
+        'status': status,
+    }
@@ -0,0 +1,167 @@
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+
+from twyla.kubedeploy import batch
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+from twyla.kubedeploy.monorepo import Service
+
+
+SERVICES = b'''
+- image: service-one
+  path: services/one
+  namespace: twyla
+  variants: de, en
+- image: service-two
+  registry: other.registry
+'''
+
+
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.printer = mock.MagicMock()
+        self.error_printer = mock.MagicMock()
+        self.prepare_build = mock.MagicMock()
+        self.services = [
+            Service(path='services/one', config={'image': 'service-one',
+                                                 'namespace': 'twyla'}),
+            Service(path='services/two', config={'image': 'service-two'}),
+        ]
+
+
+    def make_deployer(self, **kwargs):
+        return batch.BatchDeploy(registry='myreg',
+                                 version='githash',
+                                 printer=self.printer,
+                                 error_printer=self.error_printer,
+                                 prepare_build=self.prepare_build,
+                                 **kwargs)
+
+
+    def test_load_services(self):
+        tmp = tempfile.NamedTemporaryFile(delete=False)
+        tmp.write(SERVICES)
+        tmp.close()
+
+        services = batch.load_services(tmp.name)
+        os.unlink(tmp.name)
+
+        assert services == [
+            Service(path='services/one', config={'image': 'service-one',
+                                                 'namespace': 'twyla',
+                                                 'variants': 'de, en'}),
+            Service(path='.', config={'image': 'service-two',
+                                      'registry': 'other.registry'}),
+        ]
+
+
+    @mock.patch('twyla.kubedeploy.batch.Kube')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.RegistrySession')
+    def test_run(self, mock_session, mock_Kube):
+        mock_session.return_value.image_exists.side_effect = \
+            lambda tag: 'service-one' in tag
+        deployer = self.make_deployer(jobs=2)
+
+        results = deployer.run(self.services)
+
+        assert results == [
+            batch.BatchResult('service-one', 'myreg/service-one:githash',
+                              batch.STATUS_DEPLOYED),
+            batch.BatchResult('service-two', 'myreg/service-two:githash',
+                              batch.STATUS_IMAGE_MISSING),
+        ]
+        mock_Kube.assert_called_once_with(
+            namespace='twyla',
+            deployment_name='service-one',
+            printer=mock.ANY,
+            error_printer=mock.ANY,
+            deployment_template='services/one/deployment.yml',
+            variants=None,
+            kubectl=deployer.kubectl('twyla'))
+        mock_Kube.return_value.apply.assert_called_once_with(
+            'myreg/service-one:githash')
+        # Only one registry session is shared by all services.
+        mock_session.assert_called_once_with()
+
+
+    @mock.patch('twyla.kubedeploy.batch.Kube')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.RegistrySession')
+    def test_run_failure_does_not_block_others(self, mock_session, mock_Kube):
+        mock_session.return_value.image_exists.return_value = True
+        mock_Kube.return_value.apply.side_effect = [
+            KubectlCallFailed(b'forbidden\n'), None]
+        deployer = self.make_deployer(jobs=1)
+
+        results = deployer.run(self.services)
+
+        assert [r.status for r in results] == [batch.STATUS_FAILED,
+                                               batch.STATUS_DEPLOYED]
+        assert results[0].message == 'forbidden'
+        assert not results[0].ok
+
+
+    @mock.patch('twyla.kubedeploy.batch.Kube')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.RegistrySession')
+    def test_run_service_without_image(self, mock_session, mock_Kube):
+        mock_session.return_value.image_exists.return_value = True
+        services = [Service(path='services/broken', config={})] + \
+            self.services[1:]
+        deployer = self.make_deployer(jobs=1)
+
+        results = deployer.run(services)
+
+        assert results[0] == batch.BatchResult(
+            'services/broken', '', batch.STATUS_FAILED,
+            'No image configured for services/broken')
+        assert results[1].status == batch.STATUS_DEPLOYED
+
+
+    @mock.patch('twyla.kubedeploy.batch.Kube')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.docker_image')
+    @mock.patch('twyla.kubedeploy.batch.docker')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.RegistrySession')
+    def test_run_local_builds(self, mock_session, mock_docker,
+                              mock_docker_image, mock_Kube):
+        mock_session.return_value.image_exists.return_value = True
+        deployer = self.make_deployer(local=True, build_jobs=2)
+
+        deployer.run(self.services[:1])
+
+        self.prepare_build.assert_called_once_with('services/one')
+        client = mock_docker.from_env.return_value
+        mock_docker_image.assert_has_calls([
+            mock.call('build', 'myreg/service-one:githash',
+                      path='services/one', client=client),
+            mock.call('push', 'myreg/service-one:githash', client=client),
+        ])
+
+
+    @mock.patch('twyla.kubedeploy.batch.Kube')
+    @mock.patch('twyla.kubedeploy.batch.docker_helpers.RegistrySession')
+    def test_run_dry(self, mock_session, mock_Kube):
+        mock_session.return_value.image_exists.return_value = True
+        deployer = self.make_deployer(dry=True)
+
+        results = deployer.run(self.services)
+
+        assert [r.status for r in results] == [batch.STATUS_DRY] * 2
+        mock_Kube.assert_not_called()
+
+
+    def test_print_results(self):
+        results = [
+            batch.BatchResult('one', 'reg/one:v1', batch.STATUS_DEPLOYED),
+            batch.BatchResult('service-two', 'reg/service-two:v1',
+                              batch.STATUS_FAILED, 'forbidden'),
+        ]
+
+        batch.print_results(results, self.printer, self.error_printer)
+
+        assert self.printer.call_args_list == [
+            mock.call('NAME         TAG                 STATUS'),
+            mock.call('one          reg/one:v1          deployed'),
+        ]
+        self.error_printer.assert_called_once_with(
+            'service-two  reg/service-two:v1  failed: forbidden')
@@ -0,0 +1,170 @@
+import threading
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from twyla.kubedeploy import chunked
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+
+
+def make_list(count):
+    return {
+        'apiVersion': 'v1',
+        'kind': 'List',
+        'metadata': {},
+        'items': [{'kind': 'Deployment', 'metadata': {'name': str(i)}}
+                  for i in range(count)],
+    }
+
+
+def names(manifest):
+    return [i['metadata']['name'] for i in yaml.safe_load(manifest)['items']]
+
+
+class ChunkedApplyTests(unittest.TestCase):
+
+    def test_chunk_list(self):
+        chunks = chunked.chunk_list(make_list(5), 2)
+
+        assert [len(c['items']) for c in chunks] == [2, 2, 1]
+        assert all(c['kind'] == 'List' for c in chunks)
+
+
+    def test_chunk_list_small(self):
+        kube_list = make_list(2)
+
+        assert chunked.chunk_list(kube_list, 2) == [kube_list]
+        assert chunked.chunk_list({'some': 'yaml'}, 2) == [{'some': 'yaml'}]
+
+
+    def test_results_concurrent_and_ordered(self):
+        barrier = threading.Barrier(2, timeout=5)
+        kubectl = mock.MagicMock()
+
+        def apply_manifest(manifest, on_error):
+            applied = names(manifest)
+            # Only passes if two chunks are applied at the same time.
+            barrier.wait()
+            return iter(['deployment "{}" configured'.format(n)
+                         for n in applied])
+
+        kubectl.apply_manifest.side_effect = apply_manifest
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2, jobs=2)
+
+        results = list(applier.results(chunked.chunk_list(make_list(4), 2)))
+
+        assert [r.index for r in results] == [0, 1]
+        assert results[1].lines == ['deployment "2" configured',
+                                    'deployment "3" configured']
+        assert all(r.ok for r in results)
+
+
+    def test_results_reported_when_earlier_chunks_are_done(self):
+        second_done = threading.Event()
+        kubectl = mock.MagicMock()
+
+        def apply_manifest(manifest, on_error):
+            if '2' in names(manifest):
+                assert second_done.wait(5)
+                return iter(['slow'])
+            return iter(['fast'])
+
+        kubectl.apply_manifest.side_effect = apply_manifest
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2, jobs=2)
+
+        results = applier.results(chunked.chunk_list(make_list(4), 2))
+        # The first chunk is reported while the second is still running.
+        assert next(results).lines == ['fast']
+        second_done.set()
+        assert next(results).lines == ['slow']
+
+
+    def test_failed_chunk_does_not_block_others(self):
+        kubectl = mock.MagicMock()
+
+        def apply_manifest(manifest, on_error):
+            if '0' in names(manifest):
+                on_error('error: something is wrong')
+                raise KubectlCallFailed(b'kubectl exited with status 1\n')
+            return iter(['ok', ''])
+
+        kubectl.apply_manifest.side_effect = apply_manifest
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2, jobs=2)
+
+        failed, applied = applier.results(chunked.chunk_list(make_list(3), 2))
+
+        assert not failed.ok
+        assert failed.errors == ['error: something is wrong']
+        assert failed.message == 'kubectl exited with status 1'
+        assert applied.ok
+        assert applied.lines == ['ok']
+
+
+    @mock.patch('twyla.kubedeploy.chunked.TokenBucket')
+    def test_rate_limit_per_object(self, mock_TokenBucket):
+        kubectl = mock.MagicMock()
+        kubectl.apply_manifest.side_effect = lambda *args, **kwargs: iter([])
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2, qps=5)
+
+        assert applier.run(make_list(3), mock.MagicMock(), mock.MagicMock())
+
+        mock_TokenBucket.assert_called_once_with(qps=5, burst=2)
+        acquired = mock_TokenBucket.return_value.acquire.call_args_list
+        assert sorted(acquired) == [mock.call(1), mock.call(2)]
+
+
+    def test_run_single_chunk_streams(self):
+        kubectl = mock.MagicMock()
+        printer = mock.MagicMock()
+        error_printer = mock.MagicMock()
+
+        def apply_manifest(manifest, on_error):
+            yield 'one'
+            # Every line is printed before the next one is read.
+            printer.assert_called_once_with('one')
+            on_error('warning')
+            yield 'two'
+
+        kubectl.apply_manifest.side_effect = apply_manifest
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2)
+
+        assert applier.run(make_list(2), printer, error_printer)
+
+        assert printer.call_args_list == [mock.call('one'), mock.call('two')]
+        error_printer.assert_called_once_with('warning')
+
+
+    def test_run_single_chunk_failed(self):
+        kubectl = mock.MagicMock()
+        kubectl.apply_manifest.side_effect = KubectlCallFailed(b'broken\n')
+        error_printer = mock.MagicMock()
+        applier = chunked.ChunkedApply(kubectl, chunk_size=2)
+
+        assert not applier.run(make_list(1), mock.MagicMock(), error_printer)
+
+        error_printer.assert_called_once_with('broken')
+
+
+    def test_print_report(self):
+        printer = mock.MagicMock()
+        error_printer = mock.MagicMock()
+        results = [
+            chunked.ChunkResult(0, 2, ['one', 'two'], []),
+            chunked.ChunkResult(1, 1, [], ['bad'], 'failed'),
+        ]
+
+        assert not chunked.print_report(iter(results), 2, printer,
+                                        error_printer)
+
+        assert printer.call_args_list == [
+            mock.call('chunk 1/2: items 1-2'),
+            mock.call('one', 2),
+            mock.call('two', 2),
+        ]
+        assert error_printer.call_args_list == [
+            mock.call('chunk 2/2: items 3-3'),
+            mock.call('bad', 2),
+            mock.call('failed', 2),
+            mock.call('1 of 2 chunks failed'),
+        ]
@@ -0,0 +1,98 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+from twyla.kubedeploy import client
+
+
+class ClientTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+
+    def test_command_of(self):
+        assert client.command_of(['info', '--name', 'x']) == 'info'
+        assert client.command_of(['--qps', '5', 'deploy']) == 'deploy'
+        assert client.command_of(['--help']) is None
+
+
+    def test_is_forwardable(self):
+        assert client.is_forwardable(['cluster-info', '--namespace', 'a'])
+        assert not client.is_forwardable(['cluster-info', '--watch'])
+        assert not client.is_forwardable(['build'])
+
+
+    def test_forwarded_env(self):
+        env = {'KUBEDEPLOY_NAME': 'svc', 'KUBECONFIG': '/k', 'HOME': '/h'}
+        assert client.forwarded_env(env) == {'KUBEDEPLOY_NAME': 'svc',
+                                             'KUBECONFIG': '/k'}
+
+
+    @mock.patch.dict('os.environ', {client.KUBEDEPLOY_SOCKET: '/run/k.sock'})
+    def test_socket_path(self):
+        assert client.socket_path() == '/run/k.sock'
+
+
+    def test_forward_without_daemon(self):
+        path = os.path.join(self.workdir, 'kubedeploy.sock')
+        assert client.forward(['info'], path=path) is None
+
+
+    def test_forward_stale_socket(self):
+        path = os.path.join(self.workdir, 'kubedeploy.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+
+        assert client.forward(['info'], path=path) is None
+
+
+    @mock.patch('twyla.kubedeploy.cli.cli')
+    @mock.patch('twyla.kubedeploy.client.forward')
+    def test_main_forwards(self, mock_forward, mock_cli):
+        mock_forward.return_value = 0
+
+        with mock.patch('sys.argv', ['kubedeploy', 'info', '--name', 'x']):
+            with self.assertRaises(SystemExit) as exit:
+                client.main()
+
+        assert exit.exception.code == 0
+        mock_forward.assert_called_once_with(['info', '--name', 'x'])
+        mock_cli.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.cli.cli')
+    @mock.patch('twyla.kubedeploy.client.forward')
+    def test_main_falls_back(self, mock_forward, mock_cli):
+        mock_forward.return_value = None
+
+        with mock.patch('sys.argv', ['kubedeploy', 'info', '--name', 'x']):
+            client.main()
+
+        mock_cli.assert_called_once_with(obj={})
+
+
+    @mock.patch('twyla.kubedeploy.cli.cli')
+    @mock.patch('twyla.kubedeploy.client.forward')
+    def test_main_not_forwarded(self, mock_forward, mock_cli):
+        with mock.patch('sys.argv', ['kubedeploy', 'build']):
+            client.main()
+
+        mock_forward.assert_not_called()
+        mock_cli.assert_called_once_with(obj={})
+
+
+    @mock.patch('twyla.kubedeploy.cli.cli')
+    @mock.patch('twyla.kubedeploy.client.forward')
+    def test_main_watch_not_forwarded(self, mock_forward, mock_cli):
+        with mock.patch('sys.argv', ['kubedeploy', 'cluster-info',
+                                     '--watch']):
+            client.main()
+
+        mock_forward.assert_not_called()
+        mock_cli.assert_called_once_with(obj={})
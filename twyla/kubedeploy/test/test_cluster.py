@@ -0,0 +1,58 @@
+import unittest
+import unittest.mock as mock
+
+from factories import deployment
+from twyla.kubedeploy import cluster
+
+
+class ClusterTests(unittest.TestCase):
+
+    def test_group_selector(self):
+        assert cluster.group_selector(['twyla']) == {'servicegroup': 'twyla'}
+        assert cluster.group_selector(['a', 'b']) == {
+            'servicegroup': ['a', 'b']}
+
+
+    @mock.patch('twyla.kubedeploy.cluster.Kubectl')
+    def test_list_deployments(self, mock_Kubectl):
+        kubectls = []
+
+        def make_kubectl():
+            kubectl = mock.MagicMock()
+
+            def list_deployments(selectors):
+                return {'items': [deployment('one', kubectl.namespace)]}
+
+            kubectl.list_deployments.side_effect = list_deployments
+            kubectls.append(kubectl)
+            return kubectl
+
+        mock_Kubectl.side_effect = make_kubectl
+
+        result = cluster.list_deployments(['prod', 'staging'], ['a', 'b'])
+
+        assert list(result) == ['prod', 'staging']
+        assert result['staging'] == [deployment('one', 'staging')]
+        assert sorted(k.namespace for k in kubectls) == ['prod', 'staging']
+        for kubectl in kubectls:
+            kubectl.list_deployments.assert_called_once_with(
+                selectors={'servicegroup': ['a', 'b']})
+
+
+    @mock.patch('twyla.kubedeploy.cluster.Kubectl')
+    def test_list_deployments_all_namespaces(self, mock_Kubectl):
+        mock_list = mock_Kubectl.return_value.list_deployments
+        mock_list.return_value = {'items': [
+            deployment('one', 'staging'),
+            deployment('two', 'prod'),
+            deployment('three', 'staging'),
+        ]}
+
+        result = cluster.list_deployments(['ignored'], ['twyla'],
+                                          all_namespaces=True)
+
+        mock_list.assert_called_once_with(
+            selectors={'servicegroup': 'twyla'}, all_namespaces=True)
+        assert list(result) == ['prod', 'staging']
+        assert [i['metadata']['name'] for i in result['staging']] == [
+            'one', 'three']
@@ -0,0 +1,107 @@
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pytest
+
+from twyla.kubedeploy.coalesce import DeployQueue, Superseded, now_ns
+
+
+class DeployQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.counter = itertools.count(1)
+
+
+    def queue(self, **kwargs) -> DeployQueue:
+        deploy_queue = DeployQueue('gke:prod/cluster', 'twyla', 'api',
+                                   queue_dir=self.workdir, poll=0.01,
+                                   clock=lambda: next(self.counter),
+                                   **kwargs)
+        deploy_queue.take()
+        self.addCleanup(deploy_queue.drop)
+        return deploy_queue
+
+
+    def test_now_ns(self):
+        first = now_ns()
+        assert isinstance(first, int)
+        assert now_ns() >= first > 10 ** 18
+
+
+    def test_take_and_drop(self):
+        deploy_queue = self.queue()
+
+        assert os.path.dirname(deploy_queue.directory) == os.path.join(
+            self.workdir, 'gke%3Aprod%2Fcluster', 'twyla')
+        assert deploy_queue.tickets() == [deploy_queue.ticket]
+        deploy_queue.drop()
+        assert deploy_queue.tickets() == []
+
+
+    def test_newest_wins(self):
+        old = self.queue()
+        new = self.queue()
+
+        with pytest.raises(Superseded) as error:
+            old.check()
+        assert 'twyla/api' in str(error.value)
+        new.check()
+
+
+    def test_dropped_ticket_does_not_supersede(self):
+        old = self.queue()
+        new = self.queue()
+        new.drop()
+
+        old.check()
+
+
+    def test_dead_ticket_ignored(self):
+        old = self.queue()
+        # A ticket nobody holds a lock on, left by a deploy that died.
+        dead = os.path.join(old.directory,
+                            '{:020d}-1-1.ticket'.format(100))
+        open(dead, mode='w').close()
+
+        old.check()
+        assert not os.path.exists(dead)
+
+
+    def test_turn_waits(self):
+        first = self.queue()
+        entered = threading.Event()
+
+        def wait_for_turn():
+            with second.turn():
+                entered.set()
+
+        with first.turn():
+            second = self.queue()
+            thread = threading.Thread(target=wait_for_turn)
+            thread.start()
+            # The newer deploy waits for the older one to finish applying.
+            assert not entered.wait(0.1)
+        thread.join(1)
+
+        assert entered.is_set()
+
+
+    def test_turn_superseded_while_waiting(self):
+        holder = self.queue()
+        newer = []
+
+        def sleep(seconds):
+            if not newer:
+                newer.append(self.queue())
+
+        with holder.turn():
+            waiting = self.queue(sleep=sleep)
+            with pytest.raises(Superseded):
+                with waiting.turn():
+                    pass
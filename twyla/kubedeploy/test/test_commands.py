@@ -1,14 +1,18 @@
+import gzip
 import os
+import shutil
 import tempfile
 import traceback
 import unittest
+from collections import OrderedDict
 from unittest import mock
 
 import pytest
 import yaml
 from click.testing import CliRunner
 
-from twyla import kubedeploy
+from twyla.kubedeploy import cli as kubedeploy
+from twyla.kubedeploy.coalesce import Superseded
 from twyla.kubedeploy.kubectl import KubectlCallFailed
 
 REQUIREMENTS = '''
@@ -20,8 +24,8 @@ git+ssh://git_package==0.0.1
 
 class DeployCommandTests(unittest.TestCase):
 
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.git')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
     def test_head_of_local(self, mock_git, mock_prompt):
         commitish = 'commitish'
         mock_repo = mock_git.Repo.return_value
@@ -42,12 +46,12 @@ class DeployCommandTests(unittest.TestCase):
         assert head == ['HEAD']
 
 
-    @mock.patch('twyla.kubedeploy.error_prompt')
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.git')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
     # NOTE: exiting should probably be handed up in the call stack by
     # reraising.
-    @mock.patch('twyla.kubedeploy.sys.exit')
+    @mock.patch('twyla.kubedeploy.cli.sys.exit')
     def test_head_of_inconclusive(self, mock_exit,
                                   mock_git, mock_prompt, mock_error_prompt):
         mock_exit.side_effect = SystemExit
@@ -67,9 +71,9 @@ class DeployCommandTests(unittest.TestCase):
         mock_exit.assert_called_once_with(1)
 
 
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.git')
-    @mock.patch('twyla.kubedeploy.sys.exit')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
+    @mock.patch('twyla.kubedeploy.cli.sys.exit')
     def test_head_single_remote(self, mock_exit, mock_git, mock_prompt):
         mock_exit.side_effect = SystemExit
         commitish = 'commitish'
@@ -98,9 +102,9 @@ class DeployCommandTests(unittest.TestCase):
         mock_exit.assert_not_called()
 
 
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.git')
-    @mock.patch('twyla.kubedeploy.sys.exit')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
+    @mock.patch('twyla.kubedeploy.cli.sys.exit')
     def test_head_multi_remote_difference(self, mock_exit,
                                           mock_git, mock_prompt):
         mock_exit.side_effect = SystemExit
@@ -157,9 +161,30 @@ key3:
         assert os.environ['KUBEDEPLOY_KEY3'] == 'en,de'
 
 
+    @mock.patch.dict(os.environ, {'KUBEDEPLOY_QPS': '5'})
+    @mock.patch('twyla.kubedeploy.ratelimit.configure')
+    @mock.patch('twyla.kubedeploy.cli.set_config')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl._list_entities')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_rate_limits(self, mock_prompt, mock_list, mock_set_config,
+                         mock_configure):
+        mock_list.return_value = {'items': []}
+        runner = CliRunner()
+
+        result = runner.invoke(kubedeploy.cli, ['cluster-info'])
+        assert result.exit_code == 0
+        mock_configure.assert_called_once_with(qps=5.0, burst=20)
+
+        mock_configure.reset_mock()
+        result = runner.invoke(kubedeploy.cli, ['--qps', '0', '--burst', '3',
+                                                'cluster-info'])
+        assert result.exit_code == 0
+        mock_configure.assert_called_once_with(qps=0.0, burst=3)
+
+
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
-    @mock.patch('twyla.kubedeploy.Kube')
-    @mock.patch('twyla.kubedeploy.head_of')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
     def test_deploy_master_head(self, mock_head_of, mock_Kube,
                                 mock_docker_exists):
         """When passed no arguments, the deploy command deploys head of
@@ -197,10 +222,64 @@ key3:
         )
 
 
+    @mock.patch('twyla.kubedeploy.coalesce.DeployQueue')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_deploy_queue(self, mock_head_of, mock_Kube, mock_docker_exists,
+                          mock_DeployQueue):
+        mock_head_of.return_value = 'githash'
+        mock_docker_exists.return_value = True
+        kube = mock_Kube.return_value
+        kube.kubectl.current_context.return_value = 'prod'
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy, ['--registry', 'reg',
+                                                   '--image', 'test-service',
+                                                   '--name', 'test-service',
+                                                   '--namespace', 'anamespace',
+                                                   '--queue'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_DeployQueue.assert_called_once_with('prod', 'anamespace',
+                                                 'test-service')
+        deploy_queue = mock_DeployQueue.return_value
+        deploy_queue.take.assert_called_once_with()
+        deploy_queue.check.assert_called_once_with()
+        deploy_queue.turn.assert_called_once_with()
+        deploy_queue.drop.assert_called_once_with()
+        kube.apply.assert_called_once_with('reg/test-service:githash')
+
+
+    @mock.patch('twyla.kubedeploy.coalesce.DeployQueue')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_deploy_queue_superseded(self, mock_head_of, mock_Kube,
+                                     mock_docker_exists, mock_DeployQueue):
+        mock_head_of.return_value = 'githash'
+        mock_docker_exists.return_value = True
+        deploy_queue = mock_DeployQueue.return_value
+        deploy_queue.check.side_effect = Superseded(
+            'Superseded by a newer deploy of anamespace/test-service.')
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy, ['--registry', 'reg',
+                                                   '--image', 'test-service',
+                                                   '--name', 'test-service',
+                                                   '--namespace', 'anamespace',
+                                                   '--queue'])
+
+        assert result.exit_code == 0
+        assert 'Superseded by a newer deploy' in result.output
+        mock_Kube.return_value.apply.assert_not_called()
+        deploy_queue.drop.assert_called_once_with()
+
+
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
-    @mock.patch('twyla.kubedeploy.Kube')
-    @mock.patch('twyla.kubedeploy.head_of')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
     def test_deploy_local_head(self, mock_head_of, mock_Kube,
                                mock_docker_exists, mock_docker_image):
         """When passed the local flag, the deploy command deploys head of the
@@ -241,16 +320,82 @@ key3:
         )
 
 
+    @mock.patch('twyla.kubedeploy.cli.download_requirements')
+    @mock.patch('twyla.kubedeploy.docker_helpers.context_hash')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_deploy_content_versioning(self, mock_head_of, mock_Kube,
+                                       mock_docker_exists, mock_docker_image,
+                                       mock_context_hash, mock_downloader):
+        """With content versioning an existing image for the same build
+        context is deployed without building and pushing it again"""
+        mock_context_hash.return_value = 'c0ffee123456'
+        mock_docker_exists.return_value = True
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy, ['--registry',
+                                                   'myown.private.registry',
+                                                   '--image',
+                                                   'test-service',
+                                                   '--name',
+                                                   'test-deployment',
+                                                   '--versioning',
+                                                   'content',
+                                                   '--local'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_head_of.assert_not_called()
+        mock_context_hash.assert_called_once_with(os.getcwd())
+        mock_docker_image.assert_not_called()
+        mock_downloader.assert_not_called()
+        kube = mock_Kube.return_value
+        kube.apply.assert_called_once_with(
+            'myown.private.registry/test-service:c0ffee123456'
+        )
+
+
+    @mock.patch('twyla.kubedeploy.docker_helpers.context_hash')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
+    @mock.patch('twyla.kubedeploy.cli.download_requirements')
+    def test_build_content_versioning(self, mock_downloader,
+                                      mock_docker_exists, mock_docker_image,
+                                      mock_context_hash):
+        mock_context_hash.return_value = 'c0ffee123456'
+        mock_docker_exists.return_value = False
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.build, ['--registry',
+                                                  'myown.private.registry',
+                                                  '--image',
+                                                  'test-service',
+                                                  '--versioning',
+                                                  'content'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_docker_exists.assert_called_once_with(
+            'myown.private.registry/test-service:c0ffee123456')
+        mock_docker_image.assert_called_once_with(
+            'build', 'myown.private.registry/test-service:c0ffee123456')
+
+
+    @mock.patch('twyla.kubedeploy.cli.validate_deployment')
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
-    @mock.patch('twyla.kubedeploy.Kube')
-    @mock.patch('twyla.kubedeploy.head_of')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
     def test_abort_on_dry_run(self,
                               mock_head_of,
                               mock_Kube,
-                              mock_docker_exists):
+                              mock_docker_exists,
+                              mock_validate):
         """
         On dry runs no deployment should be done.
         """
+        mock_validate.return_value = True
         mock_head_of.return_value = 'githash'
         mock_docker_exists.return_value = True
         runner = CliRunner()
@@ -270,10 +415,70 @@ key3:
         assert kube.apply.call_count == 0
 
 
-    @mock.patch('twyla.kubedeploy.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_deploy_profile(self, mock_head_of, mock_Kube,
+                            mock_docker_exists, mock_prompt):
+        mock_head_of.return_value = 'githash'
+        mock_docker_exists.return_value = True
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy, ['--registry',
+                                                   'myown.private.registry',
+                                                   '--image',
+                                                   'test-service',
+                                                   '--name',
+                                                   'test-deployment',
+                                                   '--profile'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_prompt.assert_any_call('Profile:')
+        critical = mock_prompt.call_args_list[-1][0][0]
+        assert critical.startswith('critical path: validate -> ')
+        assert '-> apply' in critical
+
+
+    @mock.patch('twyla.kubedeploy.validation.ManifestValidator')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_abort_on_invalid_manifest(self, mock_head_of, mock_Kube,
+                                       mock_docker_image, mock_error_prompt,
+                                       mock_validator):
+        """
+        Invalid manifests stop a dry run before git or docker are used.
+        """
+        mock_Kube.return_value.validate.return_value = ['Deployment/x: bad']
+        mock_validator.for_cluster.return_value.version = 'v1.10.0'
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy, ['--registry',
+                                                   'myown.private.registry',
+                                                   '--image',
+                                                   'test-service',
+                                                   '--name',
+                                                   'test-deployment',
+                                                   '--local',
+                                                   '--dry'])
+
+        assert result.exit_code == 1
+        mock_Kube.return_value.validate.assert_called_once_with(
+            'myown.private.registry/test-service:latest',
+            mock_validator.for_cluster.return_value)
+        mock_error_prompt.assert_has_calls([
+            mock.call('Manifests are invalid for v1.10.0:'),
+            mock.call('Deployment/x: bad', 4)])
+        mock_head_of.assert_not_called()
+        mock_docker_image.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image_exists')
-    @mock.patch('twyla.kubedeploy.Kube')
-    @mock.patch('twyla.kubedeploy.head_of')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
     def test_abort_on_missing_image(self, mock_head_of, mock_Kube,
                                     mock_docker_exists, mock_error_prompt):
         """
@@ -303,11 +508,11 @@ key3:
 
     @mock.patch('twyla.kubedeploy.docker_helpers.open',
                 new=mock.mock_open(read_data=REQUIREMENTS))
-    @mock.patch('twyla.kubedeploy.pip_main')
-    @mock.patch('twyla.kubedeploy.os')
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.tempfile')
-    @mock.patch('twyla.kubedeploy.shutil')
+    @mock.patch('twyla.kubedeploy.cli.pip_main')
+    @mock.patch('twyla.kubedeploy.cli.os')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.tempfile')
+    @mock.patch('twyla.kubedeploy.cli.shutil')
     def test_download_requirements_none(self,
                                         mock_shutil,
                                         mock_tempfile,
@@ -323,11 +528,11 @@ key3:
 
     @mock.patch('twyla.kubedeploy.docker_helpers.open',
                 new=mock.mock_open(read_data=REQUIREMENTS))
-    @mock.patch('twyla.kubedeploy.pip_main')
-    @mock.patch('twyla.kubedeploy.os')
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.tempfile')
-    @mock.patch('twyla.kubedeploy.shutil')
+    @mock.patch('twyla.kubedeploy.cli.pip_main')
+    @mock.patch('twyla.kubedeploy.cli.os')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.tempfile')
+    @mock.patch('twyla.kubedeploy.cli.shutil')
     def test_download_requirements_cache_exists(self,
                                                 mock_shutil,
                                                 mock_tempfile,
@@ -349,11 +554,11 @@ key3:
 
     @mock.patch('twyla.kubedeploy.docker_helpers.open',
                 new=mock.mock_open(read_data=REQUIREMENTS))
-    @mock.patch('twyla.kubedeploy.pip_main')
-    @mock.patch('twyla.kubedeploy.os')
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.tempfile')
-    @mock.patch('twyla.kubedeploy.shutil')
+    @mock.patch('twyla.kubedeploy.cli.pip_main')
+    @mock.patch('twyla.kubedeploy.cli.os')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.tempfile')
+    @mock.patch('twyla.kubedeploy.cli.shutil')
     def test_download_requirements(self,
                                    mock_shutil,
                                    mock_tempfile,
@@ -377,11 +582,11 @@ key3:
 
     @mock.patch('twyla.kubedeploy.docker_helpers.open',
                 new=mock.mock_open(read_data=REQUIREMENTS))
-    @mock.patch('twyla.kubedeploy.pip_main')
-    @mock.patch('twyla.kubedeploy.os')
-    @mock.patch('twyla.kubedeploy.prompt')
-    @mock.patch('twyla.kubedeploy.tempfile')
-    @mock.patch('twyla.kubedeploy.shutil')
+    @mock.patch('twyla.kubedeploy.cli.pip_main')
+    @mock.patch('twyla.kubedeploy.cli.os')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.tempfile')
+    @mock.patch('twyla.kubedeploy.cli.shutil')
     def test_download_requirements_force(self,
                                          mock_shutil,
                                          mock_tempfile,
@@ -410,8 +615,8 @@ key3:
 
 
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
-    @mock.patch('twyla.kubedeploy.head_of')
-    @mock.patch('twyla.kubedeploy.download_requirements')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    @mock.patch('twyla.kubedeploy.cli.download_requirements')
     def test_build(self, mock_downloader, mock_head_of, mock_docker_image):
         mock_head_of.return_value = 'githash'
         runner = CliRunner()
@@ -433,7 +638,7 @@ key3:
 
 
     @mock.patch('twyla.kubedeploy.docker_helpers.docker_image')
-    @mock.patch('twyla.kubedeploy.head_of')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
     def test_push(self, mock_head_of, mock_docker_image):
         mock_head_of.return_value = 'githash'
         runner = CliRunner()
@@ -453,7 +658,7 @@ key3:
             'push', 'myown.private.registry/test-service:githash')
 
 
-    @mock.patch('twyla.kubedeploy.Kube')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
     def test_info(self, mock_Kube):
         runner = CliRunner()
         result = runner.invoke(kubedeploy.info, ['--name',
@@ -473,8 +678,52 @@ key3:
         kube.info.assert_called_once_with()
 
 
-    @mock.patch('twyla.kubedeploy.set_config')
-    @mock.patch('twyla.kubedeploy.Kube')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    def test_info_many(self, mock_Kube):
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.info, ['--name', 'one, two',
+                                                 '--namespace', 'anamespace'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_Kube.assert_called_once_with(
+            namespace='anamespace',
+            deployment_name=None,
+            printer=kubedeploy.prompt,
+            error_printer=kubedeploy.error_prompt)
+        kube = mock_Kube.return_value
+        kube.info_many.assert_called_once_with(names=['one', 'two'],
+                                               selectors=None)
+        kube.info.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    def test_info_selector(self, mock_Kube):
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.info,
+                               ['--selector', 'servicegroup=twyla'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        kube = mock_Kube.return_value
+        kube.info_many.assert_called_once_with(names=[],
+                                               selectors='servicegroup=twyla')
+
+
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    def test_info_without_name(self, mock_Kube):
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.info, [])
+
+        assert result.exit_code == 1
+        assert 'Either --name or --selector is required.' in result.output
+        mock_Kube.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.cli.set_config')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
     def test_config_from_file(self, mock_Kube, mock_set_config):
         runner = CliRunner()
         env = {
@@ -497,8 +746,8 @@ key3:
         mock_set_config.called_once_with(kubedeploy.CONFIG_FILE)
 
 
-    @mock.patch('twyla.kubedeploy.set_config')
-    @mock.patch('twyla.kubedeploy.Kube')
+    @mock.patch('twyla.kubedeploy.cli.set_config')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
     def test_config_override(self, mock_Kube, mock_set_config):
         runner = CliRunner()
         env = {
@@ -522,8 +771,8 @@ key3:
         mock_set_config.called_once_with(kubedeploy.CONFIG_FILE)
 
 
-    @mock.patch('twyla.kubedeploy.Kubectl._list_entities')
-    @mock.patch('twyla.kubedeploy.prompt')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl._list_entities')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
     def test_cluster_info(self, mock_printer, mock_cluster_info):
         mock_cluster_info.return_value = {
             'items': [{
@@ -719,8 +968,8 @@ key3:
             assert item['metadata'].get('uid') is None
 
 
-    @mock.patch('twyla.kubedeploy.Kubectl._list_entities')
-    @mock.patch('twyla.kubedeploy.prompt')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl._list_entities')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
     def test_scrub_cluster_info(self, mock_printer, mock_list):
         mock_list.return_value = {
             "apiVersion": "v1",
@@ -922,8 +1171,8 @@ kind: List
 metadata: {}
 '''
 
-    @mock.patch('twyla.kubedeploy.Kubectl')
-    @mock.patch('twyla.kubedeploy.prompt')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
     def test_apply(self, mock_prompt, mock_kubectl):
         content = b'''apiVersion: v1
 items:
@@ -984,9 +1233,8 @@ metadata: {}'''
         tmp = tempfile.NamedTemporaryFile(delete=False)
         tmp.write(content)
         tmp.close()
-        mock_kubectl.return_value.apply.return_value = '''some
-test
-output'''
+        mock_kubectl.return_value.apply_manifest.return_value = iter(
+            ['some', 'test', 'output'])
 
         runner = CliRunner()
         result = runner.invoke(kubedeploy.apply,
@@ -997,22 +1245,26 @@ output'''
             self.fail()
 
         mock_kubectl.return_value.update_replicas.assert_called_once_with(
-            yaml.load(content))
-        mock_kubectl.return_value.apply.assert_called_once_with(
-            tmp.name)
+            yaml.safe_load(content))
+        mock_kubectl.return_value.apply_manifest.assert_called_once_with(
+            yaml.dump(yaml.safe_load(content), default_flow_style=False),
+            on_error=mock.ANY)
+        # The file passed in is not modified.
+        with open(tmp.name, mode='rb') as fd:
+            assert fd.read() == content
         assert mock_prompt.call_count == 3
         (one, two, three) = mock_prompt.call_args_list
         assert one == mock.call('some')
         assert two == mock.call('test')
         assert three == mock.call('output')
 
-    @mock.patch('twyla.kubedeploy.Kubectl')
-    @mock.patch('twyla.kubedeploy.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
     def test_apply_fail(self, mock_prompt, mock_kubectl):
-        def raiser(x):
+        def raiser(*args, **kwargs):
             raise KubectlCallFailed('some error output')
 
-        mock_kubectl.return_value.apply.side_effect = raiser
+        mock_kubectl.return_value.apply_manifest.side_effect = raiser
         content = b'some: yaml'
         tmp = tempfile.NamedTemporaryFile(delete=False)
         tmp.write(content)
@@ -1022,11 +1274,265 @@ output'''
         result = runner.invoke(kubedeploy.apply,
                                ['--from-file',
                                 tmp.name])
+
+        assert result.exit_code == 1
+        mock_prompt.assert_called_once_with('some error output')
+
+
+    @mock.patch('twyla.kubedeploy.cli.Kubectl')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_apply_gzip(self, mock_prompt, mock_kubectl):
+        content = 'apiVersion: v1\nitems: []\nkind: List\nmetadata: {}\n'
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        file_name = os.path.join(tmp, 'demo.yml.gz')
+        with gzip.open(file_name, mode='wt') as fd:
+            fd.write(content)
+        mock_kubectl.return_value.apply_manifest.return_value = iter([])
+
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.apply, ['--from-file', file_name])
         if result.exception:
             print(''.join(traceback.format_exception(*result.exc_info)))
             self.fail()
 
-        mock_prompt.assert_called_once_with('some error output')
+        mock_kubectl.return_value.apply_manifest.assert_called_once_with(
+            content, on_error=mock.ANY)
+
+
+    @mock.patch('twyla.kubedeploy.chunked.ChunkedApply')
+    @mock.patch('twyla.kubedeploy.cli.Kubectl')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_apply_objects_per_second(self, mock_prompt, mock_kubectl,
+                                      mock_ChunkedApply):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        file_name = os.path.join(tmp, 'demo.yml')
+        with open(file_name, mode='w') as fd:
+            fd.write('apiVersion: v1\nitems: []\nkind: List\n')
+        mock_ChunkedApply.return_value.run.return_value = True
+
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.apply,
+                               ['--from-file', file_name,
+                                '--objects-per-second', '5'])
+
+        assert result.exit_code == 0
+        mock_ChunkedApply.assert_called_once_with(
+            mock_kubectl.return_value, chunk_size=25, jobs=4, qps=5.0)
+
+
+    @mock.patch('twyla.kubedeploy.snapshot.zstandard', None)
+    @mock.patch('twyla.kubedeploy.cli.Kubectl')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    def test_apply_zstd_unavailable(self, mock_prompt, mock_kubectl):
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.apply,
+                               ['--from-file', 'demo.yml.zst'])
+
+        assert result.exit_code == 1
+        mock_prompt.assert_called_once_with(
+            'zstandard is not installed, can not open demo.yml.zst')
+        mock_kubectl.return_value.apply_manifest.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.cli.Kubectl._list_entities')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_cluster_info_delta(self, mock_printer, mock_list):
+        def deployment(name, image):
+            return {
+                'metadata': {'name': name, 'namespace': 'twyla'},
+                'spec': {'template': {'spec': {
+                    'containers': [{'image': image}]}}},
+            }
+
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        base_file = os.path.join(tmp, 'base.yml')
+        delta_file = os.path.join(tmp, 'delta.yml')
+        base = [deployment('one', 'one:1'), deployment('two', 'two:1')]
+        with open(base_file, mode='w') as fd:
+            kubedeploy.write_list(fd, base)
+        mock_list.return_value = {
+            'items': [deployment('one', 'one:2'), deployment('two', 'two:1')]}
+
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.cluster_info,
+                               ['--dump-to', delta_file,
+                                '--delta-from', base_file])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        with open(delta_file) as fd:
+            written = yaml.safe_load(fd)
+        assert written['kind'] == 'SnapshotDelta'
+        assert written['items'] == [deployment('one', 'one:2')]
+        mock_printer.assert_called_with(
+            '1 new or changed deployments dumped.')
+
+
+
+    @mock.patch('twyla.kubedeploy.cli.watch_module.DeploymentWatch')
+    @mock.patch('twyla.kubedeploy.cluster.list_deployments')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_cluster_info_watch(self, mock_printer, mock_error, mock_list,
+                                mock_Watch):
+        Row = kubedeploy.watch_module.Row
+
+        def run(on_change):
+            on_change(Row('twyla', 'one', 2, 2, 2), False)
+            on_change(Row('twyla', 'two', 2, 1, 2), False)
+            on_change(Row('twyla', 'three', 1, 1, 1), True)
+            raise KeyboardInterrupt()
+
+        mock_Watch.return_value.run.side_effect = run
+
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.cluster_info,
+                               ['--namespace', 'twyla', '--watch'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_list.assert_not_called()
+        mock_Watch.assert_called_once_with(['twyla'], ['twyla'],
+                                           all_namespaces=False)
+        mock_Watch.return_value.stop.assert_called_once_with()
+        mock_printer.assert_called_once_with(
+            'twyla/one  replicas: 2 ready: 2 updated: 2')
+        assert mock_error.call_args_list == [
+            mock.call('twyla/two  replicas: 2 ready: 1 updated: 2'),
+            mock.call('twyla/three deleted'),
+        ]
+
+
+    @mock.patch('twyla.kubedeploy.cluster.list_deployments')
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    def test_cluster_info_namespaces(self, mock_printer, mock_list):
+        def deployment(name, namespace):
+            return {
+                'metadata': {'name': name, 'namespace': namespace},
+                'spec': {'template': {'spec': {
+                    'containers': [{'image': name + ':1'}]}}},
+            }
+
+        mock_list.return_value = OrderedDict([
+            ('prod', [deployment('one', 'prod')]),
+            ('staging', [deployment('one', 'staging'),
+                         deployment('two', 'staging')]),
+        ])
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        dump_file = os.path.join(tmp, 'dump.yml')
+
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.cluster_info,
+                               ['--namespace', 'prod, staging',
+                                '--group', 'a,b',
+                                '--dump-to', dump_file])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_list.assert_called_once_with(['prod', 'staging'], ['a', 'b'],
+                                          all_namespaces=False, jobs=4,
+                                          make_kubectl=None)
+        printed = [c[0][0] for c in mock_printer.call_args_list]
+        assert printed == ['namespace: prod', 'one', 'one:1',
+                           'namespace: staging', 'one', 'one:1',
+                           'two', 'two:1']
+        with open(dump_file) as fd:
+            dumped = yaml.safe_load(fd)
+        assert [(i['metadata']['namespace'], i['metadata']['name'])
+                for i in dumped['items']] == [
+            ('prod', 'one'), ('staging', 'one'), ('staging', 'two')]
+
+
+    @mock.patch('twyla.kubedeploy.monorepo.plan')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_plan(self, mock_head_of, mock_plan):
+        mock_head_of.return_value = 'githash'
+        cwd = os.getcwd()
+        mock_plan.return_value = [
+            kubedeploy.monorepo.PlannedService(
+                service=kubedeploy.monorepo.Service(
+                    path=os.path.join(cwd, 'service-one'), config={}),
+                deployed='oldhash', changed=False),
+            kubedeploy.monorepo.PlannedService(
+                service=kubedeploy.monorepo.Service(
+                    path=os.path.join(cwd, 'service-two'), config={}),
+                deployed='oldhash', changed=True),
+        ]
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.plan, ['--names-only'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_head_of.assert_called_once_with(cwd, 'master', local=False)
+        mock_plan.assert_called_once_with(cwd, 'githash',
+                                          kubedeploy.CONFIG_FILE)
+        assert result.output == 'service-two\n'
+
+
+    @mock.patch('twyla.kubedeploy.batch.BatchDeploy')
+    @mock.patch('twyla.kubedeploy.monorepo.find_services')
+    @mock.patch('twyla.kubedeploy.cli.head_of')
+    def test_deploy_many(self, mock_head_of, mock_find_services,
+                         mock_BatchDeploy):
+        mock_head_of.return_value = 'githash'
+        mock_BatchDeploy.return_value.run.return_value = [
+            kubedeploy.batch.BatchResult('one', 'reg/one:githash',
+                                         kubedeploy.batch.STATUS_DEPLOYED)]
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.deploy_many, ['--registry', 'reg',
+                                                        '--jobs', '8'])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        # The git state is only resolved once for all services.
+        mock_head_of.assert_called_once_with(os.getcwd(), 'master',
+                                             local=False)
+        mock_BatchDeploy.assert_called_once_with(
+            registry='reg', version='githash', printer=kubedeploy.prompt,
+            error_printer=kubedeploy.error_prompt, prepare_build=mock.ANY,
+            local=False, dry=False, jobs=8, build_jobs=1)
+        mock_BatchDeploy.return_value.run.assert_called_once_with(
+            mock_find_services.return_value)
+
+
+    @mock.patch('twyla.kubedeploy.cli.prompt')
+    @mock.patch('twyla.kubedeploy.cli.Kube')
+    def test_render(self, mock_Kube, mock_prompt):
+        mock_Kube.return_value.render_matrix.return_value = [
+            (['de', 'prod'], 'lang: de'),
+            (['en', 'prod'], 'lang: en'),
+            (['en'], 'lang: en'),
+        ]
+        output_dir = tempfile.mkdtemp()
+        runner = CliRunner()
+        result = runner.invoke(kubedeploy.render, ['--registry', 'reg',
+                                                   '--image', 'service',
+                                                   '--version', 'v1',
+                                                   '--variant-matrix',
+                                                   'de|en,prod|',
+                                                   '--output-dir',
+                                                   output_dir])
+        if result.exception:
+            print(''.join(traceback.format_exception(*result.exc_info)))
+            self.fail()
+
+        mock_Kube.return_value.render_matrix.assert_called_once_with(
+            'reg/service:v1',
+            [['de', 'prod'], ['de'], ['en', 'prod'], ['en']])
+        # Identical manifests are only written once.
+        assert sorted(os.listdir(output_dir)) == ['deployment-de-prod.yml',
+                                                  'deployment-en-prod.yml']
+        mock_prompt.assert_called_with('en: same as {}'.format(
+            os.path.join(output_dir, 'deployment-en-prod.yml')))
 
 
     def test_variant_preprocessing(self):
@@ -0,0 +1,182 @@
+import io
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from twyla.kubedeploy import client, daemon
+from twyla.kubedeploy.prompt import carry_output, prompt
+
+
+@click.group()
+def toy():
+    pass
+
+
+@toy.command()
+@click.option('--code', default=0, type=int)
+def hello(code: int):
+    prompt('cwd: {}'.format(os.getcwd()))
+    click.echo('name: {}'.format(os.environ.get('KUBEDEPLOY_NAME')),
+               err=True)
+    work = carry_output(lambda i: prompt('worker {}'.format(i)))
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        list(executor.map(work, range(2)))
+    sys.exit(code)
+
+
+class GateTests(unittest.TestCase):
+
+    def test_same_key_runs_concurrently(self):
+        gate = daemon.Gate()
+        switches = []
+
+        with gate.enter('a', lambda: switches.append('a')):
+            with gate.enter('a', lambda: switches.append('a')):
+                assert gate.running == 2
+
+        assert switches == ['a']
+        assert gate.running == 0
+
+
+    def test_other_key_waits(self):
+        gate = daemon.Gate()
+        switches = []
+        entered = threading.Event()
+
+        def other():
+            with gate.enter('b', lambda: switches.append('b')):
+                entered.set()
+
+        with gate.enter('a', lambda: switches.append('a')):
+            thread = threading.Thread(target=other)
+            thread.start()
+            assert not entered.wait(0.1)
+        thread.join(1)
+
+        assert entered.is_set()
+        assert switches == ['a', 'b']
+
+
+class StreamTests(unittest.TestCase):
+
+    def test_thread_local_stream(self):
+        fallback = io.StringIO()
+        local = io.StringIO()
+        stream = daemon.ThreadLocalStream(fallback)
+
+        stream.set(local)
+        stream.write('mine')
+        thread = threading.Thread(target=stream.write, args=('other',))
+        thread.run()
+        stream.set(None)
+        stream.write('nobody')
+
+        assert local.getvalue() == 'mineother'
+        assert fallback.getvalue() == 'nobody'
+
+
+    def test_bind(self):
+        fallback = io.StringIO()
+        local = io.StringIO()
+        stream = daemon.ThreadLocalStream(fallback)
+
+        stream.set(local)
+        thread = threading.Thread(target=stream.bind(stream.write),
+                                  args=('child',))
+        thread.start()
+        thread.join()
+        other = threading.Thread(target=stream.write, args=('other',))
+        other.start()
+        other.join()
+
+        assert local.getvalue() == 'child'
+        assert fallback.getvalue() == 'other'
+
+
+    def test_connection_stream_rejects_bytes(self):
+        one, two = socket.socketpair()
+        self.addCleanup(one.close)
+        self.addCleanup(two.close)
+        stream = daemon.ConnectionStream(one, 'out', threading.Lock())
+
+        with self.assertRaises(TypeError):
+            stream.write(b'')
+        stream.write('text')
+        one.close()
+
+        assert list(client.messages(two)) == [{'out': 'text'}]
+
+
+class DaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, 'run', 'kubedeploy.sock')
+        self.daemon = daemon.Daemon(toy, path=self.path)
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.daemon.serve,
+                                       kwargs={'ready': ready.set})
+        self.thread.start()
+        assert ready.wait(5)
+
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.thread.join(5)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+
+    def request(self, args, env=None):
+        connection = client.connect(self.path)
+        with connection:
+            client.send(connection, {'args': args,
+                                     'cwd': self.workdir,
+                                     'env': env or {}})
+            return list(client.messages(connection))
+
+
+    def test_run(self):
+        responses = self.request(['hello', '--code', '3'],
+                                 env={'KUBEDEPLOY_NAME': 'svc',
+                                      'HOME': '/nowhere'})
+
+        out = ''.join(r.get('out', '') for r in responses)
+        err = ''.join(r.get('err', '') for r in responses)
+        assert 'cwd: {}'.format(os.path.realpath(self.workdir)) in out
+        assert 'worker 0' in out
+        assert 'worker 1' in out
+        assert err == 'name: svc\n'
+        assert responses[-1] == {'exit': 3}
+        # Only the variables of kubedeploy are taken from the client.
+        assert os.environ.get('HOME') != '/nowhere'
+
+
+    def test_usage_error(self):
+        responses = self.request(['nope'])
+
+        err = ''.join(r.get('err', '') for r in responses)
+        assert "No such command 'nope'" in err
+        assert responses[-1] == {'exit': 2}
+
+
+    def test_socket_permissions(self):
+        assert os.stat(self.path).st_mode & 0o777 == 0o600
+
+
+    def test_running(self):
+        with self.assertRaises(daemon.DaemonRunning):
+            daemon.Daemon(toy, path=self.path).bind()
+
+
+    def test_forward(self):
+        os.chdir(self.workdir)
+        assert client.forward(['hello', '--code', '4'], path=self.path) == 4
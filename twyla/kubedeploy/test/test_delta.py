@@ -0,0 +1,111 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from factories import deployment
+from twyla.kubedeploy import delta, serialization, snapshot
+
+
+def scrubbed(name, image=None):
+    return snapshot.scrub_item(deployment(name, image=image))
+
+
+def make_delta(base_items, items):
+    fd = io.StringIO()
+    delta.write_delta(fd, delta.make_index(base_items), items)
+    return serialization.load_yaml(fd.getvalue())
+
+
+class DeltaTests(unittest.TestCase):
+
+    def setUp(self):
+        self.base = [scrubbed('one'), scrubbed('two'),
+                     scrubbed('three')]
+
+
+    def test_identity(self):
+        moved = scrubbed('one')
+        moved['apiVersion'] = 'extensions/v1beta1'
+
+        assert delta.identity(scrubbed('one')) == 'Deployment/twyla/one'
+        assert delta.identity(moved) == delta.identity(scrubbed('one'))
+
+
+    def test_item_hash(self):
+        assert (delta.item_hash(scrubbed('one')) ==
+                delta.item_hash(scrubbed('one')))
+        assert (delta.item_hash(scrubbed('one')) !=
+                delta.item_hash(scrubbed('one', image='image:2')))
+
+
+    def test_write_delta(self):
+        items = [scrubbed('one', image='image:2'), scrubbed('two'),
+                 scrubbed('four')]
+
+        written = make_delta(self.base, items)
+
+        assert written['kind'] == delta.DELTA_KIND
+        assert [i['metadata']['name'] for i in written['items']] == [
+            'one', 'four']
+        assert written['deleted'] == ['Deployment/twyla/three']
+        assert written['base'] == delta.digest(delta.make_index(self.base))
+        assert written['digest'] == delta.digest(delta.make_index(items))
+
+
+    def test_write_delta_unchanged(self):
+        written = make_delta(self.base, self.base)
+
+        assert written['items'] == []
+        assert written['deleted'] == []
+        assert written['base'] == written['digest']
+
+
+    def test_reconstruct_chain(self):
+        second = [scrubbed('one', image='image:2'), scrubbed('two')]
+        third = [scrubbed('one', image='image:2'), scrubbed('two'),
+                 scrubbed('four')]
+        chain = [
+            snapshot.scrub_cluster_info({'items': self.base}),
+            make_delta(self.base, second),
+            make_delta(second, third),
+        ]
+
+        result = delta.reconstruct(chain)
+
+        assert result['kind'] == 'List'
+        assert result['items'] == third
+
+
+    def test_reconstruct_wrong_base(self):
+        other = [scrubbed('other')]
+        chain = [
+            snapshot.scrub_cluster_info({'items': self.base}),
+            make_delta(other, self.base),
+        ]
+
+        with self.assertRaises(delta.DeltaMismatch):
+            delta.reconstruct(chain)
+
+
+    def test_reconstruct_requires_full_snapshot(self):
+        with self.assertRaises(delta.DeltaMismatch):
+            delta.reconstruct([make_delta(self.base, self.base)])
+
+
+    def test_load_chain(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        base_file = os.path.join(tmp, 'base.yml')
+        delta_file = os.path.join(tmp, 'delta.yml.gz')
+        items = [scrubbed('one', image='image:2')]
+        with snapshot.open_snapshot(base_file, mode='w') as fd:
+            snapshot.write_list(fd, self.base)
+        with snapshot.open_snapshot(delta_file, mode='w') as fd:
+            delta.write_delta(fd, delta.make_index(self.base), items)
+
+        assert delta.load_chain([base_file])['items'] == self.base
+        assert delta.load_chain([base_file, delta_file])['items'] == items
+        with self.assertRaises(delta.DeltaMismatch):
+            delta.load_chain([delta_file])
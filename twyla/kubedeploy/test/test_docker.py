@@ -1,5 +1,8 @@
 import base64
 import json
+import os
+import shutil
+import tempfile
 import unittest
 from subprocess import PIPE, STDOUT
 from unittest import mock
@@ -71,6 +74,38 @@ class DockerTests(unittest.TestCase):
         assert not exists
 
 
+    @mock.patch('twyla.kubedeploy.docker_helpers.registry_credentials')
+    @mock.patch('twyla.kubedeploy.docker_helpers.registry')
+    def test_registry_session_reuses_clients(self, mock_registry,
+                                             mock_credentials):
+        mock_credentials.return_value = ('tim_toddler', 'crappy password')
+        session = docker_helpers.RegistrySession()
+        assert session.image_exists('myown.private.registry/one:678fg')
+        assert session.image_exists('myown.private.registry/two:678fg')
+
+        mock_credentials.assert_called_once_with('myown.private.registry')
+        mock_registry.DockerRegistryClient.assert_called_once_with(
+            "https://myown.private.registry",
+            username="tim_toddler",
+            password="crappy password")
+
+
+    @mock.patch('twyla.kubedeploy.docker_helpers.registry_credentials')
+    @mock.patch('twyla.kubedeploy.docker_helpers.registry')
+    def test_shared_sessions(self, mock_registry, mock_credentials):
+        mock_credentials.return_value = ('tim_toddler', 'crappy password')
+        with docker_helpers.shared_sessions():
+            assert docker_helpers.docker_image_exists(
+                'myown.private.registry/one:678fg')
+            assert docker_helpers.docker_image_exists(
+                'myown.private.registry/two:678fg')
+        assert docker_helpers.docker_image_exists(
+            'myown.private.registry/one:678fg')
+
+        # Once for the shared session, once after it ended.
+        assert mock_credentials.call_count == 2
+
+
     @mock.patch('twyla.kubedeploy.docker_helpers.Popen')
     def test_get_macos_credentials(self, mock_popen):
         creds = json.dumps({
@@ -128,3 +163,112 @@ class DockerTests(unittest.TestCase):
         docker_helpers.docker_image('somethingelse', 'some/tag:version')
         mock_client.return_value.images.push.assert_not_called()
         mock_client.return_value.images.build.assert_not_called()
+
+
+class ContextHashTests(unittest.TestCase):
+
+    def setUp(self):
+        self.context = tempfile.mkdtemp()
+        self.write('Dockerfile', 'FROM python:3.6\nCOPY . /app\n')
+        self.write('app.py', 'print("hello")\n')
+        self.write('docs/index.md', '# Docs\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.context)
+
+
+    def write(self, rel_path, content):
+        path = os.path.join(self.context, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w') as fd:
+            fd.write(content)
+
+
+    def test_is_ignored(self):
+        patterns = ['docs', '*.md', '!README.md', '**/*.pyc']
+        assert docker_helpers.is_ignored('docs/index.md', patterns)
+        assert docker_helpers.is_ignored('CHANGES.md', patterns)
+        assert not docker_helpers.is_ignored('README.md', patterns)
+        assert docker_helpers.is_ignored('app.pyc', patterns)
+        assert docker_helpers.is_ignored('pkg/sub/app.pyc', patterns)
+        assert not docker_helpers.is_ignored('app.py', patterns)
+
+
+    def test_is_ignored_segments(self):
+        # Like Docker, * does not match across directories.
+        assert docker_helpers.is_ignored('CHANGES.md', ['*.md'])
+        assert not docker_helpers.is_ignored('docs/a.md', ['*.md'])
+        assert docker_helpers.is_ignored('a/b.py', ['a/*.py'])
+        assert not docker_helpers.is_ignored('a/b/c.py', ['a/*.py'])
+        assert not docker_helpers.is_ignored('ab/c.py', ['a?/*.txt'])
+        assert docker_helpers.is_ignored('ab/c.txt', ['a?/*.txt'])
+        assert not docker_helpers.is_ignored('a/b/c.txt', ['a?/*.txt'])
+
+
+    def test_is_ignored_double_star(self):
+        assert docker_helpers.is_ignored('a.md', ['**/*.md'])
+        assert docker_helpers.is_ignored('docs/sub/a.md', ['**/*.md'])
+        assert docker_helpers.is_ignored('docs/x/y/z', ['docs/**'])
+        assert docker_helpers.is_ignored('a/b/c/d.log', ['a/**/d.log'])
+        assert docker_helpers.is_ignored('a/d.log', ['a/**/d.log'])
+        assert not docker_helpers.is_ignored('b/d.log', ['a/**/d.log'])
+
+
+    def test_is_ignored_character_class(self):
+        assert docker_helpers.is_ignored('file1', ['file[0-9]'])
+        assert not docker_helpers.is_ignored('filex', ['file[0-9]'])
+        assert docker_helpers.is_ignored('filex', ['file[!0-9]'])
+        assert docker_helpers.is_ignored('a.b', ['a.b'])
+        assert not docker_helpers.is_ignored('axb', ['a.b'])
+
+
+    def test_read_dockerignore(self):
+        self.write('.dockerignore', '# comment\n\ndocs/\n!docs/keep.md\n')
+        patterns = docker_helpers.read_dockerignore(self.context)
+        assert patterns == ['docs', '!docs/keep.md']
+
+
+    def test_context_hash_stable(self):
+        first = docker_helpers.context_hash(self.context)
+        second = docker_helpers.context_hash(self.context)
+        assert first == second
+        assert len(first) == 12
+
+
+    def test_context_hash_changes_with_sources(self):
+        before = docker_helpers.context_hash(self.context)
+        self.write('app.py', 'print("bye")\n')
+        assert docker_helpers.context_hash(self.context) != before
+
+
+    def test_context_hash_honors_dockerignore(self):
+        self.write('.dockerignore', 'docs\n')
+        before = docker_helpers.context_hash(self.context)
+        self.write('docs/index.md', '# Changed docs\n')
+        self.write('.git/HEAD', 'ref: refs/heads/master\n')
+        self.write('pip-cache/some_package.tar.gz', 'binary')
+        assert docker_helpers.context_hash(self.context) == before
+
+
+    def test_context_hash_nested_files_not_ignored(self):
+        # Docker sends docs/a.md despite *.md, so it is part of the hash.
+        self.write('.dockerignore', '*.md\n')
+        self.write('docs/a.md', 'one\n')
+        before = docker_helpers.context_hash(self.context)
+        self.write('docs/a.md', 'two\n')
+        assert docker_helpers.context_hash(self.context) != before
+
+
+    def test_context_hash_includes_ignored_dockerfile(self):
+        self.write('.dockerignore', 'Dockerfile\n')
+        before = docker_helpers.context_hash(self.context)
+        self.write('Dockerfile', 'FROM python:3.7\nCOPY . /app\n')
+        assert docker_helpers.context_hash(self.context) != before
+
+
+    def test_context_hash_build_args(self):
+        plain = docker_helpers.context_hash(self.context)
+        with_args = docker_helpers.context_hash(self.context,
+                                                build_args={'ENV': 'prod'})
+        assert plain != with_args
@@ -4,12 +4,12 @@ from types import SimpleNamespace as Bunch
 
 import pytest
 
-from twyla import kubedeploy
+from twyla.kubedeploy import cli as kubedeploy
 
 
 class HeadOfTests(unittest.TestCase):
 
-    @mock.patch('twyla.kubedeploy.git')
+    @mock.patch('twyla.kubedeploy.cli.git')
     def test_local(self, mock_git):
         """If local is True, head of local should be returned"""
         head = kubedeploy.head_of('/blah', local=True)
@@ -20,8 +20,8 @@ class HeadOfTests(unittest.TestCase):
         mock_git.Repo.assert_called_once_with('/blah')
 
 
-    @mock.patch('twyla.kubedeploy.error_prompt')
-    @mock.patch('twyla.kubedeploy.git')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
     def test_no_matching_remote(self, mock_git, mock_error_prompt):
         repo = mock_git.Repo.return_value
         repo.active_branch = 'the-branch'
@@ -34,8 +34,8 @@ class HeadOfTests(unittest.TestCase):
             'No remote tracking branch matching "the-branch" found')
 
 
-    @mock.patch('twyla.kubedeploy.error_prompt')
-    @mock.patch('twyla.kubedeploy.git')
+    @mock.patch('twyla.kubedeploy.cli.error_prompt')
+    @mock.patch('twyla.kubedeploy.cli.git')
     def test_matching_remote(self, mock_git, mock_error_prompt):
         repo = mock_git.Repo.return_value
         repo.active_branch = 'the-branch'
@@ -45,3 +45,15 @@ class HeadOfTests(unittest.TestCase):
         repo.remotes = [remote]
         head = kubedeploy.head_of('/blah')
         assert head == repo.git.rev_parse.return_value
+
+
+    @mock.patch('twyla.kubedeploy.cli.git')
+    def test_shared_repositories(self, mock_git):
+        with kubedeploy.shared_repositories():
+            kubedeploy.head_of('/blah', local=True)
+            kubedeploy.head_of('/blah', local=True)
+
+        mock_git.Repo.assert_called_once_with('/blah')
+        mock_git.Repo.return_value.close.assert_called_once_with()
+        kubedeploy.head_of('/blah', local=True)
+        assert mock_git.Repo.call_count == 2
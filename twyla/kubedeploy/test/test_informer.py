@@ -0,0 +1,174 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import pytest
+
+from factories import deployment
+from twyla.kubedeploy import informer
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+
+
+def listed(version, *items):
+    return {'metadata': {'resourceVersion': version}, 'items': list(items)}
+
+
+class InformerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = mock.patch('twyla.kubedeploy.informer.Kubectl')
+        self.mock_Kubectl = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.kubectl = self.mock_Kubectl.return_value
+        self.kubectl.current_context.return_value = 'arn:aws:eks:cluster/one'
+        self.kubectl.list_deployments.return_value = listed(
+            '10', deployment('one', version='5'),
+            deployment('two', version='7'))
+
+
+    def informer(self, max_age=0):
+        return informer.Informer(cache_dir=self.cache_dir, max_age=max_age)
+
+
+    def cache_file(self):
+        return os.path.join(self.cache_dir,
+                            'arn%3Aaws%3Aeks%3Acluster%2Fone', 'twyla.json')
+
+
+    def test_first_sync_lists(self):
+        state = self.informer().sync('twyla')
+
+        assert state['resourceVersion'] == '10'
+        assert list(state['items']) == ['one', 'two']
+        self.kubectl.watch_raw.assert_not_called()
+        with open(self.cache_file()) as fd:
+            cached = json.load(fd)
+        assert cached['resourceVersion'] == '10'
+        assert len(cached['items']) == 2
+
+
+    def test_catch_up_from_cache(self):
+        self.informer().sync('twyla')
+        self.kubectl.list_deployments.reset_mock()
+        self.kubectl.watch_raw.return_value = iter([
+            {'type': 'MODIFIED',
+             'object': deployment('one', version='11', replicas=3)},
+            {'type': 'DELETED', 'object': deployment('two', version='12')},
+            {'type': 'ADDED', 'object': deployment('three', version='13')},
+            {'type': 'BOOKMARK', 'object': {
+                'metadata': {'resourceVersion': '15'}}},
+        ])
+
+        state = self.informer().sync('twyla')
+
+        self.kubectl.list_deployments.assert_not_called()
+        path = self.kubectl.watch_raw.call_args[0][0]
+        assert 'resourceVersion=10&' in path
+        assert 'timeoutSeconds=1' in path
+        assert state['resourceVersion'] == '15'
+        assert list(state['items']) == ['one', 'three']
+        assert state['items']['one']['spec']['replicas'] == 3
+        with open(self.cache_file()) as fd:
+            assert json.load(fd)['resourceVersion'] == '15'
+
+
+    def test_expired_version_relists(self):
+        self.informer().sync('twyla')
+        self.kubectl.list_deployments.return_value = listed(
+            '30', deployment('one', version='29'))
+        self.kubectl.watch_raw.return_value = iter([
+            {'type': 'ERROR', 'object': {'code': 410}}])
+
+        state = self.informer().sync('twyla')
+
+        assert state['resourceVersion'] == '30'
+        assert list(state['items']) == ['one']
+
+
+    def test_fresh_cache_not_watched(self):
+        self.informer().sync('twyla')
+        self.kubectl.list_deployments.reset_mock()
+
+        state = self.informer(max_age=60).sync('twyla')
+
+        assert list(state['items']) == ['one', 'two']
+        self.kubectl.list_deployments.assert_not_called()
+        self.kubectl.watch_raw.assert_not_called()
+
+
+    def test_unchanged_cache_not_rewritten(self):
+        self.informer().sync('twyla')
+        # Synced a while ago.
+        os.utime(self.cache_file(), (1000, 1000))
+        self.kubectl.watch_raw.return_value = iter([])
+
+        with mock.patch('twyla.kubedeploy.informer.json.dump') as mock_dump:
+            self.informer(max_age=60).sync('twyla')
+
+        self.kubectl.watch_raw.assert_called_once_with(mock.ANY)
+        mock_dump.assert_not_called()
+        assert os.path.getmtime(self.cache_file()) > 1000
+
+
+    def test_synced_once(self):
+        cache = self.informer()
+
+        cache.get('twyla', 'one')
+        cache.list('twyla', {'servicegroup': 'twyla'})
+
+        self.kubectl.list_deployments.assert_called_once_with()
+
+
+    def test_list_selectors(self):
+        self.kubectl.list_deployments.return_value = listed(
+            '10',
+            deployment('one', version='1', labels={'servicegroup': 'a'}),
+            deployment('two', version='2', labels={'servicegroup': 'b'}),
+            deployment('three', version='3', labels={'servicegroup': 'c'}))
+        cache = self.informer()
+
+        names = [i['metadata']['name']
+                 for i in cache.list('twyla', {'servicegroup': ['a', 'c']})]
+
+        assert names == ['one', 'three']
+        assert cache.list('twyla', {'servicegroup': 'b'})[0][
+            'metadata']['name'] == 'two'
+        assert len(cache.list('twyla', 'servicegroup notin (a,c)')) == 1
+        self.kubectl.list_deployments.assert_called_once_with()
+
+
+    def test_cached_kubectl(self):
+        kubectl = informer.CachedKubectl(self.informer())
+        kubectl.namespace = 'twyla'
+
+        assert kubectl.get_deployment('one')['metadata']['name'] == 'one'
+        with pytest.raises(KubectlCallFailed) as error:
+            kubectl.get_deployment('missing')
+        assert b'NotFound' in error.value.args[0]
+        assert len(kubectl.list_deployments()['items']) == 2
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.Kubectl._call')
+    def test_cached_kubectl_passes_other_kinds(self, mock_call):
+        kubectl = informer.CachedKubectl(self.informer())
+        kubectl.namespace = 'twyla'
+
+        kubectl.get_service('one')
+        kubectl.list_pods()
+
+        assert mock_call.call_count == 2
+        self.kubectl.list_deployments.assert_not_called()
+
+
+    def test_update_replicas_from_cache(self):
+        kubectl = informer.CachedKubectl(self.informer())
+        kube_list = {'items': [deployment('one', version='1', replicas=1)]}
+
+        kubectl.update_replicas(kube_list)
+
+        assert kube_list['items'][0]['spec']['replicas'] == 2
@@ -1,5 +1,9 @@
 import json
+import os
 import pytest
+import shutil
+import subprocess
+import tempfile
 import unittest
 import unittest.mock as mock
 
@@ -31,8 +35,8 @@ class KubectlTest(unittest.TestCase):
 
 
     @mock.patch('twyla.kubedeploy.kubectl.subprocess')
-    @mock.patch('twyla.kubedeploy.kubectl.json')
-    def test_call(self, mock_json, mock_subprocess):
+    @mock.patch('twyla.kubedeploy.kubectl.serialization')
+    def test_call(self, mock_serialization, mock_subprocess):
         mock_pipe = mock.MagicMock()
         mock_subprocess.PIPE = mock_pipe
         kubectl = Kubectl()
@@ -43,6 +47,8 @@ class KubectlTest(unittest.TestCase):
             cmd,
             stdout=mock_pipe,
             stderr=mock_pipe)
+        mock_serialization.loads_json.assert_called_once_with(
+            mock_subprocess.run.return_value.stdout)
 
 
     def test_failing_call(self):
@@ -53,21 +59,192 @@ class KubectlTest(unittest.TestCase):
 
         assert error.value.args[0].endswith(b'No such file or directory\n')
 
-    @mock.patch('twyla.kubedeploy.kubectl.subprocess')
-    @mock.patch('twyla.kubedeploy.kubectl.json')
-    def test_apply(self, mock_json, mock_subprocess):
-        mock_pipe = mock.MagicMock()
-        mock_subprocess.PIPE = mock_pipe
+    def throttled_kubectl(self, *returncodes):
+        backoff = mock.MagicMock(retries=2)
+        limiter = mock.MagicMock()
+        kubectl = Kubectl(limiter=limiter, backoff=backoff)
+        procs = []
+        for returncode in returncodes:
+            proc = mock.MagicMock(returncode=returncode, stdout=b'{}')
+            if returncode:
+                proc.stderr = (b'Error from server (TooManyRequests): the '
+                               b'server has received too many requests '
+                               b'(Retry-After: 3s)')
+                proc.check_returncode.side_effect = \
+                    subprocess.CalledProcessError(returncode, 'kubectl')
+            procs.append(proc)
+        return kubectl, procs
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.subprocess.run')
+    def test_call_retries_throttled(self, mock_run):
+        kubectl, procs = self.throttled_kubectl(1, 1, 0)
+        mock_run.side_effect = procs
+
+        assert kubectl._call(['kubectl', 'get', 'pods']) == {}
+
+        assert mock_run.call_count == 3
+        assert kubectl.limiter.acquire.call_count == 3
+        assert kubectl.backoff.wait.call_args_list == [mock.call(0, 3.0),
+                                                       mock.call(1, 3.0)]
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.subprocess.run')
+    def test_call_throttled_gives_up(self, mock_run):
+        kubectl, procs = self.throttled_kubectl(1, 1, 1)
+        mock_run.side_effect = procs
+
+        with pytest.raises(KubectlCallFailed) as error:
+            kubectl._call(['kubectl', 'get', 'pods'])
+
+        assert b'TooManyRequests' in error.value.args[0]
+        assert mock_run.call_count == 3
+
+
+    def test_failing_call_not_retried(self):
+        backoff = mock.MagicMock(retries=2)
+        kubectl = Kubectl(backoff=backoff)
+
+        with pytest.raises(KubectlCallFailed):
+            kubectl._call(['ls', '/does/probably/not/exist'])
+
+        backoff.wait.assert_not_called()
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.Kubectl._stream')
+    def test_watch_raw(self, mock_stream):
+        mock_stream.return_value = (line for line in [
+            '{"type": "ADDED"}', '', '{"type": "DELETED"}'])
         kubectl = Kubectl()
-        file_name = 'deployment.yml'
-        expected = ['kubectl', 'apply', '-f', file_name]
 
-        kubectl.apply(file_name)
+        events = list(kubectl.watch_raw('/apis/apps/v1/deployments?watch=1'))
 
-        mock_subprocess.run.assert_called_once_with(
+        assert events == [{'type': 'ADDED'}, {'type': 'DELETED'}]
+        mock_stream.assert_called_once_with(
+            ['kubectl', 'get', '--raw', '/apis/apps/v1/deployments?watch=1'],
+            on_start=None)
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.Kubectl._stream')
+    def test_apply_manifest(self, mock_stream):
+        kubectl = Kubectl()
+        on_error = mock.MagicMock()
+        expected = ['kubectl', 'apply', '-f', '-']
+
+        lines = kubectl.apply_manifest('kind: Deployment', on_error=on_error)
+
+        assert lines == mock_stream.return_value
+        mock_stream.assert_called_once_with(
             expected,
-            stdout=mock_pipe,
-            stderr=mock_pipe)
+            stdin=b'kind: Deployment',
+            on_error=on_error)
+
+
+    def test_stream(self):
+        kubectl = Kubectl()
+        cmd = ['sh', '-c', 'cat; echo warning >&2; echo done']
+        on_error = mock.MagicMock()
+
+        lines = list(kubectl._stream(cmd, stdin=b'one\ntwo\n',
+                                     on_error=on_error))
+
+        assert lines == ['one', 'two', 'done']
+        on_error.assert_called_once_with('warning')
+
+
+    def test_stream_failure(self):
+        kubectl = Kubectl()
+        cmd = ['sh', '-c', 'echo partial; echo broken >&2; exit 3']
+
+        lines = []
+        with pytest.raises(KubectlCallFailed) as error:
+            for line in kubectl._stream(cmd):
+                lines.append(line)
+
+        assert lines == ['partial']
+        assert error.value.args[0] == b'broken\n'
+
+
+    def test_stream_failure_with_live_errors(self):
+        kubectl = Kubectl()
+        cmd = ['sh', '-c', 'echo broken >&2; exit 3']
+        on_error = mock.MagicMock()
+
+        with pytest.raises(KubectlCallFailed) as error:
+            list(kubectl._stream(cmd, on_error=on_error))
+
+        on_error.assert_called_once_with('broken')
+        assert error.value.args[0] == b'kubectl exited with status 3'
+
+
+    def test_stream_retries_throttled(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        marker = os.path.join(tmp, 'throttled')
+        # Throttled on the first attempt, applied on the second.
+        script = ('cat > /dev/null; '
+                  'if [ ! -e {0} ]; then touch {0}; '
+                  'echo "Error from server (TooManyRequests): slow down" >&2; '
+                  'exit 1; fi; echo applied').format(marker)
+        backoff = mock.MagicMock(retries=2)
+        kubectl = Kubectl(limiter=mock.MagicMock(), backoff=backoff)
+        on_error = mock.MagicMock()
+
+        lines = list(kubectl._stream(['sh', '-c', script], stdin=b'kind: List',
+                                     on_error=on_error))
+
+        assert lines == ['applied']
+        backoff.wait.assert_called_once_with(0, None)
+        assert kubectl.limiter.acquire.call_count == 2
+        # The throttled attempt is not reported.
+        on_error.assert_not_called()
+
+
+    def test_stream_not_retried_after_output(self):
+        cmd = ['sh', '-c', 'echo partial; '
+               'echo "Error from server (TooManyRequests)" >&2; exit 1']
+        backoff = mock.MagicMock(retries=2)
+        kubectl = Kubectl(limiter=mock.MagicMock(), backoff=backoff)
+
+        with pytest.raises(KubectlCallFailed) as error:
+            list(kubectl._stream(cmd))
+
+        assert b'TooManyRequests' in error.value.args[0]
+        backoff.wait.assert_not_called()
+
+
+    def test_stream_throttled_gives_up(self):
+        cmd = ['sh', '-c', 'echo "Error from server (TooManyRequests)" >&2; '
+               'exit 1']
+        backoff = mock.MagicMock(retries=2)
+        kubectl = Kubectl(limiter=mock.MagicMock(), backoff=backoff)
+        on_error = mock.MagicMock()
+
+        with pytest.raises(KubectlCallFailed):
+            list(kubectl._stream(cmd, on_error=on_error))
+
+        assert backoff.wait.call_count == 2
+        # Only the error of the last attempt is reported.
+        on_error.assert_called_once_with(
+            'Error from server (TooManyRequests)')
+
+
+    def test_stream_closed_early(self):
+        kubectl = Kubectl()
+        cmd = ['sh', '-c', 'echo one; exec sleep 30']
+        procs = []
+        real_popen = subprocess.Popen
+
+        def popen(*args, **kwargs):
+            procs.append(real_popen(*args, **kwargs))
+            return procs[-1]
+
+        with mock.patch('subprocess.Popen', side_effect=popen):
+            lines = kubectl._stream(cmd, stdin=b'')
+            assert next(lines) == 'one'
+            lines.close()
+
+        assert procs[0].returncode is not None
 
 
     @mock.patch('twyla.kubedeploy.kubectl.Kubectl._call')
@@ -119,6 +296,21 @@ class KubectlTest(unittest.TestCase):
         assert res == ['--selector', 'one=val']
         res = kubectl._make_selector_args({'one': 'val', 'two': 'val2'})
         assert res == ['--selector', 'one=val,two=val2']
+        res = kubectl._make_selector_args({'one': ['val', 'val2']})
+        assert res == ['--selector', 'one in (val,val2)']
+        res = kubectl._make_selector_args('one notin (val),!two')
+        assert res == ['--selector', 'one notin (val),!two']
+
+
+    @mock.patch('twyla.kubedeploy.kubectl.Kubectl._call')
+    def test_list_deployments_all_namespaces(self, mock_call):
+        kubectl = Kubectl()
+        kubectl.list_deployments(selectors={'servicegroup': 'twyla'},
+                                 all_namespaces=True)
+
+        mock_call.assert_called_once_with(
+            ['kubectl', 'get', 'deployments', '--all-namespaces',
+             '--selector', 'servicegroup=twyla', '-o', 'json'])
 
 
     @mock.patch('twyla.kubedeploy.kubectl.Kubectl._call')
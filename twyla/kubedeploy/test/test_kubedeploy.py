@@ -1,10 +1,17 @@
+import json
+import os
+import shutil
+import tempfile
 import unittest
 import unittest.mock as mock
 
+import yaml
 from jinja2 import Template
 
-from twyla.kubedeploy.kube import Kube
+from twyla.kubedeploy import kube as kube_module
+from twyla.kubedeploy.kube import LAST_APPLIED, Kube
 from twyla.kubedeploy.kubectl import Kubectl, KubectlCallFailed
+from twyla.kubedeploy.model import Deployment
 
 TEST_TEMPLATE = '''
 apiVersion: extensions/v1beta1 # for versions since 1.8.0 use apps/v1beta2
@@ -30,6 +37,26 @@ spec:
         - containerPort: 80
 '''
 
+MULTI_DOCUMENT = '''
+kind: Deployment
+metadata:
+  name: test-ployment
+spec:
+  replicas: 2
+---
+apiVersion: v1
+kind: Service
+metadata:
+  name: test-ployment
+spec:
+  ports:
+  - port: 80
+---
+kind: ConfigMap
+metadata:
+  name: test-config
+'''
+
 
 class KubeTests(unittest.TestCase):
     def setUp(self):
@@ -92,10 +119,7 @@ class KubeTests(unittest.TestCase):
             printer=mock.MagicMock(),
             error_printer=mock.MagicMock()
         )
-        file_name = kube.render_template('myreg/myimage:ver001')
-
-        with open(file_name) as fd:
-            content = fd.read()
+        content = kube.render_template('myreg/myimage:ver001')
 
         expected = '''
 apiVersion: extensions/v1beta1 # for versions since 1.8.0 use apps/v1beta2
@@ -139,10 +163,7 @@ spec:
             printer=mock.MagicMock(),
             error_printer=error_printer
         )
-        file_name = kube.render_template('myreg/myimage:ver001')
-
-        with open(file_name) as fd:
-            content = fd.read()
+        content = kube.render_template('myreg/myimage:ver001')
 
         error_printer.assert_called_once_with('Failed Call!!!')
 
@@ -197,7 +218,7 @@ spec:
             error_printer=mock.MagicMock()
         )
 
-        kube.print_deployment_info('tester', deployment)
+        kube.print_deployment_info('tester', Deployment.from_dict(deployment))
 
         assert printer.call_count == 4
         (one, two, three, four) = printer.call_args_list
@@ -235,7 +256,7 @@ spec:
         )
         kube.info()
         mock_printer.assert_called_once_with('Current test-ployment',
-                                             deployment)
+                                             Deployment.from_dict(deployment))
 
 
     @mock.patch('twyla.kubedeploy.kube.Kube.get_remote_deployment')
@@ -256,11 +277,89 @@ spec:
         error_printer.assert_called_once_with('Failed Call!!!')
 
 
+    @mock.patch('twyla.kubedeploy.kube.Kubectl._list_entities')
+    def test_info_many(self, mock_list):
+        def item(name, image):
+            return {
+                'metadata': {'name': name},
+                'spec': {'template': {'spec': {'containers': [
+                    {'name': name, 'image': image}]}}},
+                'status': {'replicas': 2, 'readyReplicas': 2},
+            }
+
+        mock_list.return_value = {'items': [item('one', 'reg/one:v1'),
+                                            item('two', 'reg/two:v2')]}
+        printer = mock.MagicMock()
+        error_printer = mock.MagicMock()
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name=None,
+            printer=printer,
+            error_printer=error_printer
+        )
+        kube.info_many(names=['two', 'missing', 'one'])
+
+        mock_list.assert_called_once_with('deployments', selectors=None)
+        assert printer.call_args_list == [
+            mock.call('Current two:'),
+            mock.call('  name: two'),
+            mock.call('  image: reg/two:v2'),
+            mock.call('  replicas: 2/2'),
+            mock.call('Current one:'),
+            mock.call('  name: one'),
+            mock.call('  image: reg/one:v1'),
+            mock.call('  replicas: 2/2'),
+        ]
+        error_printer.assert_called_once_with(
+            'Error from server (NotFound): deployments.apps "missing" not '
+            'found')
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kubectl._list_entities')
+    def test_info_many_selector(self, mock_list):
+        mock_list.return_value = {'items': [
+            {'metadata': {'name': 'one'}},
+            {'metadata': {'name': 'two'}},
+        ]}
+        printer = mock.MagicMock()
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name=None,
+            printer=printer,
+            error_printer=mock.MagicMock()
+        )
+        kube.info_many(selectors='servicegroup=twyla')
+
+        mock_list.assert_called_once_with('deployments',
+                                          selectors='servicegroup=twyla')
+        titles = [c for c in printer.call_args_list
+                  if c[0][0].startswith('Current')]
+        assert titles == [mock.call('Current one:'),
+                          mock.call('Current two:')]
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kubectl._list_entities')
+    def test_info_many_failed_list(self, mock_list):
+        mock_list.side_effect = KubectlCallFailed(b'Failed Call!!!')
+        error_printer = mock.MagicMock()
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name=None,
+            printer=mock.MagicMock(),
+            error_printer=error_printer
+        )
+        kube.info_many(names=['one'])
+        error_printer.assert_called_once_with('Failed Call!!!')
+
+
     @mock.patch('twyla.kubedeploy.kube.Kube.render_template')
-    @mock.patch('twyla.kubedeploy.kube.Kubectl.apply')
+    @mock.patch('twyla.kubedeploy.kube.Kubectl.apply_manifest')
     def test_apply(self, mock_apply, mock_render):
-        mock_render.return_value = '/a/file/path'
-        mock_apply.return_value = 'some\napply\noutput'
+        mock_render.return_value = 'kind: Deployment'
+        mock_apply.return_value = iter(['some', 'apply', '', 'output'])
         mock_printer = mock.MagicMock()
 
         kube = Kube(
@@ -272,8 +371,194 @@ spec:
         kube.apply('my-reg/my-test-image:ver123')
 
         mock_render.assert_called_once_with('my-reg/my-test-image:ver123')
-        assert mock_printer.call_count == 3
-        (one, two, three) = mock_printer.call_args_list
+        mock_apply.assert_called_once_with('kind: Deployment\n',
+                                           on_error=kube.error_printer)
+        assert mock_printer.call_count == 4
+        (summary, one, two, three) = mock_printer.call_args_list
+        assert summary == mock.call('Deployment/None: changed')
         assert one == mock.call('some')
         assert two == mock.call('apply')
         assert three == mock.call('output')
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kube.render_template')
+    @mock.patch('twyla.kubedeploy.kube.Kubectl._get_entity_by_name')
+    @mock.patch('twyla.kubedeploy.kube.Kubectl.apply_manifest')
+    def test_apply_changed_documents_only(self, mock_apply, mock_get,
+                                          mock_render):
+        mock_render.return_value = MULTI_DOCUMENT
+        service = {'apiVersion': 'v1', 'kind': 'Service',
+                   'metadata': {'annotations': {}, 'name': 'test-ployment',
+                                'namespace': 'test-space'},
+                   'spec': {'ports': [{'port': 80}]}}
+        live = {
+            'deployment': {'metadata': {'annotations': {
+                LAST_APPLIED: '{"kind": "Deployment", "metadata": '
+                '{"name": "test-ployment"}, "spec": {"replicas": 1}}'}}},
+            'service': {'apiVersion': 'v1', 'kind': 'Service',
+                        'metadata': {'annotations': {
+                            'other': 'annotation',
+                            LAST_APPLIED: json.dumps(service)},
+                            'name': 'test-ployment',
+                            'namespace': 'test-space'},
+                        # Defaults set by the server.
+                        'spec': {'clusterIP': '10.0.0.1',
+                                 'ports': [{'port': 80,
+                                            'protocol': 'TCP'}]}},
+        }
+
+        def get_live(kind, name):
+            if kind not in live:
+                raise KubectlCallFailed(b'not found')
+            return live[kind]
+        mock_get.side_effect = get_live
+        mock_apply.return_value = iter(['applied'])
+        mock_printer = mock.MagicMock()
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name='test-ployment',
+            printer=mock_printer,
+            error_printer=mock.MagicMock()
+        )
+        kube.apply('my-reg/my-test-image:ver123')
+
+        assert mock_printer.call_args_list == [
+            mock.call('Deployment/test-ployment: changed'),
+            mock.call('Service/test-ployment: unchanged'),
+            mock.call('ConfigMap/test-config: new'),
+            mock.call('applied'),
+        ]
+        applied = list(yaml.safe_load_all(mock_apply.call_args[0][0]))
+        assert [d['kind'] for d in applied] == ['Deployment', 'ConfigMap']
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kubectl._get_entity_by_name')
+    def test_document_status_live_changed(self, mock_get):
+        document = {'apiVersion': 'apps/v1', 'kind': 'Deployment',
+                    'metadata': {'name': 'svc', 'namespace': 'test-space'},
+                    'spec': {'template': {'spec': {'containers': [
+                        {'name': 'svc', 'image': 'reg/svc:A'}]}}}}
+        live = json.loads(json.dumps(document))
+        live['metadata']['annotations'] = {
+            LAST_APPLIED: json.dumps(document)}
+        mock_get.return_value = live
+        kube = Kube(namespace='test-space', deployment_name='svc',
+                    printer=mock.MagicMock(),
+                    error_printer=mock.MagicMock())
+
+        assert kube.document_status(document) == 'unchanged'
+        # A hotfix with kubectl set image leaves the annotation alone.
+        live['spec']['template']['spec']['containers'][0]['image'] = \
+            'reg/svc:B'
+        assert kube.document_status(document) == 'changed'
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kube.document_status')
+    @mock.patch('twyla.kubedeploy.kube.Kube.render_template')
+    @mock.patch('twyla.kubedeploy.kube.Kubectl.apply_manifest')
+    def test_apply_nothing_changed(self, mock_apply, mock_render,
+                                   mock_status):
+        mock_render.return_value = MULTI_DOCUMENT
+        mock_status.return_value = 'unchanged'
+        mock_printer = mock.MagicMock()
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name='test-ployment',
+            printer=mock_printer,
+            error_printer=mock.MagicMock()
+        )
+        kube.apply('my-reg/my-test-image:ver123')
+
+        mock_apply.assert_not_called()
+        mock_printer.assert_called_with(
+            'All objects unchanged. Nothing to apply.')
+
+
+    @mock.patch('twyla.kubedeploy.kube.Kube.get_remote_deployment')
+    @mock.patch('twyla.kubedeploy.kube.Environment.get_template')
+    def test_render_matrix(self, mock_template, mock_deployment):
+        mock_template.return_value = Template(
+            'replicas: {{ data.replicas }}\n'
+            '{% if "de" in data.variants %}lang: de{% endif %}')
+        mock_deployment.return_value = {'spec': {'replicas': 3}}
+
+        kube = Kube(
+            namespace='test-space',
+            deployment_name='test-ployment',
+            printer=mock.MagicMock(),
+            error_printer=mock.MagicMock()
+        )
+        rendered = kube.render_matrix('myreg/myimage:ver001',
+                                      [['de'], ['en'], []])
+
+        assert rendered == [
+            (['de'], 'replicas: 3\nlang: de'),
+            (['en'], 'replicas: 3\n'),
+            ([], 'replicas: 3\n'),
+        ]
+        mock_deployment.assert_called_once_with()
+
+
+    def test_variant_matrix(self):
+        matrix = kube_module.variant_matrix('de|en, prod|staging')
+        assert matrix == [['de', 'prod'], ['de', 'staging'],
+                          ['en', 'prod'], ['en', 'staging']]
+
+        matrix = kube_module.variant_matrix('de|en,beta|')
+        assert matrix == [['de', 'beta'], ['de'], ['en', 'beta'], ['en']]
+
+
+class TemplateCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+        with open('deployment.yml', mode='w') as fd:
+            fd.write(TEST_TEMPLATE)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_make_bytecode_cache(self):
+        directory = os.path.join(self.workdir, 'cache')
+        cache = kube_module.make_bytecode_cache(directory)
+
+        template = kube_module.Environment(
+            loader=kube_module.FileSystemLoader('./'),
+            bytecode_cache=cache).get_template('deployment.yml')
+
+        assert template.render(data={'name': 'x'})
+        assert len(os.listdir(directory)) == 1
+
+    def test_make_bytecode_cache_unwritable(self):
+        blocker = os.path.join(self.workdir, 'file')
+        open(blocker, mode='w').close()
+
+        assert kube_module.make_bytecode_cache(
+            os.path.join(blocker, 'cache')) is None
+
+    def test_template_compiled_once(self):
+        first = kube_module.template_environment().get_template(
+            'deployment.yml')
+        second = kube_module.template_environment().get_template(
+            'deployment.yml')
+
+        assert first is second
+
+
+    def test_template_environment_per_directory(self):
+        other = os.path.join(self.workdir, 'other')
+        os.makedirs(other)
+        with open(os.path.join(other, 'deployment.yml'), mode='w') as fd:
+            fd.write('other: {{ data.name }}')
+
+        here = kube_module.template_environment().get_template(
+            'deployment.yml')
+        there = kube_module.template_environment(other).get_template(
+            'deployment.yml')
+
+        assert here is not there
+        assert there.render(data={'name': 'x'}) == 'other: x'
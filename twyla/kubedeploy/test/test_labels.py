@@ -0,0 +1,93 @@
+import unittest
+
+import pytest
+
+from factories import deployment
+from twyla.kubedeploy import labels
+from twyla.kubedeploy.labels import LabelIndex, Requirement
+
+
+def names(items):
+    return [i['metadata']['name'] for i in items]
+
+
+class SelectorTests(unittest.TestCase):
+
+    def test_parse_selector(self):
+        requirements = labels.parse_selector(
+            'servicegroup in (a, b),app!=web,tier=front,team,!legacy,'
+            'env notin (dev)')
+
+        assert requirements == [
+            Requirement('servicegroup', labels.IN, ('a', 'b')),
+            Requirement('app', labels.NOT_IN, ('web',)),
+            Requirement('tier', labels.IN, ('front',)),
+            Requirement('team', labels.EXISTS),
+            Requirement('legacy', labels.DOES_NOT_EXIST),
+            Requirement('env', labels.NOT_IN, ('dev',)),
+        ]
+
+
+    def test_parse_invalid_selector(self):
+        with pytest.raises(ValueError):
+            labels.parse_selector('app in a,b')
+
+
+    def test_requirements_of_dict(self):
+        assert labels.requirements_of({'app': 'web', 'group': ['a', 'b']}) == [
+            Requirement('app', labels.IN, ('web',)),
+            Requirement('group', labels.IN, ('a', 'b')),
+        ]
+        assert labels.requirements_of(None) == []
+
+
+class LabelIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LabelIndex([
+            deployment('one', labels={'servicegroup': 'a', 'app': 'web',
+                                      'team': 'bots'}),
+            deployment('two', labels={'servicegroup': 'b', 'app': 'api'}),
+            deployment('three', labels={'servicegroup': 'a', 'app': 'api',
+                                        'team': 'core'}),
+            deployment('four', labels={'app': 'worker'}),
+        ])
+
+
+    def test_equality(self):
+        assert names(self.index.select({'servicegroup': 'a'})) == [
+            'one', 'three']
+        assert names(self.index.select('app==api')) == ['two', 'three']
+
+
+    def test_in(self):
+        assert names(self.index.select('app in (web,worker)')) == [
+            'one', 'four']
+
+
+    def test_notin_matches_missing_keys(self):
+        assert names(self.index.select('servicegroup notin (a)')) == [
+            'two', 'four']
+        assert names(self.index.select('servicegroup!=b')) == [
+            'one', 'three', 'four']
+
+
+    def test_exists(self):
+        assert names(self.index.select('team')) == ['one', 'three']
+        assert names(self.index.select('!team')) == ['two', 'four']
+
+
+    def test_multiple_requirements(self):
+        assert names(self.index.select(
+            'servicegroup in (a,b),app=api,team')) == ['three']
+        assert self.index.select('servicegroup=a,app=worker') == []
+
+
+    def test_unknown_label(self):
+        assert self.index.select('nope=x') == []
+        assert len(self.index.select('!nope')) == 4
+
+
+    def test_no_selector(self):
+        assert len(self.index.select()) == 4
+        assert len(self.index.select({})) == 4
@@ -0,0 +1,94 @@
+import unittest
+
+from factories import deployment
+from twyla.kubedeploy import model
+from twyla.kubedeploy.model import Deployment
+
+
+def item(name, status=None):
+    return deployment(name, status=status,
+                      sidecars=[('sidecar', 'reg/sidecar:v2')])
+
+
+class DeploymentTests(unittest.TestCase):
+
+    def test_from_dict(self):
+        deployment = Deployment.from_dict(item('web', status={
+            'replicas': 3, 'readyReplicas': 2, 'updatedReplicas': 1}))
+
+        assert deployment.name == 'web'
+        assert deployment.namespace == 'twyla'
+        assert deployment.containers == (('web', 'reg/web:v1'),
+                                         ('sidecar', 'reg/sidecar:v2'))
+        assert deployment.images == ['reg/web:v1', 'reg/sidecar:v2']
+        assert deployment.labels == {'app': 'web', 'servicegroup': 'twyla'}
+        assert deployment.desired == 2
+        assert deployment.has_status
+        assert (deployment.replicas, deployment.ready,
+                deployment.updated) == (3, 2, 1)
+        assert deployment.current_replicas == 3
+
+
+    def test_from_dict_without_status(self):
+        deployment = Deployment.from_dict(item('web', status={}))
+
+        assert not deployment.has_status
+        assert (deployment.replicas, deployment.ready,
+                deployment.updated) == (None, 0, 0)
+        assert deployment.current_replicas == 2
+
+
+    def test_from_dict_omitted_counts(self):
+        # The API server leaves out counts that are zero.
+        deployment = Deployment.from_dict(item('web', status={'replicas': 1}))
+
+        assert deployment.has_status
+        assert deployment.ready == 0
+        assert deployment.updated == 0
+
+
+    def test_from_dict_without_replicas(self):
+        # The server has not counted the replicas yet.
+        deployment = Deployment.from_dict(item('web', status={
+            'observedGeneration': 1}))
+
+        assert deployment.has_status
+        assert deployment.replicas is None
+        assert deployment.current_replicas == 2
+
+
+    def test_from_dict_minimal(self):
+        deployment = Deployment.from_dict({'metadata': {'name': 'web'}})
+
+        assert deployment.namespace == 'default'
+        assert deployment.containers == ()
+        assert deployment.labels == {}
+        assert deployment.desired is None
+
+
+    def test_labels_are_interned(self):
+        one = Deployment.from_dict(item('one'))
+        two = Deployment.from_dict(item('two'))
+
+        assert list(one.labels)[1] is list(two.labels)[1]
+        assert one.labels['servicegroup'] is two.labels['servicegroup']
+
+
+    def test_summaries_consume(self):
+        items = [item('one'), item('two'), item('three')]
+
+        summaries = model.summaries(items)
+        assert next(summaries).name == 'one'
+        # Parsed items are released right away.
+        assert len(items) == 2
+        assert [d.name for d in summaries] == ['two', 'three']
+        assert items == []
+
+
+    def test_summaries_without_consume(self):
+        items = [item('one'), item('two')]
+
+        deployments = list(model.summaries(items, consume=False))
+
+        assert [d.name for d in deployments] == ['one', 'two']
+        assert len(items) == 2
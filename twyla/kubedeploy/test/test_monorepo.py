@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import git
+
+from twyla.kubedeploy import monorepo
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+
+
+def deployment_with_images(*images):
+    return {
+        'spec': {
+            'template': {
+                'spec': {
+                    'containers': [{'image': image} for image in images]
+                }
+            }
+        }
+    }
+
+
+class MonorepoTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.repo = git.Repo.init(self.root)
+        with self.repo.config_writer() as config:
+            config.set_value('user', 'name', 'Tester')
+            config.set_value('user', 'email', 'tester@example.com')
+        for service in ['service-one', 'service-two']:
+            self.write(os.path.join(service, 'kubedeploy.yml'),
+                       'image: {}\nnamespace: twyla\n'.format(service))
+            self.write(os.path.join(service, 'deployment.yml'), 'kind: List')
+        self.write('README.md', '# Monorepo')
+        self.first = self.commit()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+    def write(self, rel_path, content):
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w') as fd:
+            fd.write(content)
+
+
+    def commit(self):
+        self.repo.git.add('-A')
+        self.repo.index.commit('change')
+        return self.repo.git.rev_parse(self.repo.head.commit, short=8)
+
+
+    def test_find_services(self):
+        services = monorepo.find_services(self.root, 'kubedeploy.yml')
+
+        assert [os.path.basename(s.path) for s in services] == [
+            'service-one', 'service-two']
+        assert services[0].config == {'image': 'service-one',
+                                      'namespace': 'twyla'}
+
+
+    def test_deployed_version(self):
+        kube = mock.MagicMock()
+        kube.get_remote_deployment.return_value = deployment_with_images(
+            'nginx', 'myreg/service-one:abcd1234')
+
+        assert monorepo.deployed_version(kube, 'service-one') == 'abcd1234'
+        assert monorepo.deployed_version(kube, 'service-two') is None
+
+
+    def test_deployed_version_not_deployed(self):
+        kube = mock.MagicMock()
+        kube.get_remote_deployment.side_effect = KubectlCallFailed(b'nope')
+
+        assert monorepo.deployed_version(kube, 'service-one') is None
+
+
+    def test_service_changed(self):
+        self.write('service-one/app.py', 'print("changed")')
+        self.write('README.md', '# Changed docs')
+        second = self.commit()
+        one = os.path.join(self.root, 'service-one')
+        two = os.path.join(self.root, 'service-two')
+
+        assert monorepo.service_changed(self.repo, one, self.first, second)
+        assert not monorepo.service_changed(self.repo, two, self.first, second)
+        assert monorepo.service_changed(self.repo, two, None, second)
+        assert monorepo.service_changed(self.repo, two, 'c0ffee123456',
+                                        second)
+
+
+    @mock.patch('twyla.kubedeploy.monorepo.Kube')
+    def test_plan(self, mock_Kube):
+        self.write('service-two/app.py', 'print("changed")')
+        second = self.commit()
+        mock_Kube.return_value.get_remote_deployment.side_effect = [
+            deployment_with_images('myreg/service-one:' + self.first),
+            deployment_with_images('myreg/service-two:' + self.first),
+        ]
+
+        planned = monorepo.plan(self.root, second, 'kubedeploy.yml')
+
+        assert [p.changed for p in planned] == [False, True]
+        assert [p.deployed for p in planned] == [self.first, self.first]
+        mock_Kube.assert_has_calls([
+            mock.call(namespace='twyla', deployment_name='service-one',
+                      printer=mock.ANY, error_printer=mock.ANY),
+            mock.call(namespace='twyla', deployment_name='service-two',
+                      printer=mock.ANY, error_printer=mock.ANY),
+        ], any_order=True)
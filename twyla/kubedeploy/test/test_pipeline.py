@@ -0,0 +1,68 @@
+import threading
+import time
+import unittest
+import unittest.mock as mock
+
+import pytest
+
+from twyla.kubedeploy.pipeline import Pipeline
+
+
+class PipelineTests(unittest.TestCase):
+
+    def test_run_passes_results(self):
+        pipeline = Pipeline()
+        pipeline.add('one', lambda results: 1)
+        pipeline.add('two', lambda results: results['one'] + 1,
+                     requires=['one'])
+
+        results = pipeline.run()
+
+        assert results == {'one': 1, 'two': 2}
+
+
+    def test_independent_phases_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+        pipeline = Pipeline()
+        # Both phases can only pass the barrier if they run at the same time.
+        pipeline.add('one', lambda results: barrier.wait())
+        pipeline.add('two', lambda results: barrier.wait())
+        pipeline.add('three', lambda results: 'done', requires=['one', 'two'])
+
+        assert pipeline.run()['three'] == 'done'
+
+
+    def test_failure_stops_dependents(self):
+        dependent = mock.MagicMock()
+
+        def fail(results):
+            raise SystemExit(1)
+
+        pipeline = Pipeline()
+        pipeline.add('fail', fail)
+        pipeline.add('dependent', dependent, requires=['fail'])
+
+        with pytest.raises(SystemExit):
+            pipeline.run()
+        dependent.assert_not_called()
+
+
+    def test_unknown_requirement(self):
+        pipeline = Pipeline()
+        with pytest.raises(ValueError):
+            pipeline.add('one', lambda results: 1, requires=['missing'])
+
+
+    def test_critical_path(self):
+        pipeline = Pipeline()
+        pipeline.add('fast', lambda results: None)
+        pipeline.add('slow', lambda results: time.sleep(0.05))
+        pipeline.add('last', lambda results: None, requires=['fast', 'slow'])
+        pipeline.run()
+
+        assert pipeline.critical_path() == ['slow', 'last']
+
+        printer = mock.MagicMock()
+        pipeline.print_profile(printer)
+        printer.assert_called_with('critical path: slow -> last ({:.3f}s)'
+                                   .format(pipeline.timings['last'][1]), 2)
@@ -1,6 +1,9 @@
+import io
+import threading
 import unittest
 import unittest.mock as mock
-from twyla.kubedeploy.prompt import prompt, error_prompt
+from twyla.kubedeploy.prompt import (ThreadLocalStream, carry_output, prompt,
+                                     error_prompt)
 
 
 class TestPrompt(unittest.TestCase):
@@ -43,3 +46,19 @@ class TestPrompt(unittest.TestCase):
             mock.call.write('this is a test'),
             mock.call.write('\n')  # newline added by print()
         ])
+
+    def test_carry_output(self):
+        local = io.StringIO()
+        stream = ThreadLocalStream(io.StringIO())
+        stream.set(local)
+
+        with mock.patch('sys.stdout', stream):
+            thread = threading.Thread(target=carry_output(print),
+                                      args=('from a thread',))
+            thread.start()
+            thread.join()
+
+        assert local.getvalue() == 'from a thread\n'
+
+    def test_carry_output_without_thread_local_streams(self):
+        assert carry_output(print) is print
@@ -0,0 +1,143 @@
+import unittest
+import unittest.mock as mock
+
+from twyla.kubedeploy import ratelimit
+from twyla.kubedeploy.ratelimit import Backoff, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self):
+        return self.now
+
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+
+    def bucket(self, qps, burst):
+        return TokenBucket(qps=qps, burst=burst, clock=self.clock,
+                           sleep=self.clock.sleep)
+
+
+    def test_burst_is_free(self):
+        bucket = self.bucket(qps=2, burst=3)
+
+        for _ in range(3):
+            assert bucket.reserve() == 0
+
+        assert bucket.reserve() == 0.5
+
+
+    def test_refills_over_time(self):
+        bucket = self.bucket(qps=2, burst=2)
+        bucket.reserve(2)
+
+        self.clock.now += 0.5
+
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0.5
+
+
+    def test_refill_capped_at_burst(self):
+        bucket = self.bucket(qps=10, burst=2)
+
+        self.clock.now += 60
+
+        assert bucket.reserve(2) == 0
+        assert bucket.reserve() == 0.1
+
+
+    def test_reservations_queue_up(self):
+        bucket = self.bucket(qps=1, burst=1)
+
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 1
+        assert bucket.reserve() == 2
+
+
+    def test_acquire_sleeps(self):
+        bucket = self.bucket(qps=4, burst=1)
+
+        bucket.acquire()
+        bucket.acquire(3)
+
+        assert self.clock.now == 0.75
+
+
+    def test_unlimited(self):
+        sleep = mock.MagicMock()
+        bucket = TokenBucket(qps=0, sleep=sleep)
+
+        for _ in range(100):
+            bucket.acquire(10)
+
+        sleep.assert_not_called()
+
+
+class BackoffTests(unittest.TestCase):
+
+    def test_exponential_with_jitter(self):
+        backoff = Backoff(base=0.5, cap=3, jitter=lambda: 1.0)
+
+        assert [backoff.delay(a) for a in range(4)] == [0.5, 1.0, 2.0, 3.0]
+        assert Backoff(jitter=lambda: 0.5).delay(1) == 0.5
+
+
+    def test_retry_after(self):
+        backoff = Backoff(base=0.5, jitter=lambda: 0.5)
+
+        assert backoff.delay(3, after=2.0) == 2.25
+
+
+    def test_wait(self):
+        sleep = mock.MagicMock()
+        backoff = Backoff(base=1, jitter=lambda: 1.0, sleep=sleep)
+
+        backoff.wait(2)
+
+        sleep.assert_called_once_with(4)
+
+
+    def test_parse_stderr(self):
+        throttled = (b'Error from server (TooManyRequests): the server has '
+                     b'received too many requests and has asked us to try '
+                     b'again later (Retry-After: 2s)')
+
+        assert ratelimit.is_throttled(throttled)
+        assert ratelimit.retry_after(throttled) == 2.0
+        assert not ratelimit.is_throttled(b'Error from server (NotFound)')
+        assert ratelimit.retry_after(b'Error from server (NotFound)') is None
+        assert not ratelimit.is_throttled(None)
+
+
+    def test_configure_shared(self):
+        limiter = ratelimit.shared_limiter()
+        self.addCleanup(ratelimit.configure)
+
+        ratelimit.configure(qps=3, burst=7)
+
+        assert ratelimit.shared_limiter() is limiter
+        assert (limiter.qps, limiter.burst, limiter.tokens) == (3, 7, 7)
+
+
+    def test_configure_unchanged_keeps_tokens(self):
+        limiter = ratelimit.shared_limiter()
+        self.addCleanup(ratelimit.configure)
+        ratelimit.configure(qps=3, burst=7)
+        limiter.tokens = 2
+
+        ratelimit.configure(qps=3, burst=7)
+        assert limiter.tokens == 2
+
+        ratelimit.configure(qps=3, burst=8)
+        assert limiter.tokens == 8
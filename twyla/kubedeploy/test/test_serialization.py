@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from twyla.kubedeploy import serialization
+
+
+SNAPSHOT = {
+    'apiVersion': 'v1',
+    'kind': 'List',
+    'metadata': {},
+    'items': [
+        {
+            'apiVersion': 'apps/v1',
+            'kind': 'Deployment',
+            'metadata': {'name': 'service-{}'.format(i),
+                         'labels': {'servicegroup': 'twyla'}},
+            'spec': {'replicas': i, 'paused': False, 'selector': None},
+        } for i in range(3)
+    ],
+}
+
+
+class SerializationTests(unittest.TestCase):
+
+    def test_yaml_round_trip(self):
+        text = serialization.dump_yaml(SNAPSHOT)
+
+        assert text == yaml.dump(SNAPSHOT, default_flow_style=False)
+        assert serialization.load_yaml(text) == SNAPSHOT
+
+
+    def test_yaml_all_round_trip(self):
+        documents = SNAPSHOT['items']
+        text = serialization.dump_all_yaml(documents)
+
+        assert list(serialization.load_all_yaml(text)) == documents
+
+
+    def test_load_yaml_is_safe(self):
+        with self.assertRaises(serialization.YAMLError):
+            serialization.load_yaml('!!python/object/apply:os.system ["ls"]')
+
+
+    def test_loads_json_bytes(self):
+        raw = b'{"kind": "List", "items": [{"name": "\xc3\xa4"}]}'
+
+        assert serialization.loads_json(raw) == {
+            'kind': 'List', 'items': [{'name': 'ä'}]}
+
+
+    @mock.patch('twyla.kubedeploy.serialization.orjson', None)
+    def test_loads_json_without_orjson(self):
+        assert serialization.loads_json(b'{"replicas": 2}') == {'replicas': 2}
+
+
+    def test_benchmark(self):
+        results = serialization.benchmark(SNAPSHOT, rounds=1)
+
+        operations = set((operation, backend)
+                         for operation, backend, _ in results)
+        assert ('yaml load', 'python') in operations
+        assert ('yaml dump', 'python') in operations
+        assert ('json decode', 'json') in operations
+        assert all(elapsed >= 0 for _, _, elapsed in results)
+
+
+    @mock.patch('builtins.print')
+    def test_main(self, mock_print):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'snapshot.yml')
+        with open(path, mode='w') as fd:
+            fd.write(serialization.dump_yaml(SNAPSHOT))
+
+        serialization.main([path, '--rounds', '1'])
+
+        assert mock_print.call_args_list[0][0][0].startswith('3 items')
@@ -0,0 +1,190 @@
+import copy
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import yaml
+
+from factories import deployment
+from twyla.kubedeploy import delta, snapshot
+
+
+SCRUBBED_METADATA = {'labels': {'app': 'one', 'servicegroup': 'twyla'},
+                     'name': 'one',
+                     'namespace': 'twyla'}
+
+
+class SnapshotTests(unittest.TestCase):
+
+    def test_scrub_item_projection(self):
+        item = deployment('one')
+        original = copy.deepcopy(item)
+
+        scrubbed = snapshot.scrub_item(item)
+
+        assert item == original
+        assert 'status' not in scrubbed
+        assert scrubbed['metadata'] == SCRUBBED_METADATA
+        # Everything else is shared instead of copied.
+        assert scrubbed['spec'] is item['spec']
+
+
+    def test_scrub_item_in_place(self):
+        item = deployment('one')
+
+        scrubbed = snapshot.scrub_item(item, in_place=True)
+
+        assert scrubbed is item
+        assert 'status' not in item
+        assert item['metadata'] == SCRUBBED_METADATA
+
+
+    def test_scrub_items_in_place_consumes(self):
+        items = [deployment('one'), deployment('two')]
+
+        names = []
+        for item in snapshot.scrub_items(items, in_place=True):
+            names.append(item['metadata']['name'])
+            # Items that are handed out are no longer held by the list.
+            assert item not in items
+
+        assert names == ['one', 'two']
+        assert items == []
+
+
+    def test_scrub_cluster_info(self):
+        state = {'items': [deployment('one')]}
+
+        deployable = snapshot.scrub_cluster_info(state)
+
+        assert deployable['kind'] == 'List'
+        assert deployable['items'][0]['metadata'] == SCRUBBED_METADATA
+        assert 'status' in state['items'][0]
+
+
+    def test_write_list(self):
+        items = [snapshot.scrub_item(deployment(n)) for n in ['one', 'two']]
+        expected = yaml.dump({'apiVersion': 'v1', 'kind': 'List',
+                              'metadata': {}, 'items': items},
+                             default_flow_style=False)
+        fd = io.StringIO()
+
+        snapshot.write_list(fd, iter(items))
+
+        assert fd.getvalue() == expected
+
+
+    def test_write_list_empty(self):
+        expected = yaml.dump({'apiVersion': 'v1', 'kind': 'List',
+                              'metadata': {}, 'items': []},
+                             default_flow_style=False)
+        fd = io.StringIO()
+
+        snapshot.write_list(fd, iter([]))
+
+        assert fd.getvalue() == expected
+
+
+    def test_list_writer_flushes_items(self):
+        fd = mock.MagicMock(wraps=io.StringIO())
+
+        with snapshot.ListWriter(fd) as writer:
+            writer.write(snapshot.scrub_item(deployment('one')))
+            assert fd.flush.call_count == 1
+            writer.write(snapshot.scrub_item(deployment('two')))
+            assert fd.flush.call_count == 2
+
+        assert writer.count == 2
+
+
+    def test_list_writer_error(self):
+        fd = io.StringIO()
+
+        with self.assertRaises(RuntimeError):
+            with snapshot.ListWriter(fd) as writer:
+                writer.write(snapshot.scrub_item(deployment('one')))
+                raise RuntimeError('listing failed')
+
+        # An aborted dump is not closed as if it were complete.
+        assert 'kind: List' not in fd.getvalue()
+
+
+    def test_open_snapshot_gzip(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'demo.yml.gz')
+        items = [snapshot.scrub_item(deployment('one'))]
+
+        with snapshot.open_snapshot(path, mode='w') as fd:
+            snapshot.write_list(fd, items)
+
+        with gzip.open(path, mode='rt') as fd:
+            content = fd.read()
+        assert yaml.safe_load(content)['items'] == items
+        with snapshot.open_snapshot(path) as fd:
+            assert fd.read() == content
+
+
+    def test_open_snapshot_gzip_not_flushed_per_item(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'demo.yml.gz')
+        items = [snapshot.scrub_item(deployment('deployment-{}'.format(i)))
+                 for i in range(500)]
+
+        with snapshot.open_snapshot(path, mode='w') as fd:
+            snapshot.write_list(fd, items)
+
+        with gzip.open(path, mode='rb') as fd:
+            content = fd.read()
+        # Streaming compresses about as well as compressing all at once.
+        assert os.path.getsize(path) < len(gzip.compress(content)) * 1.1
+
+
+    def test_open_snapshot_plain(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        path = os.path.join(tmp, 'demo.yml')
+
+        with snapshot.open_snapshot(path, mode='w') as fd:
+            fd.write('kind: List\n')
+
+        with open(path) as fd:
+            assert fd.read() == 'kind: List\n'
+
+
+    def round_trip(self, suffix):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        base_path = os.path.join(tmp, 'base.yml' + suffix)
+        delta_path = os.path.join(tmp, 'delta.yml' + suffix)
+        base = [snapshot.scrub_item(deployment(n)) for n in ['one', 'two']]
+        items = [base[0], snapshot.scrub_item(deployment('three'))]
+
+        with snapshot.open_snapshot(base_path, mode='w') as fd:
+            snapshot.write_list(fd, base)
+        with snapshot.open_snapshot(delta_path, mode='w') as fd:
+            delta.write_delta(fd, delta.make_index(base), items)
+
+        assert delta.load_chain([base_path])['items'] == base
+        assert delta.load_chain([base_path, delta_path])['items'] == items
+
+
+    def test_round_trip_gzip(self):
+        self.round_trip('.gz')
+
+
+    @unittest.skipIf(snapshot.zstandard is None,
+                     'zstandard is not installed')
+    def test_round_trip_zstd(self):
+        self.round_trip('.zst')
+
+
+    @mock.patch('twyla.kubedeploy.snapshot.zstandard', None)
+    def test_open_snapshot_zstd_unavailable(self):
+        with self.assertRaises(snapshot.CompressionUnavailable):
+            snapshot.open_snapshot('demo.yml.zst', mode='w')
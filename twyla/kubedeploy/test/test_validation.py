@@ -0,0 +1,167 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock as mock
+
+import pytest
+
+from twyla.kubedeploy import validation
+
+# A tiny excerpt of the OpenAPI schema of a cluster.
+DEFINITIONS = {
+    'io.k8s.api.apps.v1.Deployment': {
+        'properties': {
+            'apiVersion': {'type': 'string'},
+            'kind': {'type': 'string'},
+            'metadata': {
+                '$ref': '#/definitions/io.k8s.apimachinery.pkg.apis.meta.v1.'
+                        'ObjectMeta'},
+            'spec': {'$ref': '#/definitions/io.k8s.api.apps.v1.'
+                             'DeploymentSpec'},
+        },
+        'x-kubernetes-group-version-kind': [
+            {'group': 'apps', 'kind': 'Deployment', 'version': 'v1'}],
+    },
+    'io.k8s.api.apps.v1.DeploymentSpec': {
+        'properties': {
+            'replicas': {'type': 'integer'},
+            'maxSurge': {'$ref': '#/definitions/io.k8s.apimachinery.pkg.util.'
+                                 'intstr.IntOrString'},
+        },
+    },
+    'io.k8s.apimachinery.pkg.apis.meta.v1.ObjectMeta': {
+        'properties': {
+            'name': {'type': 'string'},
+            'creationTimestamp': {'type': 'string', 'format': 'date-time'},
+        },
+    },
+    'io.k8s.apimachinery.pkg.util.intstr.IntOrString': {
+        'type': 'string', 'format': 'int-or-string'},
+    'io.k8s.api.core.v1.Service': {
+        'properties': {'apiVersion': {'type': 'string'},
+                       'kind': {'type': 'string'}},
+        'x-kubernetes-group-version-kind': [
+            {'group': '', 'kind': 'Service', 'version': 'v1'}],
+    },
+}
+
+SCHEMA = {
+    'version': 'v1.10.0',
+    'definitions': validation.prepare_definitions(DEFINITIONS),
+}
+
+VALID = '''
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: test-service
+  creationTimestamp: null
+spec:
+  replicas: 2
+  maxSurge: 1
+---
+apiVersion: v1
+kind: Service
+'''
+
+INVALID = '''
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: test-service
+spec:
+  replicas: two
+  replica: 2
+'''
+
+
+@pytest.mark.skipif(validation.jsonschema is None,
+                    reason='jsonschema is not installed')
+class ValidationTests(unittest.TestCase):
+
+    def test_validate_manifest(self):
+        validator = validation.ManifestValidator(SCHEMA)
+        assert validator.validate_manifest(VALID) == []
+
+
+    def test_validate_manifest_errors(self):
+        validator = validation.ManifestValidator(SCHEMA)
+        errors = validator.validate_manifest(INVALID)
+
+        assert len(errors) == 2
+        assert any('spec: Additional properties are not allowed' in e
+                   for e in errors)
+        assert any(e.startswith('Deployment/test-service: spec.replicas:')
+                   for e in errors)
+
+
+    def test_validate_unknown_kind(self):
+        validator = validation.ManifestValidator(SCHEMA)
+        errors = validator.validate_manifest(
+            'apiVersion: extensions/v1beta1\nkind: Deployment\n'
+            'metadata:\n  name: old\n')
+
+        assert errors == ['Deployment/old: unknown apiVersion '
+                          'extensions/v1beta1 for kind Deployment in v1.10.0']
+
+
+    def test_validate_invalid_yaml(self):
+        validator = validation.ManifestValidator(SCHEMA)
+        errors = validator.validate_manifest('kind: [Deployment')
+
+        assert errors[0].startswith('invalid YAML')
+
+
+    def test_validators_are_reused(self):
+        validator = validation.ManifestValidator(SCHEMA)
+        validator.validate_manifest(VALID)
+        first = validator.validator('apps/v1', 'Deployment')
+        validator.validate_manifest(VALID)
+
+        assert validator.validator('apps/v1', 'Deployment') is first
+
+
+class SchemaCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.kubectl = mock.MagicMock()
+        self.kubectl.current_context.return_value = 'test-context'
+        self.kubectl.server_version.return_value = 'v1.10.0'
+        self.kubectl.get_raw.return_value = {'definitions': DEFINITIONS}
+
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+    def test_load_schema_fetches_once(self):
+        first = validation.load_schema(self.kubectl, cache_dir=self.cache_dir)
+        second = validation.load_schema(self.kubectl, cache_dir=self.cache_dir)
+
+        assert first == second == SCHEMA
+        self.kubectl.get_raw.assert_called_once_with('/openapi/v2')
+        with open(os.path.join(self.cache_dir, 'test-context.json')) as fd:
+            assert json.load(fd)['version'] == 'v1.10.0'
+
+
+    def test_load_schema_update(self):
+        validation.load_schema(self.kubectl, cache_dir=self.cache_dir)
+        validation.load_schema(self.kubectl, cache_dir=self.cache_dir,
+                               update=True)
+
+        assert self.kubectl.get_raw.call_count == 2
+
+
+    def test_prepare_definitions(self):
+        prepared = validation.prepare_definitions(DEFINITIONS)
+
+        assert prepared['io.k8s.api.apps.v1.DeploymentSpec'][
+            'additionalProperties'] is False
+        assert prepared['io.k8s.apimachinery.pkg.util.intstr.IntOrString'] \
+            == {'type': ['string', 'integer']}
+        # The original definitions are left alone.
+        assert 'additionalProperties' not in DEFINITIONS[
+            'io.k8s.api.apps.v1.DeploymentSpec']
@@ -0,0 +1,169 @@
+import subprocess
+import unittest
+import unittest.mock as mock
+
+from factories import deployment
+from twyla.kubedeploy import watch
+from twyla.kubedeploy.kubectl import KubectlCallFailed
+
+
+def event(kind, item):
+    return {'type': kind, 'object': item}
+
+
+class ModelTests(unittest.TestCase):
+
+    def setUp(self):
+        self.model = watch.DeploymentModel()
+        list(self.model.apply('twyla', event(
+            watch.RELISTED, [deployment('one'), deployment('two')])))
+
+
+    def test_row_of(self):
+        row = watch.row_of({'metadata': {'name': 'new'}})
+
+        assert row == watch.Row('default', 'new', 0, 0, 0)
+        assert watch.format_row(row) == (
+            'default/new  replicas: 0 ready: 0 updated: 0')
+
+
+    def test_relist_reports_all_rows(self):
+        model = watch.DeploymentModel()
+
+        changes = list(model.apply('twyla', event(
+            watch.RELISTED, [deployment('one'), deployment('two')])))
+
+        assert [(row.name, deleted) for row, deleted in changes] == [
+            ('one', False), ('two', False)]
+
+
+    def test_unchanged_counts_not_reported(self):
+        changes = list(self.model.apply('twyla', event(
+            watch.MODIFIED, deployment('one', version='2'))))
+
+        assert changes == []
+
+
+    def test_changed_counts_reported(self):
+        changes = list(self.model.apply('twyla', event(
+            watch.MODIFIED, deployment('one', ready=1))))
+
+        assert changes == [(watch.Row('twyla', 'one', 2, 1, 2), False)]
+        assert self.model.rows[('twyla', 'one')].ready == 1
+
+
+    def test_deleted(self):
+        changes = list(self.model.apply('twyla', event(
+            watch.DELETED, deployment('two'))))
+
+        assert changes == [(watch.Row('twyla', 'two', 2, 2, 2), True)]
+        assert list(self.model.apply('twyla', event(
+            watch.DELETED, deployment('two')))) == []
+
+
+    def test_relist_removes_missing_in_scope(self):
+        list(self.model.apply('other', event(
+            watch.RELISTED, [deployment('one', namespace='other')])))
+
+        changes = list(self.model.apply('twyla', event(
+            watch.RELISTED, [deployment('one')])))
+
+        assert changes == [(watch.Row('twyla', 'two', 2, 2, 2), True)]
+        assert ('other', 'one') in self.model.rows
+
+
+class DeploymentWatchTests(unittest.TestCase):
+
+    def test_watch_path(self):
+        path = watch.watch_path('twyla', {'servicegroup': ['a', 'b']}, '42')
+
+        assert path == ('/apis/apps/v1/namespaces/twyla/deployments?watch=1&'
+                        'resourceVersion=42&allowWatchBookmarks=true&'
+                        'labelSelector=servicegroup+in+%28a%2Cb%29')
+        assert watch.watch_path(None, None, '1').startswith(
+            '/apis/apps/v1/deployments?')
+
+
+    @mock.patch('twyla.kubedeploy.watch.Kubectl')
+    def test_run(self, mock_Kubectl):
+        kubectl = mock_Kubectl.return_value
+        kubectl.list_deployments.return_value = {
+            'metadata': {'resourceVersion': '10'},
+            'items': [deployment('one')],
+        }
+        kubectl.watch_raw.return_value = (e for e in [
+            event(watch.MODIFIED, deployment('one', version='11')),
+            event(watch.MODIFIED, deployment('one', ready=1, version='12')),
+        ])
+        watcher = watch.DeploymentWatch(['twyla'], ['twyla'])
+        changes = []
+
+        def on_change(row, deleted):
+            changes.append((row, deleted))
+            if len(changes) == 2:
+                watcher.stop()
+
+        watcher.run(on_change)
+
+        assert changes == [(watch.Row('twyla', 'one', 2, 2, 2), False),
+                           (watch.Row('twyla', 'one', 2, 1, 2), False)]
+        # Exactly one list, the watch continues from its resource version.
+        kubectl.list_deployments.assert_called_once_with(
+            selectors={'servicegroup': 'twyla'}, all_namespaces=False)
+        path = kubectl.watch_raw.call_args_list[0][0][0]
+        assert 'resourceVersion=10' in path
+
+
+    def test_stream_relists_on_error(self):
+        kubectl = mock.MagicMock()
+        closed = []
+
+        def list_deployments(**kwargs):
+            # The expired watch was ended before listing again.
+            assert closed == [True]
+            return {'metadata': {'resourceVersion': '20'}, 'items': []}
+
+        kubectl.list_deployments.side_effect = list_deployments
+        watcher = watch.DeploymentWatch(['twyla'], ['twyla'],
+                                        backoff=mock.MagicMock(retries=3))
+        watcher.kubectl = lambda scope: kubectl
+
+        def watch_raw(path, on_start):
+            if 'resourceVersion=1&' in path:
+                try:
+                    yield event(watch.ERROR, {'code': 410})
+                except GeneratorExit:
+                    closed.append(True)
+                    raise
+            # The stream continues from the new list.
+            assert 'resourceVersion=20&' in path
+            raise KubectlCallFailed(b'connection reset')
+
+        kubectl.watch_raw.side_effect = watch_raw
+        watcher.backoff.wait.side_effect = lambda attempt: watcher.stop()
+
+        watcher.stream('twyla', '1')
+
+        scope, relisted = watcher.events.get_nowait()
+        assert relisted['type'] == watch.RELISTED
+        watcher.backoff.wait.assert_called_once_with(0)
+
+
+    def test_stop_kills_streams(self):
+        watcher = watch.DeploymentWatch(['twyla'], ['twyla'])
+        proc = subprocess.Popen(['sleep', '30'])
+        watcher.started('twyla', proc)
+
+        watcher.stop()
+
+        assert proc.wait(5) != 0
+
+
+    def test_started_after_stop(self):
+        watcher = watch.DeploymentWatch(['twyla'], ['twyla'])
+        watcher.stop()
+        proc = subprocess.Popen(['sleep', '30'])
+
+        watcher.started('twyla', proc)
+
+        assert proc.wait(5) != 0
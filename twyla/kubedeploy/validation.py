@@ -0,0 +1,151 @@
+import json
+import os
+from typing import List
+
+try:
+    import jsonschema
+except ImportError:
+    # Validation is optional, install with the validation extra to enable it.
+    jsonschema = None
+
+from twyla.kubedeploy import serialization
+from twyla.kubedeploy.kube import CACHE_DIR, split_documents
+from twyla.kubedeploy.kubectl import Kubectl
+
+SCHEMA_CACHE_DIR = os.path.join(CACHE_DIR, 'openapi')
+GVK = 'x-kubernetes-group-version-kind'
+
+# Definitions the API server accepts in more than the declared form, e.g.
+# maxSurge: 1 as well as maxSurge: 50%.
+LENIENT_DEFINITIONS = {
+    'io.k8s.apimachinery.pkg.util.intstr.IntOrString': {
+        'type': ['string', 'integer']},
+    'io.k8s.apimachinery.pkg.api.resource.Quantity': {
+        'type': ['string', 'integer', 'number']},
+}
+
+
+class ValidationUnavailable(Exception):
+    pass
+
+
+def prepare_definitions(definitions: dict) -> dict:
+    '''
+    prepare_definitions turns the definitions of the OpenAPI schema of a
+    cluster into JSON schemas that reject unknown fields like the API server
+    does.
+    '''
+    prepared = {}
+    for name, definition in definitions.items():
+        if name in LENIENT_DEFINITIONS:
+            definition = dict(LENIENT_DEFINITIONS[name])
+        elif 'properties' in definition:
+            definition = dict(definition, additionalProperties=False)
+        prepared[name] = definition
+
+    return prepared
+
+
+def fetch_schema(kubectl: Kubectl) -> dict:
+    spec = kubectl.get_raw('/openapi/v2')
+    return {
+        'version': kubectl.server_version(),
+        'definitions': prepare_definitions(spec['definitions']),
+    }
+
+
+def load_schema(kubectl: Kubectl, cache_dir: str=SCHEMA_CACHE_DIR,
+                update: bool=False) -> dict:
+    '''
+    load_schema returns the OpenAPI schema of the current context from the
+    cache and only fetches it from the cluster if it is not cached yet or an
+    update is requested.
+    '''
+    cache_file = os.path.join(cache_dir,
+                              '{}.json'.format(kubectl.current_context()))
+    if not update and os.path.isfile(cache_file):
+        with open(cache_file, mode='rb') as fd:
+            return serialization.loads_json(fd.read())
+
+    schema = fetch_schema(kubectl)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_file, mode='w') as fd:
+        json.dump(schema, fd)
+
+    return schema
+
+
+def strip_nulls(value):
+    # The API server treats null the same as a missing field.
+    if isinstance(value, dict):
+        return {k: strip_nulls(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [strip_nulls(v) for v in value]
+    return value
+
+
+class ManifestValidator:
+    def __init__(self, schema: dict):
+        if jsonschema is None:
+            raise ValidationUnavailable('jsonschema is not installed')
+
+        self.version = schema['version']
+        self.definitions = schema['definitions']
+        self.kinds = {}
+        for name, definition in self.definitions.items():
+            for gvk in definition.get(GVK, []):
+                api_version = gvk['version']
+                if gvk['group']:
+                    api_version = '{}/{}'.format(gvk['group'], api_version)
+                self.kinds[(api_version, gvk['kind'])] = name
+        self.validators = {}
+
+
+    @classmethod
+    def for_cluster(cls, kubectl: Kubectl, update: bool=False):
+        if jsonschema is None:
+            raise ValidationUnavailable('jsonschema is not installed')
+        return cls(load_schema(kubectl, update=update))
+
+
+    def validator(self, api_version: str, kind: str):
+        # Validators are built once per kind and reused for every document.
+        key = (api_version, kind)
+        if key not in self.validators:
+            schema = {
+                '$ref': '#/definitions/{}'.format(self.kinds[key]),
+                'definitions': self.definitions,
+            }
+            self.validators[key] = jsonschema.Draft4Validator(schema)
+        return self.validators[key]
+
+
+    def validate(self, document: dict) -> List[str]:
+        api_version = document.get('apiVersion')
+        kind = document.get('kind')
+        name = document.get('metadata', {}).get('name')
+        if (api_version, kind) not in self.kinds:
+            return ['{}/{}: unknown apiVersion {} for kind {} in {}'.format(
+                kind, name, api_version, kind, self.version)]
+
+        errors = []
+        validator = self.validator(api_version, kind)
+        for error in validator.iter_errors(strip_nulls(document)):
+            path = '.'.join(str(p) for p in error.absolute_path)
+            errors.append('{}/{}: {}: {}'.format(kind, name, path or '.',
+                                                 error.message))
+
+        return errors
+
+
+    def validate_manifest(self, manifest: str) -> List[str]:
+        try:
+            documents = split_documents(manifest)
+        except serialization.YAMLError as e:
+            return ['invalid YAML: {}'.format(e)]
+
+        errors = []
+        for document in documents:
+            errors.extend(self.validate(document))
+
+        return errors
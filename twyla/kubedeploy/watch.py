@@ -0,0 +1,223 @@
+import contextlib
+import functools
+import queue
+import subprocess
+import threading
+import urllib.parse
+from collections import OrderedDict
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from twyla.kubedeploy.cluster import group_selector
+from twyla.kubedeploy.kubectl import (Kubectl, KubectlCallFailed,
+                                      selector_string)
+from twyla.kubedeploy.ratelimit import Backoff
+
+ADDED = 'ADDED'
+MODIFIED = 'MODIFIED'
+DELETED = 'DELETED'
+ERROR = 'ERROR'
+# Not sent by the API server, marks a fresh list of a scope.
+RELISTED = 'RELISTED'
+
+
+class Row(NamedTuple):
+    namespace: str
+    name: str
+    replicas: int
+    ready: int
+    updated: int
+
+
+def row_of(item: dict) -> Row:
+    metadata = item['metadata']
+    status = item.get('status') or {}
+    return Row(namespace=metadata.get('namespace', 'default'),
+               name=metadata['name'],
+               replicas=status.get('replicas', 0),
+               ready=status.get('readyReplicas', 0),
+               updated=status.get('updatedReplicas', 0))
+
+
+def kill(proc: subprocess.Popen):
+    if proc.poll() is None:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+
+
+def format_row(row: Row) -> str:
+    return '{}/{}  replicas: {} ready: {} updated: {}'.format(
+        row.namespace, row.name, row.replicas, row.ready, row.updated)
+
+
+def watch_path(namespace: Optional[str], selectors: dict,
+               resource_version: str, timeout: int=None) -> str:
+    scope = '/namespaces/{}'.format(namespace) if namespace else ''
+    query = [('watch', '1'), ('resourceVersion', resource_version),
+             ('allowWatchBookmarks', 'true')]
+    selector = selector_string(selectors)
+    if selector:
+        query.append(('labelSelector', selector))
+    if timeout is not None:
+        # The server ends the watch after timeout seconds.
+        query.append(('timeoutSeconds', str(timeout)))
+    return '/apis/apps/v1{}/deployments?{}'.format(
+        scope, urllib.parse.urlencode(query))
+
+
+class DeploymentModel:
+    '''
+    DeploymentModel keeps the rows of the watched deployments and reports
+    which of them changed with every event. Only changes of the replica
+    counts are reported.
+    '''
+    def __init__(self):
+        self.rows = OrderedDict()
+
+
+    def in_scope(self, row: Row, scope: Optional[str]) -> bool:
+        return scope is None or row.namespace == scope
+
+
+    def key(self, row: Row) -> Tuple[str, str]:
+        return (row.namespace, row.name)
+
+
+    def apply(self, scope: Optional[str],
+              event: dict) -> Iterator[Tuple[Row, bool]]:
+        '''
+        apply updates the model with event and yields the changed rows and
+        whether they were deleted.
+        '''
+        kind = event.get('type')
+        if kind == RELISTED:
+            rows = [row_of(item) for item in event['object']]
+            current = set(self.key(row) for row in rows)
+            for key, row in list(self.rows.items()):
+                if self.in_scope(row, scope) and key not in current:
+                    del self.rows[key]
+                    yield row, True
+            for row in rows:
+                yield from self.update(row)
+        elif kind in (ADDED, MODIFIED):
+            yield from self.update(row_of(event['object']))
+        elif kind == DELETED:
+            row = self.rows.pop(self.key(row_of(event['object'])), None)
+            if row is not None:
+                yield row, True
+
+
+    def update(self, row: Row) -> Iterator[Tuple[Row, bool]]:
+        if self.rows.get(self.key(row)) != row:
+            self.rows[self.key(row)] = row
+            yield row, False
+
+
+class DeploymentWatch:
+    '''
+    DeploymentWatch lists the deployments of every scope once and then
+    follows a single watch stream per scope, starting at the resource
+    version of the list. A scope is a namespace, or None for all namespaces.
+    Streams run in threads and hand their events to the caller's thread,
+    which owns the model. When the resource version of a stream expired,
+    the scope is listed again and the stream resumes from there.
+    '''
+    def __init__(self, namespaces: List[str], groups: List[str],
+                 all_namespaces: bool=False, backoff: Backoff=None):
+        self.selectors = group_selector(groups)
+        self.scopes = [None] if all_namespaces else list(namespaces)
+        self.model = DeploymentModel()
+        self.events = queue.Queue()
+        self.stopped = threading.Event()
+        self.backoff = backoff or Backoff()
+        self.processes = {}
+        self.lock = threading.Lock()
+
+
+    def kubectl(self, scope: Optional[str]) -> Kubectl:
+        kubectl = Kubectl()
+        kubectl.namespace = scope
+        return kubectl
+
+
+    def relist(self, kubectl: Kubectl, scope: Optional[str]) -> str:
+        state = kubectl.list_deployments(selectors=self.selectors,
+                                         all_namespaces=scope is None)
+        self.events.put((scope, {'type': RELISTED,
+                                 'object': state['items']}))
+        return state['metadata']['resourceVersion']
+
+
+    def started(self, scope: Optional[str], proc: subprocess.Popen):
+        with self.lock:
+            self.processes[scope] = proc
+            stopped = self.stopped.is_set()
+        if stopped:
+            kill(proc)
+
+
+    def stream(self, scope: Optional[str], resource_version: str):
+        kubectl = self.kubectl(scope)
+        on_start = functools.partial(self.started, scope)
+        attempt = 0
+        while not self.stopped.is_set():
+            path = watch_path(scope, self.selectors, resource_version)
+            expired = False
+            try:
+                events = kubectl.watch_raw(path, on_start=on_start)
+                with contextlib.closing(events):
+                    for event in events:
+                        if self.stopped.is_set():
+                            return
+                        attempt = 0
+                        if event.get('type') == ERROR:
+                            # Usually 410 Gone: the resource version is too
+                            # old to resume from.
+                            expired = True
+                            break
+                        resource_version = event['object']['metadata'][
+                            'resourceVersion']
+                        self.events.put((scope, event))
+                if expired:
+                    # The watch was closed above, which ends its kubectl.
+                    resource_version = self.relist(kubectl, scope)
+            except KubectlCallFailed:
+                if self.stopped.is_set():
+                    return
+                # The connection broke. Resume from the last event seen.
+                self.backoff.wait(attempt)
+                attempt = min(attempt + 1, self.backoff.retries)
+
+
+    def run(self, on_change: Callable[[Row, bool], None]):
+        '''
+        run lists and watches until stopped is set, calling on_change for
+        every row that changed.
+        '''
+        versions = {}
+        for scope in self.scopes:
+            versions[scope] = self.relist(self.kubectl(scope), scope)
+
+        for scope, resource_version in versions.items():
+            threading.Thread(target=self.stream,
+                             args=(scope, resource_version),
+                             daemon=True).start()
+
+        while not self.stopped.is_set():
+            try:
+                scope, event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            for row, deleted in self.model.apply(scope, event):
+                on_change(row, deleted)
+
+
+    def stop(self):
+        '''
+        stop ends the watch. The kubectl processes of the streams are killed,
+        so that their threads do not wait for the next event.
+        '''
+        with self.lock:
+            self.stopped.set()
+            processes = list(self.processes.values())
+        for proc in processes:
+            kill(proc)